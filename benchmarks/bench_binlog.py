@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""Compares the size and load time of a day of text and binary logs.
+
+Logs a day of readings from a set of 1-wire sensors and a heatmiser
+network to both formats, then loads one sensor back from each.
+
+usage: python benchmarks/bench_binlog.py [sensors] [interval]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import binlog
+from datalogger import LocalDatalogger
+
+DAY = 19000
+
+def folder_size(folder):
+    """Total bytes in a folder"""
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+
+def write_day(logger, sensors, stats, interval):
+    """Log a day of random walk readings"""
+    rand = random.Random(1)
+    temps = dict((sensor, 20.0) for sensor in sensors)
+    for read_time in range(DAY * 86400, (DAY + 1) * 86400, interval):
+        logger.log_heatmiser(read_time, [rand.randint(15, 25) for _ in range(stats)],
+                                [rand.randint(0, 1) for _ in range(stats)], 1)
+        for sensor in sensors:
+            temps[sensor] += rand.uniform(-0.1, 0.1)
+            logger.log_sensor(read_time, sensor, temps[sensor])
+    logger.close()
+
+def load_text(folder, sensor):
+    """Parse one sensor out of a text log, as a script would"""
+    times, values = [], []
+    with open(os.path.join(folder, 'testlog%s.txt' % float(DAY))) as logfile:
+        for line in logfile:
+            parts = line.rstrip('\n').split(':')
+            if len(parts) == 3 and parts[1] == sensor:
+                times.append(int(parts[0]))
+                values.append(float(parts[2]))
+    return times, values
+
+def timed(function):
+    """Best of three wall clock seconds"""
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    """Write both formats and print the comparison."""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    interval = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    sensors = ['/28.%012X' % index for index in range(count)]
+    textfolder = tempfile.mkdtemp()
+    binfolder = tempfile.mkdtemp()
+    try:
+        write_day(LocalDatalogger(textfolder), sensors, 8, interval)
+        write_day(binlog.BinaryDatalogger(binfolder), sensors, 8, interval)
+        textsize = folder_size(textfolder)
+        binsize = folder_size(binfolder)
+        print("%d sensors every %d s" % (count, interval))
+        print("  text   %9d bytes" % textsize)
+        print("  binary %9d bytes, %.1fx smaller" % (binsize, textsize / binsize))
+
+        texttime = timed(lambda: load_text(textfolder, sensors[0]))
+        bintime = timed(lambda: binlog.read_range(binfolder, DAY * 86400, (DAY + 1) * 86400,
+                                                    [sensors[0]]))
+        print("  load one sensor, text %.1f ms, binary %.1f ms, %.1fx faster"
+                % (texttime * 1000, bintime * 1000, texttime / bintime))
+    finally:
+        shutil.rmtree(textfolder)
+        shutil.rmtree(binfolder)
+
+if __name__ == "__main__":
+    main()
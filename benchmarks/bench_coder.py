@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+"""Micro-benchmark of emonhub_coder frame encoding and decoding.
+
+Compares building a node frame one value at a time with encode/decode, as
+the reporters used to, against the batch encode_frame/decode_many calls.
+
+usage: python benchmarks/bench_coder.py
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import emonhub_coder
+
+def frame_per_value(node, values):
+    """Original per sensor encode and join"""
+    outputstr = node
+    for value in values:
+        outputstr += ' ' + ' '.join(map(str, emonhub_coder.encode("h", value)))
+    return outputstr
+
+def decode_per_value(payload):
+    """Decode two bytes at a time"""
+    return [emonhub_coder.decode("h", payload[index:index + 2])
+                for index in range(0, len(payload), 2)]
+
+def report(label, function, number):
+    """Time function and print microseconds per call"""
+    seconds = min(timeit.repeat(function, number=number, repeat=5))
+    print("%-34s %8.2f us" % (label, seconds / number * 1e6))
+    return seconds
+
+def main():
+    """Run the benchmarks for a range of frame sizes."""
+    for count in (16, 64, 256):
+        values = [215 + index % 50 for index in range(count)]
+        payload = list(bytearray(emonhub_coder.encode_many("h", values)))
+        assert frame_per_value('18', values) == emonhub_coder.encode_frame('18', "h", values)
+        number = 20000 // count
+
+        print("%d values" % count)
+        before = report("  encode per value", lambda: frame_per_value('18', values), number)
+        after = report("  encode_frame", lambda: emonhub_coder.encode_frame('18', "h", values),
+                        number)
+        print("  speed up %.1fx" % (before / after))
+        before = report("  decode per value", lambda: decode_per_value(payload), number)
+        after = report("  decode_many", lambda: emonhub_coder.decode_many("h", payload), number)
+        print("  speed up %.1fx" % (before / after))
+        if emonhub_coder.numpy is not None:
+            array = emonhub_coder.numpy.array(values)
+            report("  encode_many numpy", lambda: emonhub_coder.encode_many("h", array), number)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+"""Benchmark of the whole rept_1wire_hmv2 sampling cycle.
+
+Runs sample_cycle against a fake owserver on a local TCP port, a simulated
+heatmiser network with a delay per frame and a local emonhub sink, and
+reports cycle time, time per stage, CPU, memory allocated and throughput
+for each number of sensors.
+
+Sensor values can be replayed from a recorded daily text log with
+--replay, the 1-wire sensors in the log being shared round the simulated
+ones. The 1-wire conversion wait defaults to 0 so the time is all spent
+in the reporter's own code; --conversion 0.75 gives real cycle times.
+--binary sends to a binary frame receiver in place of the text sink.
+
+usage: python benchmarks/bench_pipeline.py [--sensors 16 64 256] [--cycles 20]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import pyownet
+
+import cycle_timer
+import logquery
+import scheduler
+import rept_1wire_hmv2 as rept
+from datalogger import BufferedDatalogger
+from emonhub_receiver import BinaryFrameReceiver
+from fakes import FakeOwserver, FakeHeatmiserNetwork, EmonhubSink
+
+class BenchSetup(object):
+    """Settings in the shape rept_1wire_hmv2 reads them from its config file"""
+    def __init__(self, owport, sinkport, logfolder, workers, binary):
+        self.settings = {
+            '1wire': {'owport': owport, 'read_workers': workers, 'read_timeout': 1},
+            'emonsocket': {'host': '127.0.0.1', 'port': sinkport, 'node': '18', 'hmnode': '27',
+                           'temperaturenull': -10, 'timestamped': True, 'binary': binary,
+                           'spool_folder': os.path.join(logfolder, 'spool')},
+            'logging': {'logfolder': logfolder},
+        }
+
+def load_replay(path):
+    """Recorded 1-wire values from a text log, as a list of per cycle value lists"""
+    cycles = {}
+    with open(path) as logfile:
+        for line in logfile:
+            parsed = logquery.parse_line(line)
+            if parsed is None:
+                continue
+            read_time, values = parsed
+            cycles.setdefault(read_time, []).extend(value for sensor, value in values
+                                                    if sensor.startswith('/'))
+    return [values for _, values in sorted(cycles.items()) if values]
+
+def percentile(values, fraction):
+    """Value below which fraction of values fall"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def run(count, args, replay):
+    """Benchmark count sensors, returning a dictionary of results"""
+    sensors = ['/28.%012X' % index for index in range(count)]
+    # sensors shared between the buses, each with its own owserver
+    owservers = [FakeOwserver(dict((sensor, 20.0) for sensor in sensors[bus::args.buses]),
+                              args.read_latency) for bus in range(args.buses)]
+    sink = BinaryFrameReceiver() if args.binary else EmonhubSink()
+    logfolder = tempfile.mkdtemp()
+
+    rept.setup = BenchSetup(owservers[0].port, sink.port, logfolder, args.workers, args.binary)
+    rept.CONVERSION_TIME = args.conversion
+    rept.heatmiser_interval = 0
+    rept.datalogger = BufferedDatalogger(logfolder)
+    rept.onewirebuses = []
+    for bus, owserver in enumerate(owservers):
+        ownet = pyownet.protocol.proxy(host='127.0.0.1', port=owserver.port, persistent=True)
+        rept.onewirebuses.append(rept.OneWireBus(str(bus), ownet, sensors[bus::args.buses],
+                                                 rept.initialise_1wire_pool(ownet), '18'))
+    rept.hmn = FakeHeatmiserNetwork(args.stats, args.frame_latency, args.dead_stats,
+                                    args.stat_timeout)
+    rept.hmpoller = rept.initialise_heatmiser_poller(rept.hmn, {
+        'heatmiser_tiered': not args.untiered, 'heatmiser_backoff': args.backoff})
+    rept.emonhub = rept.initialise_emonhub(rept.setup.settings['emonsocket'], logfolder)
+    rept.cycletimer = cycle_timer.CycleTimer()
+    rept.reportpolicy = rept.initialise_report_policy(
+        {'deadband': args.deadband, 'heartbeat': args.heartbeat}, 10, 'bench%d' % count)
+    rept.sampletimer = scheduler.Timer(0, 10, None, ())
+
+    def cycle(number):
+        if replay:
+            values = replay[number % len(replay)]
+            for index, sensor in enumerate(sensors):
+                owservers[index % args.buses].sensors[sensor] = values[index % len(values)]
+        rept.sample_cycle()
+
+    try:
+        cycle(0) # connections and first use costs
+        busbytes = rept.hmpoller.bus_bytes
+        walls, cpus, stages = [], [], {}
+        for number in range(args.cycles):
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            cycle(number)
+            cpus.append(time.process_time() - cpu_start)
+            walls.append(time.perf_counter() - wall_start)
+            for stage, seconds in rept.cycletimer.stages.items():
+                stages[stage] = stages.get(stage, 0.0) + seconds
+
+        busbytes = rept.hmpoller.bus_bytes - busbytes
+
+        tracemalloc.start()
+        allocated = []
+        for number in range(min(args.cycles, 5)):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            cycle(number)
+            allocated.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+
+        time.sleep(0.05) # let the sink catch up
+        total = sum(walls)
+        return {
+            'sensors': count,
+            'mean': total / len(walls),
+            'p95': percentile(walls, 0.95),
+            'max': max(walls),
+            'cpu': sum(cpus) / len(cpus),
+            'stages': dict((stage, seconds / len(walls)) for stage, seconds in stages.items()),
+            'alloc': max(allocated),
+            'readings': (count + 2 * args.stats + 1) * len(walls) / total,
+            'sent': sink.bytes_received,
+            'frames': len(sink.frames) if args.binary else sink.frames_received,
+            'busbytes': busbytes / len(walls),
+        }
+    finally:
+        for bus in rept.onewirebuses:
+            if bus.readpool is not None:
+                bus.readpool.close()
+            bus.ownet.close_connection()
+        rept.emonhub.close()
+        rept.datalogger.close()
+        for owserver in owservers:
+            owserver.close()
+        sink.close()
+        shutil.rmtree(logfolder)
+
+def get_args():
+    """Setups and parser and processes the arguements"""
+    parser = argparse.ArgumentParser(description='Benchmark the 1-wire and heatmiser cycle')
+    parser.add_argument('--sensors', type=int, nargs='+', default=[16, 64, 256],
+                        help='numbers of 1-wire sensors to run with')
+    parser.add_argument('--cycles', type=int, default=20, help='timed cycles for each run')
+    parser.add_argument('--buses', type=int, default=1,
+                        help='owservers the sensors are shared between')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='parallel owserver connections, 1 reads serially')
+    parser.add_argument('--stats', type=int, default=8, help='heatmiser stats on the bus')
+    parser.add_argument('--frame-latency', type=float, default=0.0,
+                        help='seconds per heatmiser frame, about 0.1 at 4800 baud')
+    parser.add_argument('--read-latency', type=float, default=0.0,
+                        help='seconds owserver takes to answer each sensor read')
+    parser.add_argument('--conversion', type=float, default=0.0,
+                        help='seconds to wait for the 1-wire temperature conversion')
+    parser.add_argument('--untiered', action='store_true',
+                        help='read every heatmiser field every cycle')
+    parser.add_argument('--dead-stats', type=int, default=0,
+                        help='heatmiser stats that never respond')
+    parser.add_argument('--stat-timeout', type=float, default=1.0,
+                        help='seconds a read of a dead stat takes to time out')
+    parser.add_argument('--backoff', type=float, default=60,
+                        help='seconds before retrying a failed stat, 0 retries every cycle')
+    parser.add_argument('--replay', help='daily text log to take sensor values from')
+    parser.add_argument('--deadband', type=float, default=0,
+                        help='only report frames with a value moved this much, 0 reports all')
+    parser.add_argument('--heartbeat', type=float, default=0,
+                        help='with a deadband, report at least this often')
+    parser.add_argument('--binary', action='store_true',
+                        help='send binary frames rather than text')
+    parser.add_argument('--verbose', action='store_true', help='show the reporter log')
+    return parser.parse_args()
+
+def main():
+    """Run the benchmark for each number of sensors and print a table."""
+    args = get_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.ERROR)
+    replay = load_replay(args.replay) if args.replay else None
+
+    print("%8s %9s %9s %9s %9s %10s %11s %9s %7s %8s" % ('sensors', 'mean ms', 'p95 ms',
+                                                           'max ms', 'cpu ms', 'alloc KiB',
+                                                           'readings/s', 'sent B', 'frames',
+                                                           'bus B'))
+    results = [run(count, args, replay) for count in args.sensors]
+    for result in results:
+        print("%8d %9.2f %9.2f %9.2f %9.2f %10.1f %11.0f %9d %7d %8.0f" % (
+            result['sensors'], result['mean'] * 1000, result['p95'] * 1000,
+            result['max'] * 1000, result['cpu'] * 1000, result['alloc'] / 1024,
+            result['readings'], result['sent'], result['frames'], result['busbytes']))
+    for result in results:
+        print("%d sensors: %s" % (result['sensors'], ', '.join(
+            '%s %.2f ms' % (stage, seconds * 1000)
+            for stage, seconds in sorted(result['stages'].items()))))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+"""Compares the time and memory of parsing a schedule with minidom and iterparse.
+
+Writes a synthetic calendar of stats with several targets a day over a
+number of weeks, then parses it the way get_schedule used to, with
+minidom and the time parsed twice per target, and with schedule_parser.
+
+usage: python benchmarks/bench_schedule.py [stats] [days] [targets per day]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from xml.dom import minidom
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import schedule_parser
+
+NOW = datetime(2018, 11, 10, 12, 0, tzinfo=timezone.utc)
+
+def write_schedule(path, stats, days, per_day, start=NOW - timedelta(days=2)):
+    """Write a calendar of stats, each with per_day random targets a day from start"""
+    rand = random.Random(1)
+    with open(path, 'w') as xmlfile:
+        xmlfile.write('<?xml version="1.0"?>\n<calendar>\n')
+        for stat in range(stats):
+            xmlfile.write('<stat><name>Stat %d</name><targets>\n' % stat)
+            for day in range(days):
+                minutes = sorted(rand.sample(range(0, 24 * 60, 15), per_day))
+                for minute in minutes:
+                    time_ = start + timedelta(days=day, minutes=minute)
+                    xmlfile.write('<target time="%s">%.1f</target>\n'
+                                  % (time_.isoformat(), rand.choice([5, 15, 18, 20, 21.5])))
+            xmlfile.write('</targets></stat>\n')
+        xmlfile.write('</calendar>\n')
+
+def parse_minidom(path, now):
+    """Stats and targets as the minidom path in get_schedule found them"""
+    parse_datetime = schedule_parser.parse_time
+    result = []
+    for stat in minidom.parse(path).getElementsByTagName('stat'):
+        targets = stat.getElementsByTagName('targets')[0].getElementsByTagName('target')
+        result.append((stat.getElementsByTagName('name')[0].firstChild.data,
+                       [{'time': parse_datetime(target.attributes['time'].value),
+                         'temp': target.firstChild.data} for target in targets
+                        if parse_datetime(target.attributes['time'].value)
+                        <= now + timedelta(days=16)]))
+    return result
+
+def parse_iterparse(path, now):
+    """Stats and targets from schedule_parser"""
+    return list(schedule_parser.iter_stats(path, now))
+
+def measure(function, path):
+    """Best of three wall clock seconds and the peak memory allocated"""
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        result = function(path, NOW)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    del result
+    tracemalloc.start()
+    function(path, NOW)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+def main():
+    """Write a schedule, parse it both ways and print the comparison."""
+    stats = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    per_day = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    handle, path = tempfile.mkstemp(suffix='.xml')
+    os.close(handle)
+    try:
+        write_schedule(path, stats, days, per_day)
+        domtargets = sum(len(targets) for _, targets in parse_minidom(path, NOW))
+        itertargets = sum(len(targets) for _, targets in parse_iterparse(path, NOW))
+        assert domtargets == itertargets
+        print("%d stats, %d days of %d targets, %d bytes, %d targets in the horizon"
+              % (stats, days, per_day, os.path.getsize(path), itertargets))
+        domtime, dompeak = measure(parse_minidom, path)
+        itertime, iterpeak = measure(parse_iterparse, path)
+        print("  minidom   %8.1f ms %9.1f KiB peak" % (domtime * 1000, dompeak / 1024))
+        print("  iterparse %8.1f ms %9.1f KiB peak, %.1fx faster, %.1fx less memory"
+              % (itertime * 1000, iterpeak / 1024, domtime / itertime, dompeak / iterpeak))
+    finally:
+        os.remove(path)
+
+if __name__ == "__main__":
+    main()
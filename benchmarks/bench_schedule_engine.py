@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""Compares schedule_engine with the rescanning compression it replaced.
+
+Plans a number of stats with thousands of targets each, with
+schedule_engine and with the approach get_schedule's script used, which
+sorted every day's gaps and searched a list of them, then rescanned all
+the targets for each of the seven days. Both give the same plans.
+
+usage: python benchmarks/bench_schedule_engine.py [stats] [targets per stat] [days]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import schedule_engine
+
+NOW = datetime(2018, 11, 10, 12, 0, tzinfo=timezone.utc)
+
+def random_targets(rand, count, days):
+    """Time ordered targets spread over days, starting in the past"""
+    start = NOW - timedelta(days=1)
+    minutes = sorted(rand.sample(range(days * 24 * 60), count))
+    return [{'time': start + timedelta(minutes=minute), 'temp': rand.choice([5, 15, 18, 20, 21])}
+            for minute in minutes]
+
+def plan_rescan(targets, now, days=7, per_day=4):
+    """Plan as get_schedule's script built it, rescanning for each day"""
+    inpast = sum(1 for target in targets if now >= target['time'])
+    targetlist = [dict(target) for target in targets[max(inpast - 1, 0):]]
+    for previous, target in zip(targetlist, targetlist[1:]):
+        target['spacing'] = target['time'] - previous['time']
+
+    targetlist2 = []
+    for key, group in itertools.groupby(enumerate(targetlist),
+                                        key=lambda item: max(item[1]['time'].date(), now.date())):
+        daytargets = list(group)
+        gaps = sorted([(index, target['spacing']) for index, target in daytargets
+                       if index >= 2], key=lambda gap: gap[1])
+        gapstoremove = [gap[0] for gap in gaps[:max(0, len(daytargets) - per_day)]]
+        for index, target in daytargets:
+            if index in gapstoremove:
+                targetlist2[-1]['temp'] = target['temp']
+            else:
+                targetlist2.append(target)
+
+    temp = targetlist2[0]['temp']
+    if len(targetlist2) < 2:
+        return schedule_engine.Plan(temp, True, 0, [])
+    holiday_hours = 0
+    if targetlist2[1]['time'] - now > timedelta(hours=24):
+        holiday_hours = int((targetlist2[1]['time'] - now).total_seconds() // 3600)
+    resume = now + timedelta(hours=holiday_hours)
+
+    programs = []
+    for offset in range(days):
+        date = now.date() + timedelta(days=offset)
+        day = [(target['time'].time(), target['temp']) for target in targetlist2
+               if target['time'].date() == date and target['time'] >= resume]
+        if resume.date() == date and len(day) < per_day:
+            daystart = datetime.combine(date, datetime.min.time(), now.tzinfo)
+            day.insert(0, (max(daystart, targetlist2[0]['time']).time(), temp))
+            futureday = [(target['time'].time(), target['temp']) for target in targetlist2
+                         if target['time'].date() == date + timedelta(days=7) and
+                         target['time'].time() < day[0][0]]
+            day[0:0] = futureday[:per_day - len(day)]
+        programs.append((date, day))
+    return schedule_engine.Plan(temp, False, holiday_hours, programs)
+
+def timed(function, stats):
+    """Best of three wall clock seconds to plan every stat"""
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for targets in stats:
+            function(targets, NOW)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    """Plan the stats both ways and print the comparison."""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    per_stat = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    days = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    rand = random.Random(1)
+    stats = [random_targets(rand, per_stat, days) for _ in range(count)]
+    for targets in stats:
+        assert schedule_engine.plan(targets, NOW) == plan_rescan(targets, NOW)
+
+    print("%d stats of %d targets over %d days" % (count, per_stat, days))
+    rescan = timed(plan_rescan, stats)
+    engine = timed(schedule_engine.plan, stats)
+    print("  rescan %8.1f ms" % (rescan * 1000))
+    print("  engine %8.1f ms, %.1fx faster" % (engine * 1000, rescan / engine))
+
+if __name__ == "__main__":
+    main()
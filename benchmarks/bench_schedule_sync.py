@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""Compares polling the schedule with ScheduleSync and rerunning get_schedule.
+
+Polls a synthetic calendar every interval over a day, one stat's targets
+changing part way through. The one shot script parsed the whole file and
+planned every stat on each run; ScheduleSync parses the file only when
+its validators change and plans a stat again only when its targets change,
+at its next target or at midnight. Fetching is left out of both, a 304
+costing the same either way.
+
+usage: python benchmarks/bench_schedule_sync.py [stats] [days] [targets per day] [interval]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import schedule_engine
+import schedule_parser
+import schedule_sync
+from bench_schedule import NOW, write_schedule
+
+class LocalGetter(object):
+    """XmlGetter standing in for the server, the file changing when told"""
+    def __init__(self):
+        self.version = 1
+
+    def check_file(self, url, destfile):
+        return False
+
+    def validators(self, destfile):
+        return ('"%d"' % self.version, None)
+
+def one_shot(path, now):
+    """Parse and plan every stat, as a run of get_schedule does"""
+    return [schedule_engine.plan(targets, now)
+            for _, targets in schedule_parser.iter_stats(path, now)]
+
+def main():
+    """Poll a day both ways and print the comparison."""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 28
+    per_day = int(sys.argv[3]) if len(sys.argv) > 3 else 6
+    interval = timedelta(seconds=int(sys.argv[4]) if len(sys.argv) > 4 else 900)
+    polls = int(timedelta(days=1) / interval)
+
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, 'schedule.xml')
+        write_schedule(path, count, days, per_day)
+        getter = LocalGetter()
+        clock = [NOW]
+        sync = schedule_sync.ScheduleSync(getter, None, path, lambda job: True,
+                                          clock=lambda: clock[0])
+
+        shot = synced = 0.0
+        for poll in range(polls):
+            clock[0] = NOW + poll * interval
+            if poll == polls // 2:
+                # a new copy, only the first stat's targets differ
+                with open(path) as xmlfile:
+                    text = xmlfile.read()
+                with open(path, 'w') as xmlfile:
+                    xmlfile.write(text.replace('>21.5<', '>22.0<', 1))
+                getter.version += 1
+            start = time.perf_counter()
+            one_shot(path, clock[0])
+            shot += time.perf_counter() - start
+            start = time.perf_counter()
+            sync.poll()
+            synced += time.perf_counter() - start
+    finally:
+        shutil.rmtree(folder)
+
+    print("%d stats, %d days of %d targets a day, %d polls a day"
+          % (count, days, per_day, polls))
+    print("  one shot %8.1f ms, %d parses, %d plans" % (shot * 1000, polls, polls * count))
+    print("  sync     %8.1f ms, %d parses, %d plans, %.0fx faster"
+          % (synced * 1000, sync.parses, sync.plans, shot / synced))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""Counts the bus writes of refreshing stat schedules with and without the cache.
+
+Plans a network of stats from a weekly calendar every hour for a number
+of days, as get_schedule run from cron would, and writes each plan with
+ScheduleWriter and by writing every field of the plan. Writes are counted
+in fields and in frames, adjacent fields going in one frame as
+heatmisercontroller sends them. One stat is away for a few days part way
+through, so is held on holiday.
+
+usage: python benchmarks/bench_schedule_writer.py [stats] [days]
+"""
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, time, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import schedule_engine
+import schedule_writer
+
+START = datetime(2018, 11, 10, 0, 30, tzinfo=timezone.utc)
+# (time of day, temperature) of each day's targets
+WEEKDAY = [(time(6, 30), 20), (time(8, 30), 16), (time(17), 21), (time(22, 30), 15)]
+WEEKEND = [(time(8), 20), (time(23), 15)]
+# field -> (address, length) in the stats' memory
+FIELD_BLOCKS = dict([('frosttemp', (17, 1)), ('runmode', (23, 1)), ('holidayhours', (24, 2))] +
+                    [(name, (103 + 12 * day, 12))
+                     for day, name in enumerate(schedule_writer.DAY_FIELDS)])
+
+def calendar(days, away=None):
+    """Targets from a day before START for days, without those between the away times"""
+    targets = []
+    for offset in range(-1, days + 8):
+        date = START.date() + timedelta(days=offset)
+        for when, temp in WEEKEND if date.weekday() >= 5 else WEEKDAY:
+            moment = datetime.combine(date, when, timezone.utc)
+            if away is None or not away[0] <= moment < away[1]:
+                targets.append({'time': moment, 'temp': temp})
+    return targets
+
+def frames(names):
+    """Frames heatmisercontroller writes names in"""
+    count, end = 0, None
+    for address, length in sorted(FIELD_BLOCKS[name] for name in names):
+        if address != end:
+            count += 1
+        end = address + length
+    return count
+
+class CountingStat(object):
+    """Stat counting the fields and frames written to it"""
+    class heat_schedule(object):
+        entrynames = schedule_writer.DAY_FIELDS
+
+    def __init__(self, address):
+        self.address = address
+        self.fields = {}
+        self.fields_written = 0
+        self.frames_written = 0
+
+    def set_fields(self, names, values):
+        self.fields.update(zip(names, values))
+        self.fields_written += len(names)
+        self.frames_written += frames(names)
+
+    def read_fields(self, names, maxage):
+        return [self.fields.get(name) for name in names]
+
+def main():
+    """Refresh the stats hourly both ways and print the writes made."""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+    away = (START + timedelta(days=2, hours=9), START + timedelta(days=4, hours=18))
+    calendars = [calendar(days, away if address == 1 else None) for address in range(count)]
+
+    folder = tempfile.mkdtemp()
+    try:
+        clock = [0]
+        writer = schedule_writer.ScheduleWriter(
+            schedule_writer.ScheduleCache(os.path.join(folder, 'schedule.written')),
+            clock=lambda: clock[0])
+        cached = [CountingStat(address) for address in range(count)]
+        full = [CountingStat(address) for address in range(count)]
+        refreshes = quiet = 0
+        for hour in range(days * 24):
+            now = START + timedelta(hours=hour)
+            clock[0] = now.timestamp()
+            for targets, cachedstat, fullstat in zip(calendars, cached, full):
+                plan = schedule_engine.plan(targets, now)
+                refreshes += 1
+                if writer.write(cachedstat, plan) == 0:
+                    quiet += 1
+                fields, _ = schedule_writer.plan_fields(plan, clock[0])
+                fullstat.set_fields(list(fields), list(fields.values()))
+    finally:
+        shutil.rmtree(folder)
+
+    print("%d stats refreshed hourly for %d days, %d refreshes" % (count, days, refreshes))
+    for label, stats in (("every field", full), ("cached", cached)):
+        print("  %-12s %6d fields %6d frames" % (label, sum(stat.fields_written for stat in stats),
+                                                 sum(stat.frames_written for stat in stats)))
+    print("  %d of %d refreshes (%.0f%%) wrote nothing" % (quiet, refreshes,
+                                                          100.0 * quiet / refreshes))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+"""Benchmark for the reporter event loop.
+
+Measures the CPU used by an idle scheduler carrying the reporter's usual
+timers, compares it with the old busy-wait loop, and measures how late
+timers fire after their deadline.
+
+usage: python benchmarks/bench_scheduler.py [idle seconds]
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from scheduler import Scheduler
+
+def cpu_fraction(function, duration):
+    """Run function for duration seconds and return fraction of a core used."""
+    wall_start = time.monotonic()
+    cpu_start = time.process_time()
+    function(duration)
+    return (time.process_time() - cpu_start) / (time.monotonic() - wall_start)
+
+def busy_wait(duration):
+    """The original EmonReporter.run loop."""
+    end = time.monotonic() + duration
+    while not time.monotonic() > end:
+        pass
+
+def idle_scheduler(duration):
+    """Scheduler with the reporter's sample, settings and poll timers."""
+    loop = Scheduler()
+    loop.call_every(30, lambda: None)  # sample interval
+    loop.call_every(1, lambda: None)   # settings check
+    loop.call_later(duration, loop.stop)
+    loop.run()
+    loop.close()
+
+def wakeup_latency(count=200, spacing=0.01):
+    """Schedule count timers spacing apart, return mean and max lateness in ms."""
+    loop = Scheduler()
+    start = loop.time() + spacing
+    for index in range(count):
+        loop.call_at(start + index * spacing, lambda: None)
+    loop.call_at(start + count * spacing, loop.stop)
+    loop.run()
+    loop.close()
+    return loop.latency_total / loop.timers_run * 1000, loop.latency_max * 1000
+
+def main():
+    """Run the benchmarks and print a summary."""
+    idle_seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    print("busy-wait loop cpu:   %5.1f%%" % (100 * cpu_fraction(busy_wait, 1)))
+    print("idle scheduler cpu:   %5.2f%% over %.0f s" %
+            (100 * cpu_fraction(idle_scheduler, idle_seconds), idle_seconds))
+    mean, worst = wakeup_latency()
+    print("timer wakeup latency: mean %.3f ms, max %.3f ms" % (mean, worst))
+
+if __name__ == "__main__":
+    main()
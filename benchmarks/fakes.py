@@ -0,0 +1,263 @@
+"""Local stand ins for the hardware and services the reporter talks to.
+
+FakeOwserver speaks the owserver network protocol over TCP,
+FakeHeatmiserNetwork answers the heatmisercontroller stat calls the
+reporter makes after a configurable delay per frame on the bus, and
+EmonhubSink accepts and counts frames like the emonhub socket interfacer.
+
+"""
+
+from __future__ import absolute_import
+import errno
+import socket
+import struct
+import threading
+import time
+
+from heatmisercontroller.exceptions import HeatmiserResponseError
+
+_HEADER = struct.Struct('>iiiiii')
+
+MSG_NOP = 1
+MSG_READ = 2
+MSG_WRITE = 3
+MSG_DIR = 4
+MSG_PRESENCE = 6
+MSG_DIRALL = 7
+MSG_GET = 8
+MSG_DIRALLSLASH = 9
+
+FLG_PERSISTENCE = 0x04
+
+class FakeOwserver(object):
+    """Threaded owserver with a set of DS18B20 style temperature sensors."""
+    def __init__(self, sensors, read_latency=0.0, conversion_time=0.0):
+        self.sensors = dict(sensors) # '/28.XXXX' -> temperature
+        self.read_latency = read_latency
+        self.conversion_time = conversion_time
+        self.requests = 0
+        self.connections = 0
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(64)
+        self.port = self._server.getsockname()[1]
+        self._lock = threading.Lock()
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        """Stop accepting connections."""
+        self._server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            thread = threading.Thread(target=self._serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                header = self._recv(conn, _HEADER.size)
+                if header is None:
+                    return
+                _, payload_len, msgtype, flags, size, _ = _HEADER.unpack(header)
+                payload = self._recv(conn, payload_len) if payload_len else b''
+                self.requests += 1
+                ret, data = self._handle(msgtype, payload, size)
+                persist = flags & FLG_PERSISTENCE
+                conn.sendall(_HEADER.pack(0, len(data), ret, persist, len(data), 0) + data)
+                if not persist:
+                    return
+
+    @staticmethod
+    def _recv(conn, nbytes):
+        buf = b''
+        while len(buf) < nbytes:
+            try:
+                chunk = conn.recv(nbytes - len(buf))
+            except OSError:
+                return None
+            if not chunk:
+                return None
+            buf += chunk
+        return buf
+
+    def _handle(self, msgtype, payload, size):
+        path = payload.split(b'\0', 1)[0].decode('ascii')
+        if msgtype == MSG_NOP:
+            return 0, b''
+        if msgtype == MSG_WRITE:
+            if path == '/simultaneous/temperature' or path == 'simultaneous/temperature':
+                time.sleep(self.conversion_time)
+            return 0, b''
+        if msgtype in (MSG_DIR, MSG_DIRALL, MSG_DIRALLSLASH, MSG_GET):
+            return 0, ','.join(name + '/' for name in sorted(self.sensors)).encode('ascii')
+        device = '/' + path.strip('/').split('/')[0]
+        if msgtype == MSG_PRESENCE:
+            return (0 if device in self.sensors else -errno.ENOENT), b''
+        if msgtype == MSG_READ:
+            if device not in self.sensors:
+                return -errno.ENOENT, b''
+            if path.endswith('latesttemp') or path.endswith('temperature'):
+                time.sleep(self.read_latency)
+                return 0, ('%12.4f' % self.sensors[device]).encode('ascii')
+            return 0, b'DS18B20'
+        return -errno.EINVAL, b''
+
+# heatmiser field -> (address, length) in the stats' memory
+_FIELD_BLOCKS = {'sensorsavaliable': (13, 1), 'remoteairtemp': (34, 2), 'airtemp': (38, 2),
+                 'heatingdemand': (41, 1), 'hotwaterdemand': (42, 1), 'currenttime': (43, 4)}
+# default maximum ages heatmisercontroller reads fields with
+_DEFAULT_AGES = {'sensorsavaliable': 86400, 'currenttime': 86400}
+_DEFAULT_AGE = 11
+_REQUEST_BYTES = 10 # a read request frame, the response is 11 bytes plus the data
+_BAUD = 4800
+
+def _read_time(length):
+    """heatmisercontroller's estimate of the seconds to read length bytes"""
+    return length * 0.002075 + 0.070727
+
+class FakeSerialPort(object):
+    """Port the fake stats talk through, so its traffic can be counted."""
+    timeout = 1
+
+    def write(self, data):
+        """Accept a request frame"""
+        return len(data)
+
+    def read(self, size=1):
+        """Return a response of size bytes"""
+        return b'\0' * size
+
+class _FakeStat(object):
+    """One heatmiser stat.
+
+    Like heatmisercontroller only fields older than the maximum age go to
+    the bus, adjacent ones in a single block. A dead stat waits for the
+    response timeout and raises as heatmisercontroller does."""
+    def __init__(self, address, frame_latency, adaptor, dead=False, timeout=1.0):
+        self.set_address = address
+        self.frame_latency = frame_latency
+        self._adaptor = adaptor # its port may be replaced by a wrapper
+        self.dead = dead
+        self.timeout = timeout
+        self.airtemp = 20.0 + address % 5
+        self.heatingdemand = address % 2
+        self.hotwaterdemand = 1
+        self._readtimes = {} # field -> time last read from the stat
+        self.frames = 0
+
+    def read_fields(self, fields, maxage=None):
+        """Read stale fields, returning the values of fields"""
+        now = time.time()
+        stale = [field for field in fields if self._stale(field, maxage, now)]
+        for _, length in self._blocks(stale):
+            self._frame(length)
+        for field in stale:
+            self._readtimes[field] = now
+        return [self._value(field) for field in fields]
+
+    def read_field(self, field, maxage=None):
+        """Read a single field"""
+        return self.read_fields([field], maxage)[0]
+
+    def _stale(self, field, maxage, now):
+        if field not in self._readtimes:
+            return True
+        if maxage is None:
+            maxage = _DEFAULT_AGES.get(field, _DEFAULT_AGE)
+        return maxage >= 0 and now - self._readtimes[field] >= maxage
+
+    @staticmethod
+    def _blocks(fields):
+        """(first address, length) of the blocks read for fields
+
+        As heatmisercontroller does, one read spanning all the fields if that
+        is quicker than reading each separately."""
+        if not fields:
+            return []
+        spans = sorted(_FIELD_BLOCKS[field] for field in fields)
+        first = spans[0][0]
+        length = max(address + fieldlength for address, fieldlength in spans) - first
+        if _read_time(length) < sum(_read_time(fieldlength) for _, fieldlength in spans):
+            return [(first, length)]
+        return spans
+
+    def _value(self, field):
+        return {'sensorsavaliable': 0, 'remoteairtemp': None, 'currenttime': None}.get(
+            field, getattr(self, field, None))
+
+    def _frame(self, length):
+        self._adaptor.serport.write(b'\0' * _REQUEST_BYTES)
+        if self.dead:
+            time.sleep(self.timeout)
+            raise HeatmiserResponseError("No response from C%d" % self.set_address)
+        self._adaptor.serport.read(11 + length)
+        self.frames += 1
+        if self.frame_latency:
+            # turnaround plus the bytes on the wire, 10 bits each
+            time.sleep(self.frame_latency + (_REQUEST_BYTES + 11 + length) * 10.0 / _BAUD)
+
+class _FakeAdaptor(object):
+    def __init__(self):
+        self.serport = FakeSerialPort()
+
+class FakeHeatmiserNetwork(object):
+    """Heatmiser network of count stats, each frame taking frame_latency seconds plus its bytes.
+
+    The last dead stats don't respond, each read of them taking timeout seconds."""
+    def __init__(self, count, frame_latency=0.0, dead=0, timeout=1.0):
+        self.adaptor = _FakeAdaptor()
+        self.controllers = [_FakeStat(address, frame_latency, self.adaptor,
+                                      address > count - dead, timeout)
+                            for address in range(1, count + 1)]
+
+class EmonhubSink(object):
+    """Accepts connections and counts the bytes and frames sent."""
+    def __init__(self):
+        self.bytes_received = 0
+        self.frames_received = 0
+        self.connections = 0
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(5)
+        self.port = self._server.getsockname()[1]
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        """Stop accepting connections."""
+        self._server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            thread = threading.Thread(target=self._serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    data = conn.recv(65536)
+                except OSError:
+                    return
+                if not data:
+                    return
+                self.bytes_received += len(data)
+                self.frames_received += data.count(b'\r\n')
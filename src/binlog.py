@@ -0,0 +1,305 @@
+"""BinLog
+
+Compact binary alternative to the text daily data logs.
+
+Each day is stored in three files in the log folder:
+  binlog<day>.sensors  json header, sensor ids in column index order and value scale
+  binlog<day>.data     fixed width (column index uint16, value int16) records
+  binlog<day>.time     fixed width (read time uint32, end of its data records uint32) records
+
+Every cycle's values share one time record, so the data file needs four
+bytes per value. Both record files are plain arrays that can be loaded or
+memory mapped with numpy.
+
+Records are buffered and written when flush_bytes have collected, or by a
+background thread once flush_age seconds have passed, so readings aren't
+held in memory for long when they arrive slowly.
+
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import json
+import logging
+import os
+import struct
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_log = logging.getLogger("EmonReporter.binlog")
+
+VERSION = 1
+SCALE = 100 # values are stored in hundredths
+MISSING = -32768 # int16 value used when a value can't be stored
+
+DATA_RECORD = struct.Struct('<Hh')
+TIME_RECORD = struct.Struct('<II')
+
+if numpy is not None:
+    DATA_DTYPE = numpy.dtype([('index', '<u2'), ('value', '<i2')])
+    TIME_DTYPE = numpy.dtype([('time', '<u4'), ('end', '<u4')])
+
+def day_paths(logfolder, day):
+    """Return the header, data and time file names for a day number"""
+    base = os.path.join(logfolder, 'binlog%d' % day)
+    return base + '.sensors', base + '.data', base + '.time'
+
+def heatmiser_sensor_ids(count):
+    """Sensor ids used for the heatmiser temperature and demand columns"""
+    return ['TEMP%d' % index for index in range(count)], \
+           ['DEMAND%d' % index for index in range(count)]
+
+class BinaryDatalogger(object):
+    """Manages local daily binary data logging files."""
+    def __init__(self, logfolder, flush_bytes=4096, flush_age=300):
+        self._logfolder = logfolder
+        self._flush_bytes = flush_bytes
+        self._flush_age = flush_age
+        self._lock = threading.RLock() # logging and the writer thread share the buffers
+        self._closing = threading.Event()
+
+        self._day = None
+        self._sensors = [] # column index -> sensor id for the open day
+        self._columns = {} # sensor id -> column index
+        self._data_count = 0 # data records already in the data file
+
+        self._cycle_time = None
+        self._cycle_values = []
+        self._data_buffer = bytearray()
+        self._time_buffer = bytearray()
+
+        self.bytes_written = 0
+        self.flushes = 0
+
+        self._writer = threading.Thread(target=self._run_writer, name='binlog')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def log_sensor(self, read_time, sensor, temp):
+        """Log a 1 wire sensor reading."""
+        self.log_values(read_time, [(sensor, temp)])
+
+    def log_heatmiser(self, read_time, temps, demands, hotwater):
+        """Log heatmiser temperatures, demands and hot water state."""
+        tempids, demandids = heatmiser_sensor_ids(len(temps))
+        self.log_values(read_time, list(zip(tempids, temps)) + list(zip(demandids, demands))
+                                    + [('HOTW', hotwater)])
+
+    def log_values(self, read_time, values):
+        """Log (sensor id, value) pairs read at read_time."""
+        read_time = int(read_time)
+        with self._lock:
+            if read_time != self._cycle_time:
+                self._end_cycle()
+                if self._day != read_time // 86400:
+                    self.flush()
+                    self._open_day(read_time // 86400)
+                self._cycle_time = read_time
+
+            for sensor, value in values:
+                self._cycle_values.append((self._column(sensor), self._scale(sensor, value)))
+
+    def flush(self):
+        """Write buffered records to the day files."""
+        with self._lock:
+            self._end_cycle()
+            if self._time_buffer:
+                self._write_buffers()
+
+    def _write_buffers(self):
+        """Append the buffers to the open day's files, called holding the lock."""
+        datapath = day_paths(self._logfolder, self._day)[1]
+        timepath = day_paths(self._logfolder, self._day)[2]
+        try:
+            # data before time, so a time record never points past the data written
+            with open(datapath, 'ab') as datafile:
+                datafile.write(self._data_buffer)
+            with open(timepath, 'ab') as timefile:
+                timefile.write(self._time_buffer)
+        except IOError as errcatch:
+            _log.warning('failed to write to binary log file : I/O error(%d): %s',
+                                errcatch.errno, errcatch.strerror)
+        else:
+            self.bytes_written += len(self._data_buffer) + len(self._time_buffer)
+            self.flushes += 1
+        self._data_buffer = bytearray()
+        self._time_buffer = bytearray()
+
+    def close(self):
+        """Stop the writer thread and write out anything buffered."""
+        self._closing.set()
+        self._writer.join()
+        self.flush()
+
+    def _run_writer(self):
+        """Background thread writing the buffers every flush_age seconds."""
+        while not self._closing.wait(self._flush_age):
+            self.flush()
+
+    def _end_cycle(self):
+        """Move the values of the current cycle to the write buffers."""
+        if not self._cycle_values:
+            return
+        for column, value in self._cycle_values:
+            self._data_buffer += DATA_RECORD.pack(column, value)
+        self._data_count += len(self._cycle_values)
+        self._time_buffer += TIME_RECORD.pack(self._cycle_time, self._data_count)
+        self._cycle_values = []
+        if len(self._data_buffer) >= self._flush_bytes:
+            self.flush()
+
+    def _open_day(self, day):
+        """Load or start the header of a day, appending to any existing files."""
+        self._day = day
+        headerpath, datapath, timepath = day_paths(self._logfolder, day)
+        header = read_header(headerpath)
+        self._sensors = header['sensors'] if header else []
+        self._columns = dict((sensor, index) for index, sensor in enumerate(self._sensors))
+
+        # drop any half written records, and data of a cycle whose time wasn't written
+        self._data_count = 0
+        if _trim(timepath, TIME_RECORD.size):
+            with open(timepath, 'rb') as timefile:
+                timefile.seek(-TIME_RECORD.size, os.SEEK_END)
+                self._data_count = TIME_RECORD.unpack(timefile.read())[1]
+        if os.path.exists(datapath):
+            with open(datapath, 'r+b') as datafile:
+                datafile.truncate(self._data_count * DATA_RECORD.size)
+
+    def _column(self, sensor):
+        """Column index for sensor, adding it to the header if new."""
+        try:
+            return self._columns[sensor]
+        except KeyError:
+            pass
+        self._columns[sensor] = len(self._sensors)
+        self._sensors.append(sensor)
+        self._write_header()
+        return self._columns[sensor]
+
+    def _write_header(self):
+        """Atomically replace the header of the open day."""
+        headerpath = day_paths(self._logfolder, self._day)[0]
+        try:
+            with open(headerpath + '.tmp', 'w') as headerfile:
+                json.dump({'version': VERSION, 'scale': SCALE, 'sensors': self._sensors},
+                            headerfile)
+            os.replace(headerpath + '.tmp', headerpath)
+        except (IOError, OSError) as errcatch:
+            _log.warning('failed to write binary log header : %s', errcatch)
+
+    @staticmethod
+    def _scale(sensor, value):
+        """Convert value to stored int16, MISSING if out of range."""
+        scaled = int(round(value * SCALE))
+        if not MISSING < scaled <= 32767:
+            _log.warning('value %s for %s out of range for binary log', value, sensor)
+            return MISSING
+        return scaled
+
+def _trim(path, record_size):
+    """Truncate file to a whole number of records and return the record count."""
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return 0
+    if size % record_size:
+        with open(path, 'r+b') as recordfile:
+            recordfile.truncate(size - size % record_size)
+    return size // record_size
+
+def read_header(headerpath):
+    """Load a day header, None if it doesn't exist."""
+    try:
+        with open(headerpath) as headerfile:
+            return json.load(headerfile)
+    except (IOError, ValueError):
+        return None
+
+def read_range(logfolder, start, end, sensors=None):
+    """Load values logged from start up to end.
+
+    Returns a dictionary of sensor id -> (read times, values), as numpy arrays
+    if numpy is installed and as lists otherwise. sensors limits the result
+    to the sensor ids given."""
+    results = {}
+    for day in range(int(start) // 86400, (int(end) - 1) // 86400 + 1):
+        headerpath, datapath, timepath = day_paths(logfolder, day)
+        header = read_header(headerpath)
+        if header is None:
+            continue
+        if numpy is not None:
+            dayresults = _read_day_numpy(header, datapath, timepath, start, end, sensors)
+        else:
+            dayresults = _read_day_struct(header, datapath, timepath, start, end, sensors)
+        for sensor, (times, values) in dayresults.items():
+            results.setdefault(sensor, ([], []))
+            results[sensor][0].append(times)
+            results[sensor][1].append(values)
+
+    if numpy is not None:
+        return dict((sensor, (numpy.concatenate(times), numpy.concatenate(values)))
+                    for sensor, (times, values) in results.items())
+    return dict((sensor, (sum(times, []), sum(values, [])))
+                for sensor, (times, values) in results.items())
+
+def _read_day_numpy(header, datapath, timepath, start, end, sensors):
+    """Vectorised load of one day's records in the time range."""
+    try:
+        data = numpy.fromfile(datapath, dtype=DATA_DTYPE)
+        alltimes = numpy.fromfile(timepath, dtype=TIME_DTYPE)
+    except FileNotFoundError: # header written, records not flushed yet
+        return {}
+
+    # each cycle's records run from the end of the previous cycle to its own end
+    first, last = numpy.searchsorted(alltimes['time'], [start, end])
+    if first == last:
+        return {}
+    ends = alltimes['end'][first:last].astype(numpy.int64)
+    starts = numpy.append(alltimes['end'][first - 1] if first else 0, ends[:-1])
+    records = data[starts[0]:ends[-1]]
+    recordtimes = numpy.repeat(alltimes['time'][first:last], ends - starts)
+
+    results = {}
+    scale = header.get('scale', SCALE)
+    for index, sensor in enumerate(header['sensors']):
+        if sensors is not None and sensor not in sensors:
+            continue
+        mask = (records['index'] == index) & (records['value'] != MISSING)
+        if mask.any():
+            results[sensor] = (recordtimes[mask], records['value'][mask] / scale)
+    return results
+
+def _read_day_struct(header, datapath, timepath, start, end, sensors):
+    """Pure python load of one day's records in the time range."""
+    try:
+        with open(datapath, 'rb') as datafile:
+            data = datafile.read()
+        with open(timepath, 'rb') as timefile:
+            times = list(TIME_RECORD.iter_unpack(timefile.read()))
+    except FileNotFoundError: # header written, records not flushed yet
+        return {}
+    datacount = len(data) // DATA_RECORD.size
+
+    results = {}
+    scale = header.get('scale', SCALE)
+    wanted = dict((index, sensor) for index, sensor in enumerate(header['sensors'])
+                    if sensors is None or sensor in sensors)
+    first = 0
+    for read_time, stop in times:
+        if not start <= read_time < end:
+            first = stop
+            continue
+        for record in range(first, min(stop, datacount)):
+            index, value = DATA_RECORD.unpack_from(data, record * DATA_RECORD.size)
+            if index in wanted and value != MISSING:
+                result = results.setdefault(wanted[index], ([], []))
+                result[0].append(read_time)
+                result[1].append(value / scale)
+        first = stop
+    return results
@@ -0,0 +1,77 @@
+"""Config_Watch
+
+Notices when the configuration file has been written so the reporter can
+reload it between cycles without restarting.
+
+Uses inotify through inotify_simple when it is installed, watching the
+file's folder so editors that save by replacing the file are seen too.
+Otherwise falls back to comparing the file's modification time and size
+each time it is asked, which is a single stat call.
+
+"""
+
+from __future__ import absolute_import
+import logging
+import os
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+_log = logging.getLogger("EmonReporter.config_watch")
+
+class ConfigWatcher(object):
+    """Tells whether a file has been written since last asked."""
+    def __init__(self, path, use_inotify=True):
+        self._path = os.path.abspath(path)
+        self._inotify = None
+        self._signature = self._stat()
+        if use_inotify and inotify_simple is not None:
+            flags = inotify_simple.flags
+            try:
+                self._inotify = inotify_simple.INotify()
+                self._inotify.add_watch(os.path.dirname(self._path),
+                                        flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+            except OSError as errcatch:
+                _log.warning('could not watch %s, polling it instead: %s', path, errcatch)
+                self._inotify = None
+        _log.debug('watching %s for changes using %s', path, self.method)
+
+    @property
+    def method(self):
+        """'inotify' or 'mtime', how changes are being found."""
+        return 'mtime' if self._inotify is None else 'inotify'
+
+    def fileno(self):
+        """inotify descriptor, readable when the folder has changed, for use with a selector."""
+        return self._inotify.fileno()
+
+    def changed(self):
+        """Whether the file has been written since the last call, never blocks."""
+        if self._inotify is not None:
+            name = os.path.basename(self._path)
+            events = self._inotify.read(timeout=0)
+            return any(event.name == name for event in events)
+        signature = self._stat()
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        return True
+
+    def close(self):
+        """Stop watching."""
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self._path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def changed_sections(old, new):
+    """Sorted names of the top level sections whose settings differ between two configs"""
+    return sorted(name for name in set(old) | set(new) if old.get(name) != new.get(name))
@@ -0,0 +1,60 @@
+"""Cycle_Timer
+
+Times the stages of a sampling cycle and keeps running figures so the
+effect of changes to the sampling pipeline can be seen in the log.
+
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+import logging
+import time
+from contextlib import contextmanager
+
+import metrics
+
+class CycleTimer(object):
+    """Records duration of each stage of a cycle and of the whole cycle."""
+    def __init__(self, clock=time.monotonic, name='sample', registry=metrics.REGISTRY):
+        self._clock = clock
+        self._cycle_start = None
+        self.name = name
+        self._cycle_histogram = registry.histogram('emonreporter_cycle_seconds',
+                                                   'Duration of whole cycles', ['cycle'])
+        self._stage_histogram = registry.histogram('emonreporter_stage_seconds',
+                                                   'Duration of cycle stages', ['cycle', 'stage'])
+
+        self.stages = {} # stage name -> seconds in the current cycle
+        self.cycles = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.last = 0.0
+
+    def start(self):
+        """Begin timing a new cycle."""
+        self._cycle_start = self._clock()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as stage name."""
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + self._clock() - start
+
+    def finish(self):
+        """End the cycle, update running figures and log a summary."""
+        self.last = self._clock() - self._cycle_start
+        self.cycles += 1
+        self.total += self.last
+        self.maximum = max(self.maximum, self.last)
+        self._cycle_histogram.observe(self.last, self.name)
+        for stage, seconds in self.stages.items():
+            self._stage_histogram.observe(seconds, self.name, stage)
+
+        logging.info("Cycle took %.3f s (%s), mean %.3f s, max %.3f s", self.last,
+                        ', '.join('%s %.3f s' % item for item in sorted(self.stages.items())),
+                        self.total / self.cycles, self.maximum)
+        return self.last
@@ -0,0 +1,207 @@
+"""DataLogger
+
+Local daily data logging files, written directly or through a buffer
+flushed by a background thread.
+
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+import os
+import threading
+import time
+
+_log = logging.getLogger("EmonReporter.datalogger")
+
+class LocalDatalogger():
+    """Manages a local daily data logging file."""
+    def __init__(self, logfolder):
+        self._logfolder = logfolder
+
+        self._outputfile = None
+        self._openfilename = False
+        self._file_day_stamp = False
+
+        self._open_file(time.time())
+
+    def _check_day(self, timestamp):
+        """Open new file if the day has changed."""
+        daystamp = timestamp//86400
+        if self._file_day_stamp != daystamp:
+            self._close_file()
+            self._open_file(timestamp)
+
+    def _open_file(self, timestamp):
+        """Open data file and store handle"""
+        self._file_day_stamp = timestamp//86400
+        try:
+            self._openfilename = self._logfolder + "/testlog"+str(self._file_day_stamp)+".txt"
+            self._outputfile = open(self._openfilename,"a") #removed b
+        except IOError as errcatch:
+            self._openfilename = False
+            self._file_day_stamp = False
+            _log.warning('failed to create log file : I/O error(%d): %s',
+                                errcatch.errno, errcatch.strerror)
+        else:
+            _log.info('opened file %s', self._openfilename)
+
+    def _close_file(self):
+        """Close data file."""
+        if self._file_day_stamp is not False:
+            self._outputfile.close()
+            _log.info('closed file %s', self._openfilename)
+            self._openfilename = False
+            self._file_day_stamp = False
+    
+    def log(self, stringout, timestamp=None):
+        """Log data to the log file for the day of timestamp, default now."""
+        self._check_day(time.time() if timestamp is None else float(timestamp))
+        if self._file_day_stamp is not False:
+            try:
+                self._outputfile.write(stringout)
+            except IOError as errcatch:
+                self._close_file()
+                _log.warning('failed to write to log file : I/O error(%d): %s',
+                                    errcatch.errno, errcatch.strerror)
+            else:
+                _log.debug('logged to file: %s', stringout)
+
+    def log_sensor(self, read_time, sensor, temp):
+        """Log a 1 wire sensor reading."""
+        self.log('{}:{!s}:{:+06.2f}\n'.format(read_time, sensor, temp), read_time)
+
+    def log_values(self, read_time, values):
+        """Log (sensor id, value) pairs read at read_time, one line each."""
+        if values:
+            self.log(''.join('{}:{!s}:{:+06.2f}\n'.format(read_time, sensor, value)
+                             for sensor, value in values), read_time)
+
+    def log_heatmiser(self, read_time, temps, demands, hotwater):
+        """Log heatmiser temperatures, demands and hot water state."""
+        stringout = str(read_time)
+        tempstring = ':TEMP' + ','.join(str(tep) for tep in temps)
+        demandsstring = 'DEMAND' + ','.join(str(tep) for tep in demands)
+        hotwaterstring = 'HOTW' + str(hotwater)
+        self.log(stringout + tempstring + demandsstring + hotwaterstring + '\n', read_time)
+
+    def close(self):
+        """Close log file."""
+        self._close_file()
+
+class BufferedDatalogger(LocalDatalogger):
+    """Local daily data logger that collects records in memory.
+
+    Records are written by a background thread when flush_bytes have been
+    buffered, when the oldest record is flush_age seconds old, when the day
+    changes and on close. fsync is 'never', 'flush' (after every flush) or
+    'close' (when each day's file is closed)."""
+    def __init__(self, logfolder, flush_bytes=4096, flush_age=300, fsync='never'):
+        self._flush_bytes = flush_bytes
+        self._flush_age = flush_age
+        self._fsync = fsync
+
+        self._buffer = [] # (daystamp, string) records waiting to be written
+        self._buffer_bytes = 0
+        self._buffer_day = None
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock() # keeps writer thread and flush calls in order
+        self._closing = False
+
+        self.bytes_written = 0
+        self.flushes = 0
+
+        super(BufferedDatalogger, self).__init__(logfolder)
+
+        self._writer = threading.Thread(target=self._run_writer, name='datalogger')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def log(self, stringout, timestamp=None):
+        """Add data to the buffer for the day of timestamp, default now."""
+        daystamp = (time.time() if timestamp is None else float(timestamp))//86400
+        with self._condition:
+            if self._buffer_day is not None and daystamp != self._buffer_day:
+                # day rollover, get yesterday's file written and closed promptly
+                self._condition.notify()
+            self._buffer_day = daystamp
+            self._buffer.append((daystamp, stringout))
+            self._buffer_bytes += len(stringout)
+            if self._buffer_bytes >= self._flush_bytes:
+                self._condition.notify()
+
+    def flush(self):
+        """Write buffered records now, from the calling thread."""
+        with self._write_lock:
+            with self._condition:
+                records = self._take_buffer()
+            if records:
+                self._write_runs(records)
+
+    def close(self):
+        """Stop the writer thread, write remaining records and close the file."""
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        self._writer.join()
+        self.flush()
+        if self._fsync != 'never' and self._file_day_stamp is not False:
+            self._sync_file()
+        self._close_file()
+
+    def _run_writer(self):
+        """Background thread writing the buffer whenever a flush is due."""
+        while True:
+            with self._condition:
+                self._condition.wait(self._flush_age)
+                if self._closing:
+                    return
+            self.flush()
+
+    def _take_buffer(self):
+        """Swap out the buffer contents, called holding the condition."""
+        records = self._buffer
+        self._buffer = []
+        self._buffer_bytes = 0
+        return records
+
+    def _write_runs(self, records):
+        """Write records to their day files, each run from the same day with one write."""
+        start = 0
+        while start < len(records):
+            daystamp = records[start][0]
+            end = start
+            while end < len(records) and records[end][0] == daystamp:
+                end += 1
+            if self._fsync == 'close' and self._file_day_stamp not in (False, daystamp):
+                self._sync_file()
+            self._check_day(daystamp * 86400)
+            self._write_text(''.join(stringout for _, stringout in records[start:end]))
+            start = end
+
+        self.flushes += 1
+        if self._fsync == 'flush' and self._file_day_stamp is not False:
+            self._sync_file()
+
+    def _write_text(self, text):
+        """Write a block of text to the open file."""
+        if self._file_day_stamp is False:
+            return
+        try:
+            self._outputfile.write(text)
+            self._outputfile.flush()
+        except IOError as errcatch:
+            self._close_file()
+            _log.warning('failed to write to log file : I/O error(%d): %s',
+                                errcatch.errno, errcatch.strerror)
+        else:
+            self.bytes_written += len(text)
+            _log.debug('logged %d bytes to file', len(text))
+
+    def _sync_file(self):
+        """Force the open file to disk."""
+        try:
+            os.fsync(self._outputfile.fileno())
+        except (IOError, ValueError) as errcatch:
+            _log.warning('failed to sync log file : %s', errcatch)
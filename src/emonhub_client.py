@@ -0,0 +1,255 @@
+"""EmonHub_Client
+
+Long lived connection to the emonhub socket interfacer.
+
+Frames go as text by default. In binary mode each frame is sent as a
+length prefixed record of its packed payload, see emonhub_coder, for a
+receiver that takes the bytes as they are rather than parsing decimal
+text back in to them.
+
+"""
+
+from __future__ import absolute_import
+import logging
+import select
+import socket
+import time
+
+import emonhub_coder
+
+_log = logging.getLogger("EmonReporter.emonhub_client")
+
+class EmonhubClient(object):
+    """Persistent socket connection to emonhub, reconnecting with backoff.
+
+    If a spool is given, frames that can't be sent are stored in it and
+    drained in batches once emonhub is reachable again. A spool for a
+    binary client must be opened binary, as it holds the frames as sent.
+
+    Unless persistent, each send has a connection of its own, and counts
+    as sent only once emonhub has closed it cleanly. The stock socket
+    interfacer reads once, up to 1024 bytes, and closes, so a reset means
+    it closed with some unread and the frames are spooled again. Batches
+    drained are sized by the bytes sent, so keep drain_batch_bytes within
+    that read."""
+    def __init__(self, host, port, connect_timeout=5.0,
+                    backoff_min=1.0, backoff_max=60.0, clock=time.monotonic,
+                    persistent=False, timestamped=False,
+                    spool=None, drain_batch_bytes=1024, drain_budget=5.0, binary=False):
+        self._address = (host, int(port))
+        self._connect_timeout = float(connect_timeout)
+        self._backoff_min = backoff_min
+        self._backoff_max = backoff_max
+        self._clock = clock
+        self._persistent = persistent
+        self._timestamped = timestamped
+        self._binary = binary
+
+        self._spool = spool
+        self._drain_batch_bytes = drain_batch_bytes
+        self._drain_budget = drain_budget
+
+        self._sock = None
+        self._backoff = 0
+        self._retry_at = 0
+
+        self.connects = 0
+        self.send_failures = 0
+
+    def configure(self, host, port, connect_timeout=5.0, persistent=False, timestamped=False,
+                  drain_batch_bytes=1024):
+        """Apply new settings, keeping the spool and, if emonhub hasn't moved, the socket."""
+        address = (host, int(port))
+        if address != self._address:
+            self.close()
+            self._address = address
+            self._backoff = 0
+            self._retry_at = 0
+        self._connect_timeout = float(connect_timeout)
+        self._persistent = persistent
+        self._timestamped = timestamped
+        self._drain_batch_bytes = drain_batch_bytes
+
+    @property
+    def binary(self):
+        """True if frames are sent as binary records rather than text."""
+        return self._binary
+
+    @property
+    def connected(self):
+        """True if a socket to emonhub is currently open."""
+        return self._sock is not None
+
+    def send(self, message_text, read_time=None):
+        """Send frames read at read_time, returning True if they were handed to the socket.
+
+        message_text holds one or more '\r\n' terminated frames."""
+        if len(message_text) == 0:
+            return True
+        frames = [frame for frame in message_text.split('\r\n') if frame]
+        if self._binary:
+            return self.send_packed([_parse_frame(frame) for frame in frames], read_time)
+        return self._deliver(frames, read_time)
+
+    def send_packed(self, frames, read_time=None):
+        """Send (node, payload) frames read at read_time, returning True as send does.
+
+        Payloads are the packed bytes from emonhub_coder.encode_many, only
+        turned in to text if this isn't a binary client."""
+        if not frames:
+            return True
+        if read_time is None:
+            read_time = int(time.time())
+        if self._binary:
+            return self._deliver([emonhub_coder.pack_frame(read_time, node, payload)
+                                  for node, payload in frames], read_time)
+        return self._deliver([emonhub_coder.frame_text(node, payload)
+                              for node, payload in frames], read_time)
+
+    def _deliver(self, frames, read_time=None):
+        """Send encoded frames, spooling them if they can't be sent."""
+        if read_time is None:
+            read_time = int(time.time())
+
+        if not self._send_records([(read_time, frame) for frame in frames]):
+            if self._spool is not None:
+                for frame in frames:
+                    self._spool.append(read_time, frame)
+                _log.info('spooled %d frames, %d waiting', len(frames), self._spool.depth)
+            return False
+
+        if self._spool is not None and self._spool.depth:
+            self.drain()
+        return True
+
+    def drain(self):
+        """Send spooled frames in batches until empty, failure or the time budget is used."""
+        deadline = self._clock() + self._drain_budget
+        sent = 0
+        while self._spool.depth and self._clock() < deadline:
+            records, position = self._spool.read_batch(self._drain_batch_bytes,
+                                                       self._record_length)
+            if not self._send_records(records):
+                break
+            self._spool.commit(position)
+            sent += len(records)
+        if sent:
+            _log.info('sent %d spooled frames, %d waiting', sent, self._spool.depth)
+        return sent
+
+    def _format_frame(self, read_time, frame):
+        """Terminate frame, prefixing the read time if emonhub expects timestamps."""
+        if self._timestamped:
+            return '%d %s\r\n' % (read_time, frame)
+        return frame + '\r\n'
+
+    def _record_length(self, read_time, frame):
+        """Bytes a spooled record takes on the socket"""
+        if self._binary:
+            return len(frame)
+        return len(self._format_frame(read_time, frame).encode('utf-8'))
+
+    def _send_records(self, records):
+        """Send (read_time, frame) records over the socket, returning True on success."""
+        sock = self._connect()
+        if sock is None:
+            self.send_failures += 1
+            return False
+
+        if self._binary:
+            data = b''.join(frame for _, frame in records)
+            _log.info('socket send %d binary frames, %d bytes', len(records), len(data))
+        else:
+            text = ''.join(self._format_frame(read_time, frame) for read_time, frame in records)
+            _log.info('socket send %s', text)
+            data = text.encode('utf-8')
+        try:
+            sock.sendall(data)
+            if not self._persistent:
+                self._wait_for_close(sock)
+        except IOError as errcatch:
+            _log.warning('could not send to emonhub due to %s', errcatch)
+            self.send_failures += 1
+            self.close()
+            self._schedule_retry()
+            return False
+
+        if not self._persistent:
+            self.close()
+        return True
+
+    @staticmethod
+    def _wait_for_close(sock):
+        """Wait for emonhub to close a connection used for one send.
+
+        Raises IOError if it resets the connection, having closed it with
+        some of the send unread, or doesn't close it within the timeout."""
+        sock.shutdown(socket.SHUT_WR)
+        while sock.recv(1024):
+            pass # emonhub sends nothing back
+
+    def close(self):
+        """Close the socket, the next send will reconnect."""
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except IOError:
+                pass
+            self._sock = None
+
+    def _connect(self):
+        """Return an open socket, connecting if needed and not backing off."""
+        if self._sock is not None and not self._peer_closed():
+            return self._sock
+        self.close()
+
+        if self._clock() < self._retry_at:
+            _log.debug('emonhub reconnect backing off for %.1f s',
+                            self._retry_at - self._clock())
+            return None
+
+        try:
+            sock = socket.create_connection(self._address, timeout=self._connect_timeout)
+        except IOError as errcatch:
+            _log.warning('could not connect to emonhub due to %s', errcatch)
+            self._schedule_retry()
+            return None
+
+        # keep the timeout on sends so a hung hub can't stall the sample loop
+        sock.settimeout(self._connect_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+
+        _log.debug('connected to emonhub at %s:%d', *self._address)
+        self.connects += 1
+        self._backoff = 0
+        self._sock = sock
+        return sock
+
+    def _peer_closed(self):
+        """Check whether emonhub has closed its end of the connection.
+
+        A persistent connection is only kept by a receiver that reads it
+        continuously, but this is checked before every send in case it has
+        been closed since, and reconnects quietly."""
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+            if not readable:
+                return False
+            return self._sock.recv(1, socket.MSG_PEEK) == b''
+        except (IOError, ValueError):
+            return True
+
+    def _schedule_retry(self):
+        """Back off exponentially before the next connection attempt."""
+        self._backoff = min(self._backoff_max, max(self._backoff_min, self._backoff * 2))
+        self._retry_at = self._clock() + self._backoff
+
+def _parse_frame(frame):
+    """(node, payload) of a frame in text form"""
+    fields = frame.split()
+    return fields[0], bytes(bytearray(int(field) for field in fields[1:]))
@@ -2,11 +2,20 @@
 
 Provides functions to code and decode data being sent to emonhub.
 
+Frames are sent either as the space separated decimal text of their
+bytes, or for the binary transport as records of a little-endian header,
+payload length, read time and node, followed by the packed payload.
+
 """
 
 from __future__ import absolute_import
 import struct
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Ensure little-endian & standard sizes used
 ENDIAN_TYPE = '<'
 
@@ -48,3 +57,113 @@ def encode(datacode, value):
     result = struct.unpack(ENDIAN_TYPE + BASE_TYPE * data_size,
                             struct.pack(ENDIAN_TYPE + datacode, value))
     return result
+
+# compiled structs, keyed by the string of data codes they pack
+_STRUCT_CACHE = {}
+
+# binary frame header, payload length, read time, node
+BINARY_HEADER = struct.Struct(ENDIAN_TYPE + 'HIB')
+
+# decimal text of each byte value, for building the text form of frames
+_BYTE_TEXT = [str(byte) for byte in range(256)]
+
+def _get_struct(datacodes):
+    """Get compiled struct for a string of data codes, building it on first use"""
+    try:
+        return _STRUCT_CACHE[datacodes]
+    except KeyError:
+        pass
+
+    for datacode in datacodes:
+        if not check_datacode(datacode):
+            raise ValueError("invalid datacode %s" % datacode)
+
+    compiled = struct.Struct(ENDIAN_TYPE + datacodes)
+    _STRUCT_CACHE[datacodes] = compiled
+    return compiled
+
+def _expand_datacodes(datacodes, count):
+    """Repeat a single data code to count values, or join one code per value"""
+    datacodes = ''.join(datacodes)
+    if len(datacodes) == 1:
+        return datacodes * count
+    if len(datacodes) != count:
+        raise ValueError("%d datacodes for %d values" % (len(datacodes), count))
+    return datacodes
+
+def encode_many(datacodes, values):
+    """encode a list of values in to the bytes of an emonhub frame
+
+    datacodes is a single code used for every value or one code per value."""
+
+    # numpy arrays of a single type are packed without a python level loop
+    if numpy is not None and isinstance(values, numpy.ndarray) and len(datacodes) == 1:
+        _get_struct(datacodes[0])
+        payload = _pack_array(datacodes[0], values)
+        if payload is not None:
+            return payload
+        values = values.tolist() # for struct to refuse as it would a list
+
+    return _get_struct(_expand_datacodes(datacodes, len(values))).pack(*values)
+
+def _pack_array(datacode, values):
+    """pack a numpy array with a single data code, None if struct should pack it
+
+    That is any array of a code other than a number, or that the cast would
+    change by truncating floats to integers, wrapping integers or
+    overflowing floats, which struct refuses rather than pack."""
+    if datacode in 'fd':
+        dtype = numpy.dtype(ENDIAN_TYPE + 'f' + DATA_CODES[datacode])
+        with numpy.errstate(over='ignore'):
+            packed = values.astype(dtype)
+        if numpy.any(numpy.isinf(packed) & ~numpy.isinf(values)):
+            return None
+        return packed.tobytes()
+    if datacode not in 'bhilqBHILQ' or values.dtype.kind not in 'biu':
+        return None
+    dtype = numpy.dtype(ENDIAN_TYPE + ('u' if datacode.isupper() else 'i') + DATA_CODES[datacode])
+    limits = numpy.iinfo(dtype)
+    if values.size and (values.min() < limits.min or values.max() > limits.max):
+        return None
+    return values.astype(dtype).tobytes()
+
+def decode_many(datacodes, frame):
+    """decode the bytes of an emonhub frame in to a tuple of values
+
+    datacodes is a single code repeated to fill the frame or one code per value."""
+
+    frame = bytes(bytearray(frame))
+    if len(datacodes) == 1:
+        datacodes = datacodes[0] * (len(frame) // _get_struct(datacodes[0]).size)
+    return _get_struct(''.join(datacodes)).unpack(frame)
+
+def encode_frame(node, datacodes, values):
+    """encode values in to the space separated text form of an emonhub node frame"""
+
+    return frame_text(node, encode_many(datacodes, values))
+
+def frame_text(node, payload):
+    """space separated text form of a node frame from its packed payload"""
+
+    return ' '.join([str(node)] + [_BYTE_TEXT[byte] for byte in bytearray(payload)])
+
+def pack_frame(read_time, node, payload):
+    """binary transport record of a node frame from its packed payload"""
+
+    return BINARY_HEADER.pack(len(payload), int(read_time), int(node)) + bytes(payload)
+
+def unpack_frames(data):
+    """split binary transport records in to (read_time, node, payload) tuples
+
+    Returns the frames and any trailing bytes of an incomplete record."""
+
+    frames = []
+    offset = 0
+    while len(data) - offset >= BINARY_HEADER.size:
+        length, read_time, node = BINARY_HEADER.unpack_from(data, offset)
+        end = offset + BINARY_HEADER.size + length
+        if end > len(data):
+            break
+        frames.append((read_time, node, bytes(data[offset + BINARY_HEADER.size:end])))
+        offset = end
+    return frames, bytes(data[offset:])
@@ -0,0 +1,291 @@
+"""EmonHub_Interfacer
+
+Sources of readings for EmonReporter.
+
+Each interfacer samples its bus in its own thread every interval seconds
+and puts typed readings on its own bounded queue, waking the reporter's
+event loop through a socket so the readings are dispatched as soon as
+they arrive. A slow or failing bus only delays its own interfacer. If the
+reporter falls behind, an interfacer waits up to an interval for queue
+space before dropping its oldest reading.
+
+"""
+
+from __future__ import absolute_import
+import collections
+import logging
+import socket
+import threading
+import time
+
+import pyownet # use OWFS pyownet module
+
+import binlog
+import heatmiser_poller
+import onewire_discovery
+import onewire_pool
+import readings
+import report_policy
+
+CONVERSION_TIME = 0.75 # seconds needed for a 12 bit temperature conversion
+
+class EmonHubInterfacerInitError(Exception):
+    """Raised when an interfacer can't be created from its settings."""
+
+class EmonHubInterfacer(threading.Thread):
+    """Base source, sampling in its own thread and queueing the readings."""
+    def __init__(self, name, queue_size=16):
+        super(EmonHubInterfacer, self).__init__(name=name)
+        self.daemon = True
+        self._log = logging.getLogger("EmonReporter." + name)
+        self.init_settings = {}
+        self._settings = {'interval': 30.0, 'pause': 'off'}
+        self.queue = readings.BoundedQueue(name, int(queue_size))
+        self._stop_event = threading.Event()
+        # readable whenever readings have been queued
+        self._wakeup_read, self._wakeup_write = socket.socketpair()
+        self._wakeup_read.setblocking(False)
+        self._wakeup_write.setblocking(False)
+
+        self.samples = 0
+        self.sample_failures = 0
+
+    @property
+    def stop(self):
+        """Whether the interfacer has been asked to stop."""
+        return self._stop_event.is_set()
+
+    @stop.setter
+    def stop(self, value):
+        if value:
+            self._stop_event.set()
+
+    @property
+    def paused(self):
+        """Whether sampling is paused by the pause setting."""
+        return str(self._settings['pause']).lower() in ('all', 'in')
+
+    def set(self, **kwargs):
+        """Update runtime settings."""
+        for key, value in kwargs.items():
+            if key == 'interval':
+                self._settings[key] = float(value)
+            elif key in self._settings:
+                self._settings[key] = str(value)
+            else:
+                self._log.warning("'%s' unknown setting %s ignored", self.name, key)
+
+    def fileno(self):
+        """Socket readable when readings are waiting, for the reporter's selector."""
+        return self._wakeup_read.fileno()
+
+    def read(self):
+        """Oldest reading waiting, None if there are none."""
+        try:
+            self._wakeup_read.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            pass
+        return self.queue.get(timeout=0)
+
+    def run(self):
+        try:
+            self.open()
+        except Exception: # nothing can be sampled, the reporter carries on without it
+            self._log.exception("'%s' failed to open", self.name)
+            return
+
+        next_sample = time.monotonic()
+        while not self.stop:
+            if not self.paused:
+                self._sample_and_queue()
+            interval = self._settings['interval']
+            next_sample += interval
+            now = time.monotonic()
+            if next_sample < now:
+                next_sample = now # overran, start again from now rather than catch up
+            self._stop_event.wait(next_sample - now)
+        self.close()
+
+    def _sample_and_queue(self):
+        try:
+            samples = self.sample()
+        except Exception: # keep sampling whatever goes wrong
+            self._log.exception("'%s' failed to sample", self.name)
+            self.sample_failures += 1
+            return
+        self.samples += 1
+        for reading in samples:
+            # wait for the reporter rather than lose readings, but no longer than an interval
+            if not self.queue.put(reading, self._settings['interval']):
+                self._log.warning("'%s' queue full, oldest reading dropped", self.name)
+            try:
+                self._wakeup_write.send(b'\0')
+            except (BlockingIOError, InterruptedError):
+                pass # wakeup already pending
+
+    def open(self):
+        """Connect to the source, run in the interfacer's thread before sampling."""
+
+    def sample(self):
+        """Read the source, returning a list of readings."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release the source once stopped."""
+        self._wakeup_write.close()
+        self._wakeup_read.close()
+
+class EmonOneWireInterfacer(EmonHubInterfacer):
+    """Temperatures of the sensors on an owserver, sent to node.
+
+    Sensors are found and the bus rescanned as for the [1wire] bus of
+    rept_1wire_hmv2, with a discovery cache if discovery_cache is given.
+    With a deadband, readings are only queued when a value has moved by
+    more than it or the heartbeat is due. Each interfacer reads one
+    owserver, so further buses are further interfacers sending to their
+    own nodes, as readings from separate interfacers aren't merged."""
+    def __init__(self, name, sensors, owhost='localhost', owport=4304, node='18',
+                 read_workers=1, read_timeout=1, conversion_time=CONVERSION_TIME,
+                 discovery_cache=None, rescan_interval=600, deadband=0, heartbeat=0,
+                 queue_size=16):
+        super(EmonOneWireInterfacer, self).__init__(name, queue_size)
+        if isinstance(sensors, str):
+            sensors = [sensors] # a single sensor isn't read as a list
+        if not sensors:
+            raise EmonHubInterfacerInitError("no sensors configured")
+        self._sensors = list(sensors)
+        self._address = (owhost, int(owport))
+        self._node = str(node)
+        self._workers = int(read_workers)
+        self._timeout = float(read_timeout)
+        self._conversion_time = float(conversion_time)
+        self._cachepath = discovery_cache
+        self._rescan_interval = float(rescan_interval)
+        self._policy = None
+        if float(deadband) > 0:
+            self._policy = report_policy.ReportPolicy(float(deadband), float(heartbeat))
+        self._ownet = None
+        self._readpool = None
+        self._discovery = None
+
+    def open(self):
+        self._ownet = pyownet.protocol.proxy(host=self._address[0], port=self._address[1],
+                                             persistent=True)
+        self._discovery = onewire_discovery.OneWireDiscovery(
+            self._ownet, self._sensors, onewire_discovery.DiscoveryCache(self._cachepath),
+            self._convert)
+        self._discovery.startup()
+        self._discovery.start(self._rescan_interval)
+        if self._workers > 1:
+            self._readpool = onewire_pool.OneWireReadPool(self._ownet, self._workers,
+                                                          self._timeout)
+
+    def sample(self):
+        if not self._discovery.sensors:
+            return [] # none found yet, the rescans keep looking
+        read_time = int(time.time())
+        if not self._convert(self._ownet):
+            return []
+
+        if self._readpool is not None:
+            temps = self._readpool.read_temps(self._sensors)
+        else:
+            temps = [self._read_temp(sensor) for sensor in self._sensors]
+        if all(temp is None for temp in temps):
+            return []
+        # sensors that failed to read don't count towards the deadband
+        if self._policy is not None and not self._policy.due(
+                [(sensor, temp) for sensor, temp in zip(self._sensors, temps) if temp is not None],
+                read_time):
+            return []
+        return [readings.Reading(self.name, self._node, read_time, self._sensors,
+                                 ['temperature'] * len(temps), temps)]
+
+    def _convert(self, ownetobj):
+        """Run a temperature conversion, returning False if it couldn't be started"""
+        try:
+            ownetobj.write('simultaneous/temperature', data=b'1') # begin conversions
+        except pyownet.protocol.Error as errcatch:
+            self._log.warning("'%s' could not run conversion due to %s", self.name, errcatch)
+            return False
+        self._stop_event.wait(self._conversion_time)
+        return True
+
+    def _read_temp(self, sensor):
+        try:
+            return float(self._ownet.read(sensor + '/latesttemp', timeout=self._timeout))
+        except pyownet.protocol.Error as errcatch:
+            self._log.debug('Sensor %s read failed due to %s', sensor, errcatch)
+            return None
+
+    def close(self):
+        if self._discovery is not None:
+            self._discovery.stop()
+        if self._readpool is not None:
+            self._readpool.close()
+        if self._ownet is not None:
+            self._ownet.close_connection()
+        super(EmonOneWireInterfacer, self).close()
+
+class EmonHeatmiserInterfacer(EmonHubInterfacer):
+    """Hot water state, then air temperature and heating demand of each stat, sent to node."""
+    def __init__(self, name, config_file=None, node='27', tiered=True, backoff=60,
+                 max_backoff=3600, queue_size=16):
+        super(EmonHeatmiserInterfacer, self).__init__(name, queue_size)
+        self._config_file = config_file
+        self._node = str(node)
+        self._tiers = heatmiser_poller.TIERED
+        if str(tiered).lower() not in ('true', 'yes', 'on', '1'):
+            self._tiers = heatmiser_poller.UNTIERED
+        self._backoff = float(backoff)
+        self._max_backoff = float(max_backoff)
+        self._hmnetwork = None
+        self._errors = ()
+        self._poller = None
+        self._jobs = collections.deque() # callables from other threads, run before sampling
+
+    def open(self):
+        # imported here so the other interfacers work without heatmisercontroller set up
+        from serial import SerialException
+        from heatmisercontroller import network
+        from heatmisercontroller.exceptions import (HeatmiserResponseError,
+                                                    HeatmiserControllerTimeError)
+        self._hmnetwork = network.HeatmiserNetwork(self._config_file)
+        self._errors = (SerialException, HeatmiserResponseError, HeatmiserControllerTimeError)
+        self._poller = heatmiser_poller.HeatmiserPoller(
+            self._hmnetwork, self._tiers, backoff=self._backoff, max_backoff=self._max_backoff,
+            errors=self._errors)
+
+    def submit(self, job):
+        """Run job(hmnetwork, errors) in the interfacer's thread before its next sample.
+
+        Other users of the stats go through here so they share the bus
+        with the polls rather than contend for the serial port. Returns
+        False, without queueing job, if it wouldn't be run because the
+        network isn't open, the interfacer has stopped or it is paused."""
+        if not self.is_alive() or self.stop or self._hmnetwork is None or self.paused:
+            return False
+        self._jobs.append(job)
+        return True
+
+    def sample(self):
+        while self._jobs:
+            job = self._jobs.popleft()
+            try:
+                job(self._hmnetwork, self._errors)
+            except Exception: # a failed job mustn't stop the polls
+                self._log.exception("'%s' job %s failed", self.name, job)
+        read_time = int(time.time())
+        rows = self._poller.poll()
+        if all(row is None for row in rows):
+            self._log.warning("'%s' all stats failed to read", self.name)
+            return []
+
+        tempids, demandids = binlog.heatmiser_sensor_ids(len(rows))
+        sensors, kinds = ['HOTW'], ['state']
+        values = [None if rows[0] is None else rows[0][4]]
+        for tempid, demandid, row in zip(tempids, demandids, rows):
+            sensors += [tempid, demandid]
+            kinds += ['temperature', 'state']
+            values += [heatmiser_poller.air_temp(row), None if row is None else row[3]]
+        return [readings.Reading(self.name, self._node, read_time, sensors, kinds, values)]
@@ -0,0 +1,88 @@
+"""EmonHub_Receiver
+
+Local stand-in for the receiving end of the binary emonhub transport.
+
+Accepts connections from EmonhubClient in binary mode, splits the stream
+in to frames and hands each one, as (read_time, node, payload), to a
+callback. Run on its own it prints the frames in emonhub's timestamped
+text form, which is handy for checking what a reporter is sending.
+
+"""
+
+from __future__ import absolute_import
+import argparse
+import logging
+import socket
+import threading
+
+import emonhub_coder
+
+class BinaryFrameReceiver(object):
+    """Listens for binary frames, passing each to callback or keeping them in frames."""
+    def __init__(self, host='127.0.0.1', port=0, callback=None):
+        self.frames = []
+        self.bytes_received = 0
+        self.connections = 0
+        self._callback = callback if callback is not None else self.frames.append
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, int(port)))
+        self._server.listen(5)
+        self.port = self._server.getsockname()[1]
+        thread = threading.Thread(target=self._accept, name='binary receiver')
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        """Stop accepting connections."""
+        # shutdown wakes the accept, close alone leaves the port listening until it returns
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass # already closed
+        self._server.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            thread = threading.Thread(target=self._serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, conn):
+        pending = b''
+        with conn:
+            while True:
+                try:
+                    data = conn.recv(65536)
+                except OSError:
+                    return
+                if not data:
+                    break
+                self.bytes_received += len(data)
+                frames, pending = emonhub_coder.unpack_frames(pending + data)
+                for frame in frames:
+                    self._callback(frame)
+        if pending:
+            logging.warning('connection closed part way through a frame, %d bytes lost',
+                            len(pending))
+
+def _print_frame(frame):
+    read_time, node, payload = frame
+    print('%d %s' % (read_time, emonhub_coder.frame_text(node, payload)), flush=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Print frames sent by the binary transport')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=50011, help='port to listen on')
+    args = parser.parse_args()
+
+    receiver = BinaryFrameReceiver(args.host, args.port, _print_frame)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        receiver.close()
@@ -0,0 +1,168 @@
+"""EmonHub_Reporter
+
+Sinks for EmonReporter readings.
+
+Each reporter takes readings from its own bounded queue in its own
+thread, so a sink that is slow or unreachable only backs up its own
+queue. When a queue is full its oldest reading is dropped and counted.
+
+"""
+
+from __future__ import absolute_import
+import logging
+import os
+import threading
+
+import binlog
+import emonhub_client
+import metrics
+import readings
+import spool
+from datalogger import LocalDatalogger, BufferedDatalogger
+
+class EmonHubReporterInitError(Exception):
+    """Raised when a reporter can't be created from its settings."""
+
+def _as_bool(value):
+    """Convert unvalidated config value to boolean"""
+    return str(value).lower() in ('true', 'yes', 'on', '1')
+
+class EmonHubReporter(threading.Thread):
+    """Base sink, processing queued readings in its own thread."""
+    def __init__(self, name, queue_size=64):
+        super(EmonHubReporter, self).__init__(name=name)
+        self.daemon = True
+        self._log = logging.getLogger("EmonReporter." + name)
+        self.init_settings = {}
+        self._settings = {'pause': 'off'}
+        self.queue = readings.BoundedQueue(name, int(queue_size))
+        self._stop_event = threading.Event()
+
+        self.processed = 0
+        self.failures = 0
+
+    @property
+    def stop(self):
+        """Whether the reporter has been asked to stop."""
+        return self._stop_event.is_set()
+
+    @stop.setter
+    def stop(self, value):
+        if value:
+            self._stop_event.set()
+
+    def set(self, **kwargs):
+        """Update runtime settings."""
+        for key, value in kwargs.items():
+            if key in self._settings:
+                self._settings[key] = str(value)
+            else:
+                self._log.warning("'%s' unknown setting %s ignored", self.name, key)
+
+    def run(self):
+        while not self.stop:
+            reading = self.queue.get(timeout=0.5)
+            if reading is None:
+                continue
+            if self._settings['pause'].lower() in ('all', 'out'):
+                continue
+            try:
+                self.process(reading)
+            except Exception: # one bad reading shouldn't stop the sink
+                self._log.exception("'%s' failed to process reading from %s", self.name,
+                                  reading.source)
+                self.failures += 1
+            else:
+                self.processed += 1
+        self.close()
+
+    def process(self, reading):
+        """Send or store one reading."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release the sink once stopped."""
+
+class EmonHubSocketReporter(EmonHubReporter):
+    """Sends readings as frames to the emonhub socket interfacer, spooling what can't be sent.
+
+    With binary set the packed frames are sent as they are, see emonhub_client."""
+    def __init__(self, name, host='localhost', port=50011, connect_timeout=5, persistent=False,
+                 timestamped=False, spool_folder=None, spool_max_bytes=50 * 1024 * 1024,
+                 spool_batch_bytes=1024, temperaturenull=-10, binary=False, queue_size=64):
+        super(EmonHubSocketReporter, self).__init__(name, queue_size)
+        self._temperaturenull = float(temperaturenull)
+        binary = _as_bool(binary)
+        framespool = None
+        if spool_folder:
+            if binary: # kept apart from text frames spooled before switching
+                spool_folder = os.path.join(spool_folder, 'binary')
+            try:
+                framespool = spool.FrameSpool(spool_folder, int(spool_max_bytes), binary=binary)
+            except (IOError, OSError) as errcatch:
+                self._log.warning("'%s' failed to open spool, unsent frames will be lost: %s",
+                                name, errcatch)
+        self._client = emonhub_client.EmonhubClient(host, int(port), float(connect_timeout),
+                                                    persistent=_as_bool(persistent),
+                                                    timestamped=_as_bool(timestamped),
+                                                    spool=framespool,
+                                                    drain_batch_bytes=int(spool_batch_bytes),
+                                                    binary=binary)
+
+    def process(self, reading):
+        self._client.send_packed([readings.pack_reading(reading, self._temperaturenull)],
+                                 reading.read_time)
+
+    def close(self):
+        self._client.close()
+
+class EmonHubLogReporter(EmonHubReporter):
+    """Logs readings to local daily files, text or binary."""
+    def __init__(self, name, logfolder, format='text', buffered=True, flush_bytes=4096,
+                 flush_age=300, fsync='never', queue_size=64):
+        super(EmonHubLogReporter, self).__init__(name, queue_size)
+        if not os.path.isdir(logfolder):
+            raise EmonHubReporterInitError("log folder %s doesn't exist" % logfolder)
+        if format == 'binary':
+            self._datalogger = binlog.BinaryDatalogger(logfolder, int(flush_bytes),
+                                                       float(flush_age))
+        elif _as_bool(buffered):
+            self._datalogger = BufferedDatalogger(logfolder, int(flush_bytes), float(flush_age),
+                                                  fsync)
+        else:
+            self._datalogger = LocalDatalogger(logfolder)
+
+    def process(self, reading):
+        self._datalogger.log_values(reading.read_time,
+                                    [(sensor, value) for sensor, value
+                                     in zip(reading.sensors, reading.values) if value is not None])
+
+    def close(self):
+        self._datalogger.close()
+
+READING = metrics.REGISTRY.gauge('emonreporter_reading', 'Last value read from each sensor',
+                                 ['source', 'sensor'])
+READING_TIME = metrics.REGISTRY.gauge('emonreporter_reading_time_seconds',
+                                      'Time of the last reading from each source', ['source'])
+
+class EmonHubMetricsReporter(EmonHubReporter):
+    """Exposes the latest readings as metrics, served on listen if given."""
+    def __init__(self, name, listen='', queue_size=64):
+        super(EmonHubMetricsReporter, self).__init__(name, queue_size)
+        self._server = None
+        if listen:
+            try:
+                self._server = metrics.MetricsServer(listen)
+            except (IOError, OSError) as errcatch:
+                raise EmonHubReporterInitError("could not serve metrics on %s: %s"
+                                               % (listen, errcatch))
+
+    def process(self, reading):
+        for sensor, value in zip(reading.sensors, reading.values):
+            if value is not None:
+                READING.set(value, reading.source, sensor)
+        READING_TIME.set(reading.read_time, reading.source)
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
@@ -0,0 +1,55 @@
+"""EmonHub_Setup
+
+Loads EmonReporter settings from a configuration file, with hub,
+interfacers and reporters sections, and reloads them when the file
+changes.
+
+"""
+
+from __future__ import absolute_import
+import logging
+
+from configobj import ConfigObj
+
+import config_watch
+
+SECTIONS = ('hub', 'interfacers', 'reporters')
+
+class EmonHubSetupInitError(Exception):
+    """Raised when the configuration file can't be loaded."""
+
+class EmonHubFileSetup(object):
+    """Settings from a configuration file."""
+    def __init__(self, filename):
+        self._filename = filename
+        self.settings = self._load()
+        self._watcher = config_watch.ConfigWatcher(filename)
+
+    def run(self):
+        """Nothing to do between checks for a file setup."""
+
+    def check_settings(self):
+        """Reload settings if the file has changed, returning True if they differ."""
+        if not self._watcher.changed():
+            return False
+        try:
+            settings = self._load()
+        except EmonHubSetupInitError as errcatch:
+            logging.getLogger("EmonReporter").warning("Settings not reloaded: %s", errcatch)
+            return False
+        if settings == self.settings:
+            return False
+        self.settings = settings
+        return True
+
+    def _load(self):
+        try:
+            settings = ConfigObj(self._filename, file_error=True)
+        except IOError as err:
+            raise EmonHubSetupInitError(err)
+        except SyntaxError as err:
+            raise EmonHubSetupInitError(
+                'Error parsing config file "%s": %s' % (self._filename, err))
+        for section in SECTIONS:
+            settings.setdefault(section, {})
+        return settings
@@ -5,7 +5,14 @@
 Monitors data sensor network, and sends data to EmonHub
 through scoket interface.
 
-Communicates with the user through an ??? EmonHubSetup
+Interfacers sample their sources in their own threads and reporters send
+or store readings in theirs, linked by bounded queues, so a slow bus or
+sink never holds up the others.
+
+If a schedule section is configured, the stats' programs are also kept
+in step with a remote schedule, polled from the same event loop.
+
+Communicates with the user through an EmonHubSetup
 
 """
 from __future__ import absolute_import
@@ -15,13 +22,15 @@ import logging
 import logging.handlers
 import signal
 import argparse
-# import pprint
-# import Queue
+import functools
+import pprint
 
-# import emonhub_setup as ehs
-# import emonhub_reporter as ehr
-# import emonhub_interfacer as ehi
-# import emonhub_coder as ehc
+import emonhub_setup as ehs
+import emonhub_reporter as ehr
+import emonhub_interfacer as ehi
+import emonhub_coder as ehc
+import scheduler
+import schedule_sync
 
 class EmonReporter():
     """Reports heatmiser information to EmonHub"""
@@ -49,6 +58,9 @@ class EmonReporter():
         self._hmnode = '27' # for hm stat reporting
 
         self._sample_interval = 30
+        self._settings_interval = 1 # seconds between settings checks
+        self._poll_interval = 0.2 # seconds between polls of interfacers without a fileno
+        self._queue_log_interval = 60 # seconds between logs of queue depths
 
         # Initialize logging
         self._log = logging.getLogger("EmonReporter")
@@ -56,8 +68,18 @@ class EmonReporter():
         self._log.info("EmonReporter %s", self.__version__)
         self._log.info("Opening reporter...")
 
-        # Initialize Interfacers
+        # Initialize Interfacers and Reporters, with a queue per reporter
         self._interfacers = {}
+        self._reporters = {}
+        self._queue = {}
+
+        # Initialize event loop
+        self._scheduler = scheduler.Scheduler()
+
+        # Schedule sync, polled from the event loop once running
+        self._schedule_settings = {}
+        self._schedule_sync = None
+        self._schedule_timers = []
 
         # Update settings
         self._update_settings(settings)
@@ -65,117 +87,188 @@ class EmonReporter():
     def run(self):
         """Launch the reporter.
         
-        Monitor the COM port and process data.
+        Poll the interfacers and process data.
         Check settings on a regular basis.
+        Sleeps between deadlines, socket readiness and signals.
 
         """
 
-        # Set signal handler to catch SIGINT and shutdown gracefully
-        signal.signal(signal.SIGINT, self._sigint_handler)
-        
+        # Set signal handlers to catch SIGINT and SIGTERM and shutdown gracefully
+        self._scheduler.add_signal_handler(signal.SIGINT, self._signal_handler)
+        self._scheduler.add_signal_handler(signal.SIGTERM, self._signal_handler)
+
+        self._scheduler.call_every(self._settings_interval, self._check_settings)
+        self._scheduler.call_every(self._poll_interval, self._poll_interfacers)
+        self._scheduler.call_every(self._queue_log_interval, self._log_queues)
+
         # Until asked to stop
-        while not self._exit:
-            pass
-            # # Run setup and update settings if modified
-            # self._setup.run()
-            # if self._setup.check_settings():
-                # self._update_settings(self._setup.settings)
-            
-            # # For all Interfacers
-            # for interfacer in self._interfacers.itervalues():
-                # # Execute run method
-                # interfacer.run()
-                # # Read socket
-                # values = interfacer.read()
-                # # If complete and valid data was received
-                # if values is not None:
-                    # # Place a copy of the values in a queue for each reporter
-                    # for name in self._reporters:
-                        # # discard if reporter 'pause' set to 'all' or 'in'
-                        # if 'pause' in self._reporters[name]._settings \
-                                # and str(self._reporters[name]._settings['pause']).lower() in \
-                                # ['all', 'in']:
-                            # continue
-                        # self._queue[name].put(values)
-
-            # # Sleep until next iteration
-            # time.sleep(0.2)
-         
+        if not self._exit:
+            self._scheduler.run()
+
+    def _check_settings(self):
+        """Run setup and update settings if modified."""
+        if self._setup is None:
+            return
+        self._setup.run()
+        if self._setup.check_settings():
+            self._update_settings(self._setup.settings)
+
+    def _poll_interfacers(self):
+        """Dispatch interfacers that can't be watched through a file descriptor."""
+        for interfacer in list(self._interfacers.values()):
+            if not hasattr(interfacer, 'fileno'):
+                self._dispatch_interfacer(interfacer)
+
+    def _dispatch_interfacer(self, interfacer):
+        """Queue readings the interfacer has sampled for each reporter."""
+        while True:
+            values = interfacer.read()
+            if values is None:
+                return
+            # Place the reading in a queue for each reporter, readings are never modified
+            for name in self._reporters:
+                # discard if reporter 'pause' set to 'all' or 'in'
+                if 'pause' in self._reporters[name]._settings \
+                        and str(self._reporters[name]._settings['pause']).lower() in \
+                        ['all', 'in']:
+                    continue
+                # never waits, a full queue drops its oldest reading
+                self._queue[name].put(values)
+
+    def _log_queues(self):
+        """Log how far behind each interfacer and reporter is."""
+        for kind, workers in (('interfacer', self._interfacers), ('reporter', self._reporters)):
+            for name, worker in workers.items():
+                self._log.debug("%s '%s' queue %d of %d, high water %d, dropped %d", kind, name,
+                                len(worker.queue), worker.queue.maxsize,
+                                worker.queue.high_water, worker.queue.dropped)
+
     def close(self):
         """Close reporter. Do some cleanup before leaving."""
         
         self._log.info("Exiting hub...")
 
-        # for interfacer in self._interfacers.itervalues():
-            # interfacer.close()
+        for interfacer in self._interfacers.values():
+            if hasattr(interfacer, 'fileno'):
+                self._scheduler.remove_reader(interfacer)
+            interfacer.stop = True
+            interfacer.join()
 
-        # for R in self._reporters.itervalues():
-            # R.stop = True
-            # R.join()
+        self._scheduler.close()
+
+        for reporter in self._reporters.values():
+            reporter.stop = True
+            reporter.join()
 
         self._log.info("Exit completed")
         logging.shutdown()
 
-    def _sigint_handler(self, signal_internal, frame):
-        """Catch SIGINT (Ctrl+C)."""
+    def _signal_handler(self, signum):
+        """Catch SIGINT (Ctrl+C) and SIGTERM."""
         
-        self._log.debug("SIGINT received.")
+        self._log.debug("Signal %d received.", signum)
         # reporter should exit at the end of current iteration.
         self._exit = True
+        self._scheduler.stop()
 
     def _update_settings(self, settings):
         """Check settings and update if needed."""
 
         # EmonHub Logging level
-        if 'loglevel' in settings['hub']:
+        if 'loglevel' in settings.get('hub', {}):
             self._set_logging_level(settings['hub']['loglevel'])
         else:
             self._set_logging_level()
 
 
-        # Create a place to hold buffer contents whilst a deletion & rebuild occurs
-        self.temp_buffer = {}
+        self._update_reporters(settings.get('reporters', {}))
+        self._update_interfacers(settings.get('interfacers', {}))
+        self._update_schedule(settings.get('schedule', {}))
+
+        if 'nodes' in settings:
+            ehc.nodelist = settings['nodes']
 
-        # Interfacers
-        for name in self._interfacers.keys():
+    def _update_reporters(self, settings):
+        """Create, rebuild or delete reporters whose settings have changed."""
+        for name in list(self._reporters.keys()):
+            if name in settings and 'Type' in settings[name] and \
+                    self._reporters[name].init_settings == settings[name].get('init_settings', {}):
+                continue
+            # Delete reporters if setting changed or name is unlisted or Type is missing
+            self._log.info("Deleting reporter '%s'", name)
+            self._reporters[name].stop = True
+            self._reporters[name].join()
+            del self._reporters[name]
+            del self._queue[name]
+
+        for name, reporter in settings.items():
+            if name in self._reporters:
+                # Otherwise just update the runtime settings if possible
+                if 'runtimesettings' in reporter:
+                    self._reporters[name].set(**reporter['runtimesettings'])
+                continue
+            if not 'Type' in reporter:
+                continue
+            try:
+                self._log.info("Creating %s '%s' ", reporter['Type'], name)
+                # This gets the class from the 'Type' string
+                initsettings = reporter.get('init_settings', {})
+                created = getattr(ehr, reporter['Type'])(name, **initsettings)
+                created.set(**reporter.get('runtimesettings', {}))
+                created.init_settings = initsettings
+            except ehr.EmonHubReporterInitError as err:
+                # If reporter can't be created, log error and skip to next
+                self._log.error("Failed to create '%s' reporter: %s", name, err)
+                continue
+            except Exception as err:
+                # If reporter can't be created, log error and skip to next
+                self._log.error("Unable to create '%s' reporter: %s", name, err)
+                continue
+            created.start()
+            self._reporters[name] = created
+            self._queue[name] = created.queue
+
+    def _update_interfacers(self, settings):
+        """Create, rebuild or delete interfacers whose settings have changed."""
+        for name in list(self._interfacers.keys()):
             #Delete interfacers not listed or have no 'Type' in the settings without further checks
             #(This also provides an ability to delete & rebuild by commenting 'Type' in conf)
-            if not name in settings['interfacers'] or not 'Type' in settings['interfacers'][name]:
+            if not name in settings or not 'Type' in settings[name]:
                 pass
             else:
                 try:
                     # test for 'init_settings' and 'runtime_setting' sections
-                    settings['interfacers'][name]['init_settings']
-                    settings['interfacers'][name]['runtimesettings']
+                    settings[name]['init_settings']
+                    settings[name]['runtimesettings']
                 except Exception as err:
                     # If interfacer's settings are incomplete, continue without updating
-                    self._log.error("Unable to update '%s' configuration: ", err)
+                    self._log.error("Unable to update '%s' configuration: %s", name, err)
                     continue
                 else:
                     #check init_settings against  file copy, if they are the same move on to next
-                    if self._interfacers[name].init_settings == settings['interfacers'][name]['init_settings']:
+                    if self._interfacers[name].init_settings == settings[name]['init_settings']:
                         continue
             # Delete interfacers if setting changed or name is unlisted or Type is missing
             self._log.info("Deleting interfacer '%s' ", name)
+            if hasattr(self._interfacers[name], 'fileno'):
+                self._scheduler.remove_reader(self._interfacers[name])
             self._interfacers[name].stop = True
+            self._interfacers[name].join()
             del self._interfacers[name]
 
-        for name, interfacer in settings['interfacers'].iteritems():
+        for name, interfacer in settings.items():
             # If interfacer does not exist, create it
             if name not in self._interfacers:
                 try:
                     if not 'Type' in interfacer:
                         continue
                     self._log.info("Creating %s '%s' ",interfacer['Type'], name)
-                    if interfacer['Type'] in ('EmonModbusTcpInterfacer',
-                                    'EmonFroniusModbusTcpInterfacer') and not pymodbus_found :
-                        self._log.error("Python mod pymodbus not installed. \
-                                            Unable to load modbus interfacer")
                     # This gets the class from the 'Type' string
-                    interfacer = getattr(ehi, interfacer['Type'])(name,**interfacer['init_settings'])
-                    interfacer.set(**interfacer['runtimesettings'])
-                    interfacer.init_settings = interfacer['init_settings']
-                    interfacer.start()
+                    initsettings = interfacer.get('init_settings', {})
+                    created = getattr(ehi, interfacer['Type'])(name, **initsettings)
+                    created.set(**interfacer.get('runtimesettings', {}))
+                    created.init_settings = initsettings
+                    created.start()
                 except ehi.EmonHubInterfacerInitError as err:
                     # If interfacer can't be created, log error and skip to next
                     self._log.error("Failed to create '%s' interfacer: %s",name, err)
@@ -185,14 +278,55 @@ class EmonReporter():
                     self._log.error("Unable to create '%s' interfacer: %s",name, err)
                     continue
                 else:
-                    self._interfacers[name] = interfacer
+                    self._interfacers[name] = created
+                    # interfacers with a socket wake the loop when data arrives
+                    if hasattr(created, 'fileno'):
+                        self._scheduler.add_reader(created, self._dispatch_interfacer, created)
             else:
                 # Otherwise just update the runtime settings if possible
                 if 'runtimesettings' in interfacer:
                     self._interfacers[name].set(**interfacer['runtimesettings'])
 
-        if 'nodes' in settings:
-            ehc.nodelist = settings['nodes']
+    def _update_schedule(self, settings):
+        """Create, rebuild or delete the schedule sync if its settings have changed."""
+        settings = dict(settings)
+        if settings == self._schedule_settings:
+            return
+        self._schedule_settings = settings
+        if self._schedule_sync is not None:
+            self._log.info("Deleting schedule sync")
+            for timer in self._schedule_timers:
+                timer.cancel()
+            self._schedule_timers = []
+        self._schedule_sync = None
+        if not settings.get('url'):
+            return
+        try:
+            # imported here so the reporter runs without requests installed
+            import get_schedule
+            getter = get_schedule.XmlGetter(settings.get('username', ''),
+                                            settings.get('password', ''),
+                                            timeout=float(settings.get('timeout', 10)))
+            self._schedule_sync = schedule_sync.ScheduleSync(
+                getter, settings['url'], settings['destfile'],
+                functools.partial(self._submit_job, settings.get('interfacer', 'heatmiser')))
+        except Exception as err:
+            self._log.error("Unable to create schedule sync: %s", err)
+            return
+        self._log.info("Creating schedule sync of %s", settings['url'])
+        # polled as soon as the loop runs, then every interval
+        self._schedule_timers = [
+            self._scheduler.call_later(0, self._schedule_sync.poll),
+            self._scheduler.call_every(float(settings.get('interval', 900)),
+                                       self._schedule_sync.poll)]
+
+    def _submit_job(self, name, job):
+        """Hand job to interfacer name to run with its bus, False if it can't take jobs."""
+        interfacer = self._interfacers.get(name)
+        if interfacer is None or not hasattr(interfacer, 'submit'):
+            self._log.warning("No '%s' interfacer to write the schedule through", name)
+            return False
+        return interfacer.submit(job)
 
     def _set_logging_level(self, level='WARNING', log=True):
         """Set logging level.
@@ -265,27 +399,24 @@ if __name__ == "__main__":
             '%(asctime)s %(levelname)s %(message)s'))
     logger.addHandler(loghandler)
 
-    # # Initialize reporter setup
-    # try:
-        # setup = ehs.EmonHubFileSetup(args.config_file)
-    setup = None
-    # except ehs.EmonHubSetupInitError as e:
-        # logger.critical(e)
-        # sys.exit("Unable to load configuration file: " + args.config_file)
+    # Initialize reporter setup
+    try:
+        setup = ehs.EmonHubFileSetup(args.config_file)
+    except ehs.EmonHubSetupInitError as e:
+        logger.critical(e)
+        sys.exit("Unable to load configuration file: " + args.config_file)
 
-    # # If in "Show settings" mode, print settings and exit
-    # if args.show_settings:
-        # setup.check_settings()
-        # pprint.pprint(setup.settings)
+    # If in "Show settings" mode, print settings and exit
+    if args.show_settings:
+        pprint.pprint(setup.settings)
 
     # Otherwise, create, run, and close EmonHub instance
-    # else:
-    try:
-        reporter = EmonReporter(setup)
-    except Exception as err:
-        sys.exit("Could not start EmonReporter: " + str(err))
     else:
-        reporter.run()
-        # When done, close reporter
-        reporter.close()
-
+        try:
+            reporter = EmonReporter(setup)
+        except Exception as err:
+            sys.exit("Could not start EmonReporter: " + str(err))
+        else:
+            reporter.run()
+            # When done, close reporter
+            reporter.close()
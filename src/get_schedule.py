@@ -4,88 +4,131 @@
 
 Gets remote xml file, parses data and configures heatmiser stats.
 
+The file is fetched with a single conditional GET on a reused session.
+The ETag and Last-Modified of the copy held are kept in a metadata file
+beside it, so an unchanged file costs one 304 response with no body, and
+a changed one is streamed to a temporary file that replaces the old copy
+only once it is complete.
+
 """
 
-###TODO
-# Add tests for XmlGetter
-# Add logging
+from __future__ import absolute_import
+from __future__ import print_function
+import email.utils
+import json
+import logging
+import os
+import tempfile
 
 import requests
-from time import mktime, strptime #strftime, localtime,
-import os #import stat, path, utime
 
-from get_config import url, destfile, username, password
+_log = logging.getLogger("EmonReporter.get_schedule")
 
-class XmlGetter(object):
+METADATA_SUFFIX = '.meta'
+CHUNK_BYTES = 64 * 1024
 
-    def __init__(self, username, password):
+class XmlGetter(object):
+    """Fetches a remote xml file when it has changed."""
+    def __init__(self, username, password, timeout=30, session=None):
         """Setup an XmlGetter.
 
-        """
-        self.url = url
+        Connections are kept open in session between fetches."""
         self.username = username
         self.password = password
-
-    def _get_headers(self, url):
-        """Get the file headers without the body."""
-        h = requests.head(url, allow_redirects=False, auth=(self.username,self.password))
-        print h
-        return h.headers
-
-    def _get_file(self, url):
-        """Get the file"""
-        return requests.get(url, allow_redirects=False, auth=(self.username,self.password))
+        self.timeout = timeout
+        self.session = session if session is not None else requests.Session()
 
     @staticmethod
     def _is_downloadable(header):
         """Does the url contain a downloadable resource?"""
-        content_type = header.get('content-type')
+        content_type = header.get('content-type', '')
         if not 'xml' in content_type.lower():
             #raise FileNotFoundError("File not xml, credetials may be wrong.")
             raise IOError('file not accessible')
 
-
     @staticmethod
-    def _has_changed(header, destfile):
-        """Has the file changed compared to local file. Based on timestamp.
-        If the local file does not exist then remote is different."""
-
+    def _load_metadata(destfile):
+        """Validators of the local copy, empty if there isn't one."""
         if not os.path.exists(destfile):
-            print("file doesn't exist")
-            return True
-        localLastModified = os.stat(destfile).st_mtime
+            return {}
+        try:
+            with open(destfile + METADATA_SUFFIX) as metafile:
+                return json.load(metafile)
+        except (IOError, ValueError):
+            return {}
+
+    def validators(self, destfile):
+        """(ETag, Last-Modified) of the local copy, Nones if there isn't one."""
+        metadata = self._load_metadata(destfile)
+        return metadata.get('etag'), metadata.get('last_modified')
 
-        srvLastModifiedStr = header.get("Last-Modified")
-        srvLastModified = mktime(strptime(srvLastModifiedStr,
-          "%a, %d %b %Y %H:%M:%S GMT"))
-        print localLastModified, srvLastModified
-        return not localLastModified == srvLastModified
+    @staticmethod
+    def _conditional_headers(metadata):
+        """Headers asking for the file only if it differs from the local copy."""
+        headers = {}
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+        return headers
 
     def check_file(self, url, destfile):
         """Checks whether file has changed and gets it if needed.
         Returns True if file was updated."""
+        metadata = self._load_metadata(destfile)
+        try:
+            response = self.session.get(url, headers=self._conditional_headers(metadata),
+                                        auth=(self.username, self.password),
+                                        allow_redirects=False, stream=True,
+                                        timeout=self.timeout)
+        except requests.RequestException as errcatch:
+            raise IOError('could not fetch %s: %s' % (url, errcatch))
+
+        with response:
+            if response.status_code == 304:
+                _log.debug('%s not modified', url)
+                return False
+            if response.status_code != 200:
+                raise IOError('file not accessible, status %d' % response.status_code)
+            #check if downloadable, and otherwise through exception
+            self._is_downloadable(response.headers)
+            self._save(response, destfile)
+
+        _log.info('downloaded %s to %s', url, destfile)
+        return True
 
-        headers = self._get_headers(url)
-        print headers
-
-        #check if downloadable, and otherwise through exception
-        self._is_downloadable(headers)
-        if self._has_changed(headers, destfile):
+    @staticmethod
+    def _save(response, destfile):
+        """Stream the body to destfile, replacing it only once complete, and save its validators."""
+        folder = os.path.dirname(os.path.abspath(destfile))
+        handle, temppath = tempfile.mkstemp(dir=folder, prefix='.' + os.path.basename(destfile))
+        try:
+            with os.fdopen(handle, 'wb') as partfile:
+                for chunk in response.iter_content(CHUNK_BYTES):
+                    partfile.write(chunk)
+                partfile.flush()
+                os.fsync(partfile.fileno())
 
-            response = self._get_file(url)
-            print("len ", len(response.content))
-            open(destfile, 'wb').write(response.content)
-            
             #modify timestamps on local file so that they match the collected file.
-            srvLastModifiedStr = response.headers.get("Last-Modified")
-            srvLastModified = mktime(strptime(srvLastModifiedStr,
-              "%a, %d %b %Y %H:%M:%S GMT"))
-            os.utime(destfile, (srvLastModified, srvLastModified))
-            return True
-            
-        return False
+            last_modified = response.headers.get('Last-Modified')
+            parsed = email.utils.parsedate_tz(last_modified) if last_modified else None
+            if parsed is not None:
+                srv_last_modified = email.utils.mktime_tz(parsed)
+                os.utime(temppath, (srv_last_modified, srv_last_modified))
+            os.replace(temppath, destfile)
+        except (IOError, OSError, requests.RequestException) as errcatch:
+            os.remove(temppath)
+            raise IOError('could not save %s: %s' % (destfile, errcatch))
+
+        metadata = {'etag': response.headers.get('ETag'), 'last_modified': last_modified}
+        metatemp = destfile + METADATA_SUFFIX + '.tmp'
+        with open(metatemp, 'w') as metafile:
+            json.dump(metadata, metafile)
+        os.replace(metatemp, destfile + METADATA_SUFFIX)
 
 if __name__ == "__main__":
+    from get_config import url, destfile, username, password
+
     
     #create XmlGetter
     getter = XmlGetter(username, password)
@@ -95,19 +138,10 @@ if __name__ == "__main__":
         print("downloaded updated file")
     
     # create a new XML file with the results
-    from xml.dom import minidom
     from datetime import datetime, timedelta
-    from pythonrfc3339 import parse_datetime
     import itertools
-    import pytz
-
-    mydoc = minidom.parse(destfile)
-
-    calendars = mydoc.getElementsByTagName('calendar')
-
-    stats = mydoc.getElementsByTagName('stat')
-
-    print(stats)
+    import schedule_engine
+    import schedule_parser
 
     def roundTime(dt=None, dateDelta=timedelta(minutes=15)):
         """Round a datetime object to a multiple of a timedelta
@@ -124,183 +158,30 @@ if __name__ == "__main__":
         rounding = (seconds+roundTo/2) // roundTo * roundTo
         return dt + timedelta(0,rounding-seconds,-dt.microsecond)
 
-    def setfrost(temp):
-        print "setting frost to %s"%(temp)
-    def setholiday(hours, temp):
-        print "setting holiday for %i hours and frost to %i"%(hours, temp)
-
-    timestampnow = pytz.utc.localize(datetime.utcnow())
-    print "timenow", timestampnow
-    for stat in stats[0:5]:
-        #through away past except most recent past
-        #keep today plus 7 days, may be able to add 7th day stuff to start of today particularly if after last event today.
-        #compute spacing between items
-        #if more than 4 in day, order by shortest (including spacing to last entry to day before). Remove items as needed by moving temperatures forward.
-
-        print stat.getElementsByTagName('name')[0].firstChild.data
-        #get target data from xml elements
-        targetholder = stat.getElementsByTagName('targets')
-        targets = targetholder[0].getElementsByTagName('target')
-        
-        #convert to dictionary and parse_datetime, if not to beyond longest likely holiday length
-        targetlist = [{'time': parse_datetime(target.attributes['time'].value), 'temp': target.firstChild.data} for target in targets if parse_datetime(target.attributes['time'].value) <= timestampnow + timedelta(days=16)]
-        #remove all but one historic item
-        inpast = sum(1 for target in targetlist if timestampnow > target['time'])
-        if inpast > 0:
-            del targetlist[:inpast-1]
-        else:
-            print "warning - no history - do something different"
-            targetlist[0:0] = {''}
-
-        #add spacing information, looking back to previous entry
-        targetlist[0]['spacing'] = timedelta(days=1)
-        for i in range(len(targetlist)-1):
-            targetlist[i+1]['spacing'] = targetlist[i+1]['time'] - targetlist[i]['time']
-        #add weekday inforamtion (this could be moved later)
-        for i in range(len(targetlist)):
-            targetlist[i]['weekday'] = targetlist[i]['time'].weekday()
-
-        #print initial state list
-        for target in targetlist:
-            print target['time'].date(), target['time'].time(), target['temp'], target['spacing'], 'n', target['weekday']
-        
-        targetlist2 = []
-        #reduce to 4 targets per day, pulls temps forward over shortest times to compress.
-        #today needs fixing so doesn't include past items in count, because that can be pushed to day before
-        for key, group in itertools.groupby(targetlist, key=lambda target:target['time'].date()):
-            daytargets = list(group)
-            #extra spacing to previous entries
-            spacing = [target['spacing'] for target in daytargets]
-            #sort by spacing smallest to largest
-            gaps = sorted(list(enumerate(spacing)), key=lambda x: x[1])
-            #extra enough entries to remove that will reduce to 4
-            if key == timestampnow.date():
-                #if today, prevent pulling fowards next and following items
-                gapstoremove = [x[0] for x in gaps[2:max(0,len(daytargets)-4+2)]]
-            else:
-                gapstoremove = [x[0] for x in gaps[0:max(0,len(daytargets)-4)]]
-            #print "gaps", key, gapstoremove
-            
-            for tid, target in enumerate(daytargets):
-                if tid in gapstoremove:
-                    #if target is one shortly after previous, pull temp forward, but don't add entry
-                    targetlist2[-1]['temp'] = target['temp']
-                else:
-                    targetlist2.append(target)
-        
-        #print next version of state list
-        #for target in targetlist2:
-        #    print target['time'].date(), target['time'].time(), target['temp'], target['spacing'], 'n', target['weekday']
-        
-        #if no future data, set to frost stat with temp from most recent past
-        if len(targetlist2) < 2:
-            setfrost(targetlist2[0]['temp'])
+    import schedule_writer
+    from serial import SerialException
+    from heatmisercontroller import network
+    from heatmisercontroller.exceptions import HeatmiserResponseError
+
+    hmnetwork = network.HeatmiserNetwork()
+    writer = schedule_writer.ScheduleWriter(
+        schedule_writer.ScheduleCache(destfile + '.written'),
+        errors=(SerialException, HeatmiserResponseError))
+
+    # the stats run on local time, so days and program times are planned in it
+    timestampnow = datetime.now().astimezone()
+    print("timenow", timestampnow)
+    stats = schedule_parser.iter_stats(destfile, timestampnow)
+    for name, targetlist in itertools.islice(stats, 5):
+        print(name)
+        device = schedule_writer.find_device(hmnetwork, name)
+        if device is None:
+            print("warning - no stat called", name)
             continue
-        
-        #if large gap to next event, set holiday and frost temp to suitable holding temperature
-        if not targetlist2[1]['time'].date() == timestampnow.date() and targetlist2[1]['time'].time() - timestampnow.time() > timedelta(hours=24):
-            td = targetlist2[1]['time'].time() - timestampnow.date()
-            holidayhours = td.days * 24 + td.seconds//3600
-            setholiday(holidayhours, targetlist2[0]['temp'])
-        else:
-            holidayhours = 0
-        
-        #work through each day (wrapping if no contents)
-        #treat today differently
-        i = 0
-        #items, today, but after end of any holiday and after current time
-        # today = [i for i in targetlist2 if i['time'].date() == timestampnow.date() and i['time'] >= timestampnow + timedelta(hours=holidayhours)]
-        # if len(today) < 4:
-            # #find items, within 7 days of end of any configured holiday
-            # #same day of week
-            # #time before now
-            # futureday = [i for i in targetlist2 if not i['time'].date() == timestampnow.date() and i['time'] >= timestampnow + timedelta(hours=holidayhours) and i['time'] < timestampnow + timedelta(hours=holidayhours) + timedelta(days=7) and i['time'].time() < timestampnow.time() and i['time'].weekday() == timestampnow.weekday()]
-            
-            # print "ft", len(futureday), futureday, (4-len(today)+1), futureday[:4-len(today)+1]
-            # today[0:0] = futureday[:4-len(today)+1]
-       
-        # print "today", today
-        
-        # for target in today:
-            # print target['time'].date(), target['time'].time(), target['temp'], 'n', target['weekday']
-        
-        print "final list"
-        
-        for i in range(0, 7):
-            daydatetime = timestampnow + timedelta(days=i)
-            day = [target for target in targetlist2 if target['time'].date() == daydatetime.date() and target['time'] >= timestampnow + timedelta(hours=holidayhours)]
-            if i == 0 and len(day) < 4: #if today add one past item
-                day[0:0] = [{'time':timestampnow - timedelta(minutes=10), 'temp': targetlist2[0]['temp'], 'weekday': timestampnow.weekday()}]
-                #bug when time very early in day, should auto shift to day before
-                #if len = 4 should shift to day before
-            if len(day) < 4:
-                #find items, within 7 days of end of any configured holiday
-                #same day of week
-                #time before first existing time
-                futureday = [i for i in targetlist2 if not i['time'].date() == daydatetime.date() and i['time'] >= timestampnow + timedelta(hours=holidayhours) and i['time'] < timestampnow + timedelta(hours=holidayhours) + timedelta(days=7) and i['time'].time() < day[0]['time'].time() and i['time'].weekday() == timestampnow.weekday()]
-                day[0:0] = futureday[:4-len(day)]
-
-            for target in day:
-                print target['time'].date(), target['time'].time(), target['temp'], 'n', target['weekday']
-            
-            
-        # how to wrap entries from last days if any on to today?
-        # how to handle holidays?
-        # how to handle missing days?
-        
-        
-        #print targetlist
-        
-        # for key, group in itertools.groupby(targetlist, key=lambda target:target[0].date()):
-            # daytargets = list(group)
-            # print "a", key, group
-            
-            # #todays items strip previous entries except current
-            # if key == timestampnow.date() and len(daytargets) > 4:
-                # for target in daytargets:
-                    # print target[0].time(), target[1]
-                # #count items in the past.
-                # inpast = sum(1 for target in daytargets if timestampnow > target[0])
-                # print "itemsinpast", inpast
-                # del daytargets[:inpast-1]
-                
-
-            
-            # #process items for later in the week. (might not deal with auto starts well)
-            # #if close pull the temp forwards
-            # if len(daytargets) > 4:
-                # for target in daytargets:
-                    # print target[0].time(), target[1]
-                
-                # #find the time differences between entries
-                # spacing = [daytargets[i+1][0] - daytargets[i][0] for i in range(len(daytargets)-1)]
-                # #order by entry lengths
-                # print spacing
-                # gaps = sorted(list(enumerate(spacing)), key=lambda x: x[1])
-                # gapstoremove = gaps[0:max(1,len(daytargets)-4)]
-                # gapstoremove.sort(key=lambda x: x[0], reverse=True)
-                # print gapstoremove
-                # for id, gap in gapstoremove:
-                    # print "replace", id, daytargets[i:i+2], "with", daytargets[id][0], daytargets[id+1][1]
-                    # daytargets[id:id+2] = [[daytargets[id][0], daytargets[id+1][1]]]
-                    # print "dt", len(daytargets)
-                # for target in daytargets:
-                    # print target[0].time(), target[1]
-
-            # difference = timedelta(minutes=15)
-            # while len(daytargets) > 4 and difference < timedelta(hours=15):
-                # print len(daytargets), range( len(daytargets) - 2, -1, -1)
-                # for i in range( len(daytargets) - 2, -1, -1):
-                    # print "l", i, i+1, daytargets[i+1][0] - daytargets[i][0]
-                    # if daytargets[i+1][0] - daytargets[i][0] <= difference:
-                        # daytargets[i:i+1] = [[daytargets[i][0], daytargets[i+1][1]]]
-
-                # difference *= 2
-
-
-        #for target in targets[0:10]:
-            #2018-11-10T05:15:00+00:00
-            #print datetime.strptime(target.attributes['time'].value, '%Y-%m-%dT%H:%M:%S%z')
-            #print parse_datetime(target.attributes['time'].value)
-            #print target.attributes['time'].value, target.firstChild.data
- 
+        #squeeze targets in to at most 4 a day and decide on frost or holiday
+        plan = schedule_engine.plan(targetlist, timestampnow)
+        if plan is None:
+            print("warning - no targets")
+            continue
+        #only the fields that differ from those last written go on the bus
+        print("wrote %i fields"%writer.write(device, plan))
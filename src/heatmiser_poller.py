@@ -0,0 +1,201 @@
+"""Heatmiser_Poller
+
+Polls the heatmiser stats in tiers, reading fast changing fields every
+poll and slow ones only when the copy cached by heatmisercontroller has
+reached the tier's age, so the slow RS-485 bus carries less per cycle.
+
+Each stat is read on its own behind a circuit breaker, so one failing
+stat doesn't lose the others' readings, and a dead stat is backed off
+exponentially and only probed occasionally instead of costing a serial
+timeout every poll.
+
+"""
+
+from __future__ import absolute_import
+import logging
+import time
+
+import metrics
+
+_log = logging.getLogger("EmonReporter.heatmiser_poller")
+
+# fields making up each stat's row, in the order rows are returned
+FRAME_FIELDS = ['sensorsavaliable', 'airtemp', 'remoteairtemp', 'heatingdemand', 'hotwaterdemand']
+
+# (maximum age in seconds, fields), 0 reads every poll, None uses the field's own default age
+TIERED = [(0, ['airtemp', 'remoteairtemp', 'heatingdemand', 'hotwaterdemand']),
+          (3600, ['sensorsavaliable']),
+          (86400, ['currenttime'])] # the stats' clocks are only checked daily
+
+# every field every poll, as the reporter used to
+UNTIERED = [(0, FRAME_FIELDS),
+            (None, ['currenttime'])]
+
+# sensorsavaliable values whose air temperature is the internal or remote sensor
+INTERNAL_AIR = (0, 3)
+REMOTE_AIR = (1, 4)
+
+# heatmisercontroller raises serial.SerialException, an IOError, and
+# HeatmiserError subclasses of RuntimeError when a stat doesn't respond
+READ_ERRORS = (IOError, RuntimeError)
+
+POLL_SECONDS = metrics.REGISTRY.histogram('emonreporter_heatmiser_poll_seconds',
+                                          'Time taken to poll the heatmiser stats')
+BUS_BYTES = metrics.REGISTRY.counter('emonreporter_heatmiser_bus_bytes_total',
+                                     'Bytes on the heatmiser bus', ['direction'])
+STAT_UP = metrics.REGISTRY.gauge('emonreporter_heatmiser_stat_up',
+                                 'Whether the stat was read on its last poll', ['stat'])
+STAT_SKIPPED = metrics.REGISTRY.counter('emonreporter_heatmiser_stat_skipped_total',
+                                        'Polls a stat was skipped while backed off', ['stat'])
+
+def air_temp(row):
+    """Air temperature from a row of FRAME_FIELDS, None if missing or no air sensor"""
+    if row is None:
+        return None
+    if row[0] in INTERNAL_AIR:
+        return row[1]
+    if row[0] in REMOTE_AIR:
+        return row[2]
+    return None
+
+class CountingPort(object):
+    """Wraps a serial port counting the bytes written and read through it."""
+    def __init__(self, port):
+        object.__setattr__(self, '_port', port)
+        object.__setattr__(self, 'bytes_sent', 0)
+        object.__setattr__(self, 'bytes_received', 0)
+
+    def write(self, data):
+        """Write to the port, counting the bytes."""
+        result = self._port.write(data)
+        object.__setattr__(self, 'bytes_sent', self.bytes_sent + len(data))
+        return result
+
+    def read(self, size=1):
+        """Read from the port, counting the bytes."""
+        data = self._port.read(size)
+        object.__setattr__(self, 'bytes_received', self.bytes_received + len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._port, name)
+
+    def __setattr__(self, name, value):
+        # settings such as timeout belong to the real port
+        setattr(self._port, name, value)
+
+class CircuitBreaker(object):
+    """Backs off a failing device, doubling the wait up to maximum while it keeps failing.
+
+    Once the wait is over one probe is allowed; success closes the breaker,
+    failure opens it again for longer. A backoff of 0 never opens."""
+    def __init__(self, backoff, maximum, clock):
+        self._backoff = backoff
+        self._maximum = maximum
+        self._clock = clock
+        self._retry_at = None # time a probe is next allowed while open
+        self.failures = 0 # consecutive failures
+
+    def configure(self, backoff, maximum):
+        """Change the backoff, taking effect from the next failure."""
+        self._backoff = backoff
+        self._maximum = maximum
+
+    @property
+    def closed(self):
+        """Whether the device is being read normally."""
+        return self._retry_at is None
+
+    def allow(self):
+        """Whether the device should be read now."""
+        return self._retry_at is None or self._clock() >= self._retry_at
+
+    def success(self):
+        """Record a good read, closing the breaker."""
+        self.failures = 0
+        self._retry_at = None
+
+    def failure(self):
+        """Record a failed read, returning the seconds until the next probe."""
+        self.failures += 1
+        if not self._backoff:
+            return 0
+        wait = min(self._maximum, self._backoff * 2 ** (self.failures - 1))
+        self._retry_at = self._clock() + wait
+        return wait
+
+class HeatmiserPoller(object):
+    """Reads the fields due in each tier from each stat and returns rows of fresh and cached values.
+
+    Rows are None for stats that failed or are backed off."""
+    def __init__(self, hmnetwork, tiers=TIERED, clock=time.monotonic, backoff=60,
+                 max_backoff=3600, errors=READ_ERRORS):
+        self._network = hmnetwork
+        self._tiers = [(maxage, list(fields)) for maxage, fields in tiers]
+        self._clock = clock
+        self._errors = errors
+        self.breakers = [CircuitBreaker(backoff, max_backoff, clock)
+                         for _ in hmnetwork.controllers]
+
+        # count bus traffic if the network has a real serial adaptor
+        self._port = None
+        adaptor = getattr(hmnetwork, 'adaptor', None)
+        if adaptor is not None and hasattr(adaptor, 'serport'):
+            port = self._port = adaptor.serport = CountingPort(adaptor.serport)
+            BUS_BYTES.set_function(lambda: port.bytes_sent, 'sent')
+            BUS_BYTES.set_function(lambda: port.bytes_received, 'received')
+
+        self.polls = 0
+        self.last_seconds = 0.0
+        self.last_bytes = 0
+
+    def configure(self, tiers, backoff, max_backoff):
+        """Change the tiers and backoff, keeping the state of each stat."""
+        self._tiers = [(maxage, list(fields)) for maxage, fields in tiers]
+        for breaker in self.breakers:
+            breaker.configure(backoff, max_backoff)
+
+    def poll(self):
+        """Read due fields and return a row of FRAME_FIELDS values, or None, for each stat."""
+        start = self._clock()
+        bytes_before = self.bus_bytes
+        rows = [self._poll_stat(controller, breaker)
+                for controller, breaker in zip(self._network.controllers, self.breakers)]
+
+        self.polls += 1
+        self.last_seconds = self._clock() - start
+        self.last_bytes = self.bus_bytes - bytes_before
+        POLL_SECONDS.observe(self.last_seconds)
+        _log.debug('heatmiser poll took %.3f s, %d bus bytes', self.last_seconds,
+                        self.last_bytes)
+        return rows
+
+    def _poll_stat(self, controller, breaker):
+        stat = str(controller.set_address)
+        if not breaker.allow():
+            STAT_SKIPPED.inc(stat)
+            return None
+        try:
+            for maxage, fields in self._tiers:
+                # heatmisercontroller only goes to the bus for fields older than maxage
+                controller.read_fields(fields, maxage)
+            # present fields come from the cache without touching the bus
+            row = controller.read_fields(FRAME_FIELDS, -1)
+        except self._errors as errcatch:
+            wait = breaker.failure()
+            _log.warning("C%s failed to read due to %s, %d failures, next try in %d s",
+                            stat, str(errcatch), breaker.failures, wait)
+            STAT_UP.set(0, stat)
+            return None
+        if not breaker.closed:
+            _log.info("C%s is responding again", stat)
+        breaker.success()
+        STAT_UP.set(1, stat)
+        return row
+
+    @property
+    def bus_bytes(self):
+        """Bytes sent and received on the bus so far, 0 if not counted."""
+        if self._port is None:
+            return 0
+        return self._port.bytes_sent + self._port.bytes_received
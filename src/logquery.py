@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+"""LogQuery
+
+Reads back the local daily text logs written by LocalDatalogger and
+reduces a sensor's readings over a time range to min, mean and max per
+time bucket.
+
+Records are streamed one day file at a time through generators, so memory
+use doesn't depend on the length of the range. Each day file gets a sparse
+index of read time to byte offset, built the first time a query starts
+part way through that day and cached beside the log as testlog<day>.txt.idx,
+so later queries seek rather than scan from the start of the day.
+
+usage: logquery.py [--logfolder FOLDER] sensor start end [bucket]
+
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import argparse
+import bisect
+import calendar
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+INDEX_STRIDE = 16384 # bytes of log between index entries
+INDEX_SUFFIX = '.idx'
+
+# 1-wire lines 'time:/28.XXXX:+21.50'
+# heatmiser lines 'time:TEMP20,21DEMAND0,1HOTW1'
+_HEATMISER_LINE = re.compile(r'TEMP([-\d.,]*)DEMAND([-\d.,]*)HOTW([-\d.]+)$')
+
+def log_path(logfolder, day):
+    """Name of the text log for a day number, as LocalDatalogger names it"""
+    return os.path.join(logfolder, 'testlog' + str(float(day)) + '.txt')
+
+def parse_line(line):
+    """Split a log line into (read time, [(sensor id, value), ...]).
+
+    Heatmiser values get the ids TEMP<n>, DEMAND<n> and HOTW. Returns None
+    for lines that can't be parsed."""
+    try:
+        timestring, rest = line.rstrip('\r\n').split(':', 1)
+        read_time = int(float(timestring))
+        match = _HEATMISER_LINE.match(rest)
+        if match is None:
+            sensor, value = rest.rsplit(':', 1)
+            return read_time, [(sensor, float(value))]
+        values = []
+        for prefix, group in zip(('TEMP', 'DEMAND'), match.groups()):
+            if group:
+                values.extend((prefix + str(index), float(value))
+                              for index, value in enumerate(group.split(',')))
+        values.append(('HOTW', float(match.group(3))))
+        return read_time, values
+    except ValueError:
+        return None
+
+def _line_time(line):
+    """Read time at the start of a line, None if it hasn't one"""
+    try:
+        return int(float(line.split(b':', 1)[0]))
+    except ValueError:
+        return None
+
+class SparseIndex(object):
+    """Read time to byte offset entries roughly every INDEX_STRIDE bytes of a log."""
+    def __init__(self, path):
+        self._path = path
+        self._indexpath = path + INDEX_SUFFIX
+        self.times = []
+        self.offsets = []
+        self.size = 0 # bytes of the log covered by the index
+
+    def offset_for(self, start):
+        """Byte offset at or before the first line with a read time of start or later"""
+        self._update()
+        position = bisect.bisect_left(self.times, start) - 1
+        return self.offsets[position] if position >= 0 else 0
+
+    def _update(self):
+        """Load the cached index and extend it over anything appended since."""
+        try:
+            logsize = os.path.getsize(self._path)
+        except OSError:
+            return
+        if not self.size:
+            self._load()
+        if self.size > logsize:
+            # log has been replaced, start again
+            self.times, self.offsets, self.size = [], [], 0
+        if self.size == logsize:
+            return
+
+        with open(self._path, 'rb') as logfile:
+            logfile.seek(self.size)
+            offset = self.size
+            last = self.offsets[-1] if self.offsets else -INDEX_STRIDE
+            for line in logfile:
+                if not line.endswith(b'\n'):
+                    break # partly written line, index it next time
+                read_time = _line_time(line)
+                if offset - last >= INDEX_STRIDE and read_time is not None:
+                    self.times.append(read_time)
+                    self.offsets.append(offset)
+                    last = offset
+                offset += len(line)
+        self.size = offset
+        self._save()
+
+    def _load(self):
+        """Read the cached index, ignoring it if missing or damaged."""
+        try:
+            with open(self._indexpath) as indexfile:
+                cached = json.load(indexfile)
+            self.times, self.offsets, self.size = cached['times'], cached['offsets'], cached['size']
+        except (IOError, ValueError, KeyError, TypeError):
+            self.times, self.offsets, self.size = [], [], 0
+
+    def _save(self):
+        """Atomically replace the cached index, it is only an optimisation so errors are logged."""
+        try:
+            with open(self._indexpath + '.tmp', 'w') as indexfile:
+                json.dump({'size': self.size, 'times': self.times, 'offsets': self.offsets},
+                            indexfile)
+            os.replace(self._indexpath + '.tmp', self._indexpath)
+        except (IOError, OSError) as errcatch:
+            logging.debug('could not cache log index %s: %s', self._indexpath, errcatch)
+
+def read_records(logfolder, start, end, sensor=None):
+    """Generate (read time, sensor id, value) for records from start up to end.
+
+    sensor limits the records to a single sensor id."""
+    for day in range(int(start) // 86400, (int(end) - 1) // 86400 + 1):
+        path = log_path(logfolder, day)
+        if not os.path.exists(path):
+            continue
+        offset = 0
+        if start > day * 86400:
+            offset = SparseIndex(path).offset_for(start)
+        with open(path, 'rb') as logfile:
+            logfile.seek(offset)
+            for line in logfile:
+                parsed = parse_line(line.decode('ascii', 'replace'))
+                if parsed is None:
+                    continue
+                read_time, values = parsed
+                if read_time >= end:
+                    break
+                if read_time < start:
+                    continue
+                for sensorid, value in values:
+                    if sensor is None or sensorid == sensor:
+                        yield read_time, sensorid, value
+
+def downsample(records, bucket):
+    """Generate (bucket start, min, mean, max, count) from time ordered records."""
+    current = None
+    for read_time, _, value in records:
+        bucket_start = read_time - read_time % bucket
+        if bucket_start != current:
+            if current is not None:
+                yield current, low, total / count, high, count
+            current, low, high, total, count = bucket_start, value, value, 0.0, 0
+        low = min(low, value)
+        high = max(high, value)
+        total += value
+        count += 1
+    if current is not None:
+        yield current, low, total / count, high, count
+
+def query(logfolder, sensor, start, end, bucket):
+    """Min, mean and max of sensor per bucket seconds from start up to end."""
+    return downsample(read_records(logfolder, start, end, sensor), bucket)
+
+def parse_time(text):
+    """Seconds since the epoch from a number or a UTC 'YYYY-MM-DD[THH:MM[:SS]]' string"""
+    try:
+        return int(float(text))
+    except ValueError:
+        pass
+    for timeformat in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return calendar.timegm(time.strptime(text, timeformat))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError("can't read time %r" % text)
+
+def get_args():
+    """Setups and parser and processes the arguements"""
+    parser = argparse.ArgumentParser(
+            description='Summarise a sensor from the local daily logs')
+    parser.add_argument('sensor', help='1-wire sensor path, TEMP<n>, DEMAND<n> or HOTW')
+    parser.add_argument('start', type=parse_time,
+                        help='start time, epoch seconds or UTC YYYY-MM-DDTHH:MM')
+    parser.add_argument('end', type=parse_time, help='end time, not included')
+    parser.add_argument('bucket', type=int, nargs='?', default=3600,
+                        help='bucket size in seconds (default: 3600)')
+    parser.add_argument('--logfolder', action='store',
+                        help='Log folder', default=sys.path[0] + '/../logs')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    ARGS = get_args()
+    print('bucket,min,mean,max,count')
+    for ROW in query(ARGS.logfolder, ARGS.sensor, ARGS.start, ARGS.end, ARGS.bucket):
+        print('%d,%.2f,%.3f,%.2f,%d' % ROW)
@@ -0,0 +1,187 @@
+"""OneWire_Discovery
+
+Finds the 1-wire sensors on the bus, remembering what has been found in a
+cache file so restarts don't need to probe every device again, and
+rescans the bus in a background thread so sensors that come back or are
+added are noticed without a restart.
+
+"""
+
+from __future__ import absolute_import
+import json
+import logging
+import os
+import threading
+import time
+
+import pyownet # use OWFS pyownet module
+
+_log = logging.getLogger("EmonReporter.onewire_discovery")
+
+class DiscoveryCache(object):
+    """Sensor id -> family, last seen time and whether it's a temperature sensor, kept in a json file.
+
+    With no path the cache is only kept in memory."""
+    def __init__(self, path):
+        self._path = path
+        self.devices = {}
+        if path is None:
+            return
+        try:
+            with open(path) as cachefile:
+                self.devices = json.load(cachefile)
+        except (IOError, ValueError):
+            pass
+
+    def get(self, sensor):
+        """Cached entry for sensor, None if it has never been probed"""
+        return self.devices.get(sensor)
+
+    def record(self, sensor, temperature, seen):
+        """Store the result of probing sensor."""
+        self.devices[sensor] = {'family': sensor.strip('/').split('.')[0],
+                                'temperature': bool(temperature), 'last_seen': seen}
+
+    def seen(self, sensor, seen):
+        """Update when a known sensor was last on the bus."""
+        self.devices[sensor]['last_seen'] = seen
+
+    def save(self):
+        """Atomically replace the cache file, errors only mean a slower next start."""
+        if self._path is None:
+            return
+        try:
+            with open(self._path + '.tmp', 'w') as cachefile:
+                json.dump(self.devices, cachefile, indent=1, sort_keys=True)
+            os.replace(self._path + '.tmp', self._path)
+        except (IOError, OSError) as errcatch:
+            _log.warning('failed to save 1 wire discovery cache %s: %s', self._path, errcatch)
+
+def check_sensor(ownetobj, name, type_label):
+    """Check whether sensor is temperature or not"""
+    try:
+        if ownetobj.present(name + '/latesttemp'):
+            # get the temperature from that sensor
+            temp = float(ownetobj.read(name + '/latesttemp'))
+            _log.info("%s sensor, %s, found with initial reading %s.",
+                            type_label, name, temp)
+        else:
+            # log the non temperature sensors
+            _log.warning("%s sensor, %s, is a non temperature sensor that won't be logged.",
+                                type_label, name)
+            return 0
+    except pyownet.protocol.Error:
+        _log.warning("%s sensor, %s, went away during setup.", type_label, name)
+        return 0
+
+    return 1
+
+class OneWireDiscovery(object):
+    """Tracks which expected sensors are on the bus.
+
+    sensors is the list to sample, either all the expected sensors or empty
+    while none have been found. It is updated in place by rescans so
+    whoever holds it sees sensors added back."""
+    def __init__(self, ownetobj, expected_sensors, cache, conversion=None):
+        self._ownet = ownetobj
+        self._expected = list(expected_sensors)
+        self._cache = cache
+        self._conversion = conversion # function running a conversion before first reads
+        self._absent = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.sensors = []
+        self.rescans = 0
+
+    @property
+    def expected(self):
+        """Sensors this discovery was set up to look for."""
+        return list(self._expected)
+
+    def startup(self):
+        """Find expected sensors, only probing ones not already in the cache.
+
+        Returns the number of expected temperature sensors found."""
+        now = time.time()
+        unknown = [sensor for sensor in self._expected if self._cache.get(sensor) is None]
+        if unknown and self._conversion is not None:
+            self._conversion(self._ownet)
+
+        found_sensors = 0 # initialise number of expected temperature sensors found so far
+        for sensor in self._expected:
+            entry = self._cache.get(sensor)
+            if entry is not None:
+                found_sensors += entry['temperature']
+            elif self._ownet.present(sensor):
+                found = check_sensor(self._ownet, sensor, "Expected")
+                self._cache.record(sensor, found, now)
+                found_sensors += found
+            else:
+                _log.warning("Expected sensor, %s, not found.", sensor)
+                self._absent.add(sensor)
+        self._cache.save()
+
+        _log.info("%d of %d expected sensors known, %d probed", found_sensors,
+                        len(self._expected), len(unknown))
+        if found_sensors:
+            self.sensors[:] = self._expected
+        return found_sensors
+
+    def rescan(self):
+        """List the bus, probe new devices and add sensors back if they have returned."""
+        try:
+            # list every sensor on the bus added that could be added to the list
+            rawlist = self._ownet.dir()
+        except pyownet.protocol.Error as errcatch:
+            _log.warning('Could not list 1 wire bus due to %s', str(errcatch))
+            return
+        now = time.time()
+        self.rescans += 1
+
+        onbus = set(sensor.rstrip('/') for sensor in rawlist)
+        for sensor in onbus:
+            entry = self._cache.get(sensor)
+            if entry is None:
+                found = check_sensor(self._ownet, sensor,
+                                     "Expected" if sensor in self._expected else "New")
+                self._cache.record(sensor, found, now)
+            else:
+                self._cache.seen(sensor, now)
+            if sensor in self._absent:
+                _log.info("Expected sensor, %s, is back.", sensor)
+                self._absent.discard(sensor)
+
+        for sensor in self._expected:
+            if sensor not in onbus and sensor not in self._absent:
+                _log.warning("Expected sensor, %s, not found.", sensor)
+                self._absent.add(sensor)
+        self._cache.save()
+
+        if not self.sensors and any(sensor in onbus and self._cache.get(sensor)['temperature']
+                                    for sensor in self._expected):
+            _log.info("expected sensors found on rescan, sampling them")
+            self.sensors[:] = self._expected
+
+        _log.debug("bus rescan found %d devices, %d expected missing", len(onbus),
+                        len(self._absent))
+
+    def start(self, interval):
+        """Rescan every interval seconds in a background thread, starting now."""
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='1wire rescan')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background rescans."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            try:
+                self.rescan()
+            except Exception: # keep rescanning whatever goes wrong
+                _log.exception('1 wire bus rescan failed')
+            self._stop.wait(interval)
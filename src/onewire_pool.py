@@ -0,0 +1,68 @@
+"""OneWire_Pool
+
+Reads 1-wire temperature sensors concurrently over a small pool of
+persistent owserver connections.
+
+"""
+
+from __future__ import absolute_import
+import logging
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pyownet # use OWFS pyownet module
+
+import metrics
+
+_log = logging.getLogger("EmonReporter.onewire_pool")
+
+READ_SECONDS = metrics.REGISTRY.histogram('emonreporter_1wire_read_seconds',
+                                          'Time taken to read each 1-wire sensor', ['sensor'])
+
+class OneWireReadPool(object):
+    """Pool of persistent owserver proxies for reading many sensors in parallel."""
+    def __init__(self, ownetobj, workers=4, timeout=1.0):
+        self._timeout = timeout
+        self._proxies = queue.Queue()
+        for _ in range(workers):
+            # clone copies host, port and flags of the existing proxy
+            self._proxies.put(pyownet.protocol.clone(ownetobj, persistent=True))
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+        self.latency = {} # seconds taken by the last read of each sensor
+
+    def read_temps(self, sensors):
+        """Read latesttemp from all sensors at once.
+
+        Returns a list of temperatures in the same order as sensors, with None
+        for any sensor that failed or timed out."""
+        futures = [self._executor.submit(self._read_temp, sensor) for sensor in sensors]
+        temps = [future.result() for future in futures]
+
+        if sensors:
+            latencies = [self.latency[sensor] for sensor in sensors]
+            _log.debug('1-wire reads took mean %.1f ms, max %.1f ms',
+                            1000 * sum(latencies) / len(latencies), 1000 * max(latencies))
+        return temps
+
+    def close(self):
+        """Stop worker threads and close owserver connections."""
+        self._executor.shutdown()
+        while not self._proxies.empty():
+            self._proxies.get().close_connection()
+
+    def _read_temp(self, sensor):
+        """Read one sensor using a proxy from the pool."""
+        proxy = self._proxies.get()
+        start = time.monotonic()
+        try:
+            temp = float(proxy.read(sensor + '/latesttemp', timeout=self._timeout))
+        except pyownet.protocol.Error as errcatch:
+            _log.debug('Sensor %s read failed due to %s', sensor, errcatch)
+            temp = None
+        finally:
+            self._proxies.put(proxy)
+        self.latency[sensor] = time.monotonic() - start
+        READ_SECONDS.observe(self.latency[sensor], sensor)
+        return temp
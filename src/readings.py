@@ -0,0 +1,104 @@
+"""Readings
+
+Typed readings passed from interfacers to reporters, and the bounded
+queues that carry them.
+
+A queue never grows without limit. A producer can wait for space, which
+slows only that producer, and once the wait is over, or if it won't wait,
+the oldest reading is dropped so the newest always gets through. Depth,
+high water mark and drops are exported as metrics.
+
+"""
+
+from __future__ import absolute_import
+import collections
+import threading
+import time
+
+import emonhub_coder
+import metrics
+
+# kind of value -> (emonhub datacode, scale applied before packing, packed value for a failed read)
+KINDS = {'temperature': ('h', 10, None), # null from the reporter's temperaturenull
+         'state': ('B', 1, 99)}
+
+Reading = collections.namedtuple('Reading', ['source', 'node', 'read_time',
+                                             'sensors', 'kinds', 'values'])
+Reading.__doc__ = """Values read from sensors of one source at read_time.
+
+kinds gives the kind of each value, values are in sensor units with None
+for a sensor that failed to read."""
+
+def encode_reading(reading, temperaturenull=-10):
+    """emonhub frame for a reading, without the line ending"""
+    return emonhub_coder.frame_text(*pack_reading(reading, temperaturenull))
+
+def pack_reading(reading, temperaturenull=-10):
+    """(node, packed payload) of the emonhub frame for a reading"""
+    datacodes = ''
+    packed = []
+    for kind, value in zip(reading.kinds, reading.values):
+        datacode, scale, null = KINDS[kind]
+        if value is None:
+            value = temperaturenull if null is None else null
+        datacodes += datacode
+        packed.append(int(round(value * scale)))
+    return reading.node, emonhub_coder.encode_many(datacodes, packed)
+
+QUEUE_DEPTH = metrics.REGISTRY.gauge('emonreporter_queue_depth',
+                                     'Readings waiting in a queue', ['queue'])
+QUEUE_HIGH_WATER = metrics.REGISTRY.gauge('emonreporter_queue_high_water',
+                                          'Most readings ever waiting in a queue', ['queue'])
+QUEUE_DROPPED = metrics.REGISTRY.counter('emonreporter_queue_dropped_total',
+                                         'Readings dropped from a full queue', ['queue'])
+
+class BoundedQueue(object):
+    """Thread safe first in first out queue holding at most maxsize items."""
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self._items = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+        self.high_water = 0
+        self.dropped = 0
+        QUEUE_DEPTH.set_function(lambda: len(self), name)
+        QUEUE_HIGH_WATER.set_function(lambda: self.high_water, name)
+        QUEUE_DROPPED.set_function(lambda: self.dropped, name)
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item, timeout=0):
+        """Add item, waiting up to timeout seconds for space.
+
+        Returns False if the oldest item had to be dropped to make room."""
+        with self._not_full:
+            if timeout:
+                deadline = time.monotonic() + timeout
+                while len(self._items) >= self.maxsize:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._not_full.wait(remaining)
+            dropped = len(self._items) >= self.maxsize
+            if dropped:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self.high_water = max(self.high_water, len(self._items))
+            self._not_empty.notify()
+        return not dropped
+
+    def get(self, timeout=None):
+        """Oldest item, waiting up to timeout seconds for one, None if there is none."""
+        with self._not_empty:
+            if not self._items:
+                self._not_empty.wait(timeout)
+                if not self._items:
+                    return None
+            item = self._items.popleft()
+            self._not_full.notify()
+            return item
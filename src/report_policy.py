@@ -0,0 +1,82 @@
+"""Report_Policy
+
+Decides which sampled frames are worth sending and logging, and how often
+to sample.
+
+emonhub node frames are positional, so values can't be left out of a
+frame individually. Instead each sensor has a deadband and a frame is
+reported when any of its values has moved by more than its sensor's
+deadband since that sensor was last reported, when a sensor is new, or
+when the heartbeat interval has passed without a report.
+
+The sample interval adapts between fast_interval while values are moving
+and slow_interval, doubling each cycle that nothing moves.
+
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+import logging
+
+_log = logging.getLogger("EmonReporter.report_policy")
+
+class ReportPolicy(object):
+    """Deadband, heartbeat and adaptive interval policy for frames of sensor values."""
+    def __init__(self, deadband, heartbeat=0, slow_interval=None, fast_interval=None,
+                 deadbands=None):
+        self._deadband = deadband
+        self._deadbands = dict(deadbands or {}) # sensor id -> deadband overriding the default
+        self._heartbeat = heartbeat
+        self._slow_interval = slow_interval
+        self._fast_interval = fast_interval or slow_interval
+        self._last = {} # sensor id -> (value, time) last reported
+        self._moved = False # any value outside its deadband since next_interval was called
+
+        self.interval = slow_interval
+        self.frames_offered = 0
+        self.frames_reported = 0
+
+    def due(self, values, now):
+        """Whether a frame of (sensor id, value) pairs read at now should be reported.
+
+        If it is, all its values are recorded as reported."""
+        self.frames_offered += 1
+        reason = None
+        for sensor, value in values:
+            try:
+                lastvalue, lasttime = self._last[sensor]
+            except KeyError:
+                reason = reason or 'new sensor %s' % sensor
+                continue
+            if abs(value - lastvalue) > self._deadbands.get(sensor, self._deadband):
+                self._moved = True
+                reason = reason or '%s moved %+.2f' % (sensor, value - lastvalue)
+            elif self._heartbeat and now - lasttime >= self._heartbeat:
+                reason = reason or 'heartbeat'
+
+        if reason is None:
+            _log.debug('frame within deadband, not reported')
+            return False
+
+        _log.debug('frame reported, %s', reason)
+        self.frames_reported += 1
+        for sensor, value in values:
+            self._last[sensor] = (value, now)
+        return True
+
+    def next_interval(self):
+        """Sample interval to use next, fast while values are moving."""
+        if self._slow_interval is not None:
+            if self._moved:
+                self.interval = self._fast_interval
+            else:
+                self.interval = min(self._slow_interval, self.interval * 2)
+        self._moved = False
+        return self.interval
+
+    @property
+    def suppressed(self):
+        """Fraction of frames offered that weren't reported."""
+        if not self.frames_offered:
+            return 0.0
+        return 1 - self.frames_reported / self.frames_offered
@@ -20,8 +20,13 @@ import logging
 # hm imports
 from heatmisercontroller import logging_setup
 
-from rept_1wire_hmv2 import initialise_setup, initialise_1wire, get_1wire_data
-from rept_1wire_hmv2 import LocalDatalogger, get_args, send_message
+import cycle_timer
+
+from rept_1wire_hmv2 import initialise_setup, initialise_1wire, initialise_1wire_pool
+from rept_1wire_hmv2 import initialise_1wire_buses, start_1wire_conversions, get_1wire_buses_data
+from rept_1wire_hmv2 import initialise_datalogger, get_args, send_message, initialise_emonhub
+from rept_1wire_hmv2 import initialise_sampler, initialise_metrics, initialise_report_policy
+from rept_1wire_hmv2 import adapt_sample_interval
 
 args = get_args('Rolling 1-wire temperatures report')
 
@@ -38,23 +43,35 @@ logging.info("1 wire bus reporting")
 logging.info("  sample interval: %d seconds", sample_interval )
 
 onewirenetwork, sensorlist1wire = initialise_1wire()
+onewirepool = initialise_1wire_pool(onewirenetwork)
+onewirebuses = initialise_1wire_buses(onewirenetwork, sensorlist1wire, onewirepool)
 
-datalogger = LocalDatalogger(setup.settings['logging']['logfolder'])
+datalogger = initialise_datalogger(setup.settings['logging'])
 
-logging.info("Entering reading loop")
+emonhub = initialise_emonhub(setup.settings['emonsocket'], setup.settings['logging']['logfolder'])
+
+metricsserver = initialise_metrics(setup.settings.get('metrics', {}))
 
-# now loop forever reading the identified sensors
-while 1:
-    # determine how long to wait until next interval
-    # note this will skip some if specified interval is too short
-    #  - it finds the next after now, not next after last
-    sleeptime = sample_interval - (time.time() % sample_interval)
-    time.sleep(sleeptime)
+cycletimer = cycle_timer.CycleTimer()
 
+def sample_cycle():
+    """Sample and send all the 1-wire sensors"""
     # get time now and record it
     read_time = int(time.time()) # we only record to integer seconds
 
     logging.info("Logging cyle at %d", read_time)
-    output_message = get_1wire_data(onewirenetwork, sensorlist1wire)
+    cycletimer.start()
+    with cycletimer.stage('1wire'):
+        output_message = get_1wire_buses_data(onewirebuses, start_1wire_conversions(onewirebuses),
+                                              reportpolicy)
 
-    send_message(setup, output_message)
+    with cycletimer.stage('send'):
+        send_message(emonhub, output_message, read_time)
+    cycletimer.finish()
+    adapt_sample_interval(reportpolicy, sampletimer)
+
+sampler, sampletimer, _ = initialise_sampler(setup.settings, sample_interval, sample_cycle)
+reportpolicy = initialise_report_policy(setup.settings.get('reporting', {}), sample_interval)
+
+logging.info("Entering reading loop")
+sampler.run()
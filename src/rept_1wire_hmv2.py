@@ -16,11 +16,15 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import os
 import sys
 import time
 import argparse
-import socket
 import logging
+import atexit
+import signal
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from serial import SerialException
 import pyownet # use OWFS pyownet module
 
@@ -30,6 +34,39 @@ from heatmisercontroller.exceptions import HeatmiserResponseError, HeatmiserCont
 import heatmisercontroller.setup as hms
 
 import emonhub_coder
+import emonhub_client
+import spool
+import onewire_pool
+import onewire_discovery
+import cycle_timer
+import scheduler
+import metrics
+import report_policy
+import heatmiser_poller
+import config_watch
+from datalogger import LocalDatalogger, BufferedDatalogger
+import binlog
+
+CONVERSION_TIME = 0.75 # seconds needed for a 12 bit temperature conversion
+
+BUS_RETRY_INTERVAL = 60 # seconds between attempts to reach an owserver that couldn't be
+
+SETTINGS_INTERVAL = 5 # seconds between checks of the config file when inotify isn't available
+
+# sections only read at startup
+RESTART_SECTIONS = ('logging', 'metrics', 'controller', 'serial', 'devicesgeneral', 'devices')
+
+# (section, key, type) of settings read when sections are rebuilt while running
+REQUIRED_SETTINGS = (('1wire', 'sensors', None), ('emonsocket', 'host', None),
+                     ('emonsocket', 'port', int), ('emonsocket', 'node', None),
+                     ('emonsocket', 'temperaturenull', float), ('logging', 'logfolder', None))
+
+READ_FAILURES = metrics.REGISTRY.counter('emonreporter_1wire_read_failures_total',
+                                         'Sensor reads reported as temperaturenull', ['sensor'])
+RELOAD_SECONDS = metrics.REGISTRY.histogram('emonreporter_config_reload_seconds',
+                                            'Time taken to apply a changed config file')
+RELOAD_REBUILT = metrics.REGISTRY.counter('emonreporter_config_rebuilt_total',
+                                          'Components rebuilt by config reloads', ['component'])
 
 def initialise_setup(configfile):
     """Initialise setup loading configuration file."""
@@ -44,124 +81,298 @@ def initialise_setup(configfile):
     return int_setup, configfile
 
 def initialise_1wire():
-    """Initialise 1 wire network and check for sensors"""
-    logging.debug("locate sensors and take initial readings:")
-    expected_sensors = setup.settings['1wire']['sensors']
-
+    """Initialise 1 wire network and check for sensors
+
+    Sensors already in the discovery cache aren't probed again, and the bus
+    is rescanned in the background, so the sensor list returned is updated
+    in place if sensors are found later. The owserver is None, with no
+    sensors, if it couldn't be reached."""
+    onewiresettings = setup.settings['1wire']
+    host, port, cachepath = _owserver_settings(onewiresettings, '1wire_discovery.json')
+    return _initialise_owserver(host, port, onewiresettings['sensors'], cachepath)
+
+def _owserver_settings(bussettings, cachename):
+    """(host, port, discovery cache path) of the owserver in a bus's settings"""
+    return (bussettings.get('owhost', 'localhost'), int(bussettings.get('owport', 4304)),
+            bussettings.get('discovery_cache',
+                            setup.settings['logging']['logfolder'] + '/' + cachename))
+
+# owservers in use, (host, port) -> (proxy, discovery), reused when settings are reloaded
+_owservers = {}
+
+def _initialise_owserver(host, port, expected_sensors, cachepath):
+    """Connect to an owserver and find its sensors, reusing the connection if already made
+
+    Returns (proxy, sensors), (None, []) if the owserver couldn't be reached."""
+    key = (host, int(port))
+    ownet, olddiscovery = _owservers.get(key, (None, None))
+    if olddiscovery is not None and olddiscovery.expected == list(expected_sensors):
+        return ownet, olddiscovery.sensors
+
+    logging.debug("locate sensors and take initial readings on %s:%s:", host, port)
+    onewiresettings = setup.settings['1wire']
     try:
-        # connect to localhost port where owserver should be running
-        ownet = pyownet.protocol.proxy(host='localhost', port=setup.settings['1wire']['owport'])
-        found_sensors = _log_expected_sensors(ownet, expected_sensors)
+        # connect to the port where owserver should be running
+        if ownet is None:
+            ownet = pyownet.protocol.proxy(host=host, port=port)
+        discovery = onewire_discovery.OneWireDiscovery(ownet, expected_sensors,
+                                                       onewire_discovery.DiscoveryCache(cachepath),
+                                                       _log_conversion)
+        found_sensors = discovery.startup()
     except (pyownet.protocol.Error) as errcatch:
         logging.warning('Could not connect to ow due to %s', str(errcatch))
-        return []
-
-    rawlist = _log_other_sensors(ownet, expected_sensors)
+        return None, []
 
-    logging.info("bus search done for sensors - %i found - %i temperature - %i missing",
-                    len(rawlist),
+    logging.info("startup done for sensors - %i temperature - %i missing",
                     found_sensors,
                     len(expected_sensors) - found_sensors)
 
-    if found_sensors == 0:
-        return ownet, []
-
-    return ownet, expected_sensors
-
-def _check_sensor(ownetobj, name, type_label):
-    """Check whether sensor is temperature or not"""
-    try:
-        if ownetobj.present(name + '/latesttemp'):
-            # get the temperature from that sensor
-            temp = float(ownetobj.read(name + '/latesttemp'))
-            logging.info("%s sensor, %s, found with initial reading %s.",
-                            type_label, name, temp)
-        else:
-            # log the non temperature sensors
-            logging.warning("%s sensor, %s, is a non temperature sensor that won't be logged.",
-                                type_label, name)
-            return 0
-    except pyownet.protocol.Error:
-        logging.warning("%s sensor, %s, went away during setup.", type_label, name)
-        return 0
-
-    return 1
+    if olddiscovery is not None:
+        olddiscovery.stop()
+    discovery.start(float(onewiresettings.get('rescan_interval', 600)))
+    _owservers[key] = (ownet, discovery)
+    return ownet, discovery.sensors
 
-def _log_expected_sensors(ownetobj, expected_sensors):
-    """Count expected sensors that are avaliable"""
-    _start_conversion(ownetobj)
-
-    found_sensors = 0 # initialise number of expected temperature sensors found so far
-    for sensor in expected_sensors:
-        #logging.info("  considering " + str(s) + ": ")
-        if ownetobj.present(sensor):
-            found_sensors += _check_sensor(ownetobj, sensor, "Expected")
-        else:
-            logging.warning("Expected sensor, %s, not found.", sensor)
-    return found_sensors
-
-def _log_other_sensors(ownetobj, expected_sensors):
-    """Get all sensor list and log any that are unexpected."""
-    try:
-        # list every sensor on the bus added that could be added to the list
-        rawlist = ownetobj.dir()
-    except (pyownet.protocol.Error) as errcatch:
-        logging.warning('Could not read list and run concersion on ow due to %s', str(errcatch))
-
-    for sensor in rawlist:
-        if sensor[:-1] not in expected_sensors:
-            _check_sensor(ownetobj, sensor[:-1], "New")
-
-    return rawlist
+def _log_conversion(ownetobj):
+    """Run a conversion so sensors probed have a current reading"""
+    _wait_for_conversion(_start_conversion(ownetobj))
 
 def _start_conversion(ownetobj):
-    """Start simultaneous temperature conversion and wait"""
+    """Start simultaneous temperature conversion and return time it will be complete"""
     try:
         ownetobj.write('simultaneous/temperature', data=b'1')    # begin conversions
-        time.sleep(0.75)                                   # need to wait for conversion
     except (pyownet.protocol.Error) as errcatch:
         logging.warning('Could not run conversion on ow due to %s', str(errcatch))
         raise
-
-def get_1wire_data(ownetobj, expected_sensors):
-    """Get data from 1 wire network and and return formatted string"""
-    #reset output string
-    outputstr = setup.settings['emonsocket']['node']
-
+    return time.monotonic() + CONVERSION_TIME
+
+def _wait_for_conversion(conversion_deadline):
+    """Wait for any remaining conversion time"""
+    remaining = conversion_deadline - time.monotonic()
+    if remaining > 0:
+        time.sleep(remaining)
+
+def initialise_1wire_buses(ownetobj, sensors, readpool):
+    """The bus in [1wire] and any further owserver buses configured as its subsections
+
+    Each further bus has its own owhost, owport and sensors, and is sent to
+    its own node if one is given, otherwise merged in to the main frame.
+    A bus keeps the slots of all its configured sensors in the frame, even
+    while its owserver can't be reached or none of its sensors are found,
+    so the positions of the sensors after it don't move."""
+    onewiresettings = setup.settings['1wire']
+    buses = [OneWireBus('main', ownetobj, sensors, readpool, setup.settings['emonsocket']['node'],
+                        onewiresettings['sensors'],
+                        _owserver_settings(onewiresettings, '1wire_discovery.json'))]
+    for name in onewiresettings.sections:
+        bussettings = onewiresettings[name]
+        logging.info("adding 1 wire bus %s", name)
+        expected = bussettings['sensors']
+        if isinstance(expected, str):
+            expected = [expected] # a single sensor isn't read as a list
+        owserver = _owserver_settings(bussettings, '1wire_discovery_' + name + '.json')
+        busownet, bussensors = _initialise_owserver(owserver[0], owserver[1], expected, owserver[2])
+        if busownet is None:
+            logging.warning("1 wire bus %s not reached, sending its sensors as null", name)
+        buses.append(OneWireBus(name, busownet, bussensors, initialise_1wire_pool(busownet),
+                                bussettings.get('node', setup.settings['emonsocket']['node']),
+                                expected, owserver))
+    return buses
+
+class OneWireBus(object):
+    """An owserver, the sensors sampled from it and the emonhub node they are sent to.
+
+    expected are the configured sensors, each given a slot in the frame
+    whether sampled or not. ownet is None while the owserver at owserver,
+    (host, port, discovery cache path), can't be reached."""
+    def __init__(self, name, ownetobj, sensors, readpool, node, expected=None, owserver=None):
+        self.name = name
+        self.ownet = ownetobj
+        self.sensors = sensors
+        self.readpool = readpool
+        self.node = node
+        self.expected = list(sensors if expected is None else expected)
+        self.owserver = owserver
+        self.retry_at = time.monotonic() + BUS_RETRY_INTERVAL
+
+def _connect_bus(bus):
+    """The owserver of bus, trying again to reach it every BUS_RETRY_INTERVAL if it couldn't be"""
+    if bus.ownet is None and bus.owserver is not None and time.monotonic() >= bus.retry_at:
+        bus.retry_at = time.monotonic() + BUS_RETRY_INTERVAL
+        host, port, cachepath = bus.owserver
+        ownet, sensors = _initialise_owserver(host, port, bus.expected, cachepath)
+        if ownet is not None:
+            logging.info("1 wire bus %s reached", bus.name)
+            bus.ownet, bus.sensors, bus.readpool = ownet, sensors, initialise_1wire_pool(ownet)
+    return bus.ownet
+
+# threads converting and reading each bus when there are several
+_bus_executor = None
+
+def _map_buses(function, buses, *args):
+    """Run function for each bus, concurrently if there are several, and return results in order"""
+    global _bus_executor
+    if len(buses) == 1:
+        return [function(buses[0], *[arg[0] for arg in args])]
+    if _bus_executor is None:
+        _bus_executor = ThreadPoolExecutor(max_workers=len(buses))
+    return list(_bus_executor.map(function, buses, *args))
+
+def start_1wire_conversions(buses):
+    """Start conversions on all buses at once, returns their deadlines, None where one failed"""
+    return _map_buses(lambda bus: start_1wire_conversion(_connect_bus(bus)), buses)
+
+def get_1wire_buses_data(buses, conversion_deadlines, policy=None):
+    """Read all buses at once and return a (node, payload) frame for each emonhub node"""
+    if len(buses) == 1:
+        bus = buses[0]
+        return get_1wire_data(bus.ownet, bus.sensors, bus.readpool, conversion_deadlines[0],
+                              policy, bus.node)
+
+    nodes = OrderedDict() # node -> (sensors, temps), buses sent to the same node are merged
+    for bus, temps in zip(buses, _map_buses(_read_1wire_bus, buses, conversion_deadlines)):
+        sensors, nodetemps = nodes.setdefault(bus.node, ([], []))
+        sensors.extend(bus.expected)
+        nodetemps.extend(temps)
+    return [frame for node, (sensors, temps) in nodes.items()
+            for frame in _encode_1wire_frame(node, sensors, temps, policy)]
+
+def _read_1wire_bus(bus, conversion_deadline):
+    """Wait for the conversion on bus and read the temperature for each slot
+
+    All are None if the conversion failed or no sensors are sampled."""
+    if conversion_deadline is None or not bus.sensors:
+        return [None] * len(bus.expected)
+    _wait_for_conversion(conversion_deadline)
+    return _read_1wire_temps(bus.ownet, bus.sensors, bus.readpool)
+
+def start_1wire_conversion(ownetobj):
+    """Start conversion so other work can be done while it runs, returns None on failure"""
+    if ownetobj is None:
+        return None # owserver not reached
     try:
-        _start_conversion(ownetobj)
+        return _start_conversion(ownetobj)
     except pyownet.protocol.Error:
-        return ''
+        return None
+
+# read pools in use, owserver proxy -> ((workers, timeout), pool)
+_readpools = {}
+
+def initialise_1wire_pool(ownetobj):
+    """Create pool of owserver connections for parallel reads if more than one worker configured
+
+    The pool already made for ownetobj is returned if its settings haven't changed."""
+    workers = int(setup.settings['1wire'].get('read_workers', 1))
+    timeout = float(setup.settings['1wire'].get('read_timeout', 1))
+    if workers <= 1 or not ownetobj:
+        return None
+    poolsettings, readpool = _readpools.get(ownetobj, (None, None))
+    if poolsettings == (workers, timeout):
+        return readpool
+    if readpool is not None:
+        readpool.close()
+    logging.info("reading 1 wire sensors with %d parallel connections", workers)
+    readpool = onewire_pool.OneWireReadPool(ownetobj, workers, timeout)
+    _readpools[ownetobj] = ((workers, timeout), readpool)
+    return readpool
+
+def reload_1wire_buses(buses):
+    """Buses for the current settings, keeping connections and pools of owservers still in use"""
+    global _bus_executor
+    ownet, sensors = initialise_1wire()
+    if ownet is None:
+        logging.warning("1 wire settings not applied, keeping the buses already in use")
+        return buses
+    newbuses = initialise_1wire_buses(ownet, sensors, initialise_1wire_pool(ownet))
+
+    # close owservers no longer in any bus
+    inuse = [bus.ownet for bus in newbuses]
+    for key, (oldownet, discovery) in list(_owservers.items()):
+        if not any(oldownet is busownet for busownet in inuse):
+            logging.info("closing 1 wire bus on %s:%s", *key)
+            discovery.stop()
+            _, readpool = _readpools.pop(oldownet, (None, None))
+            if readpool is not None:
+                readpool.close()
+            if hasattr(oldownet, 'close_connection'):
+                oldownet.close_connection()
+            del _owservers[key]
+
+    if len(newbuses) != len(buses) and _bus_executor is not None:
+        _bus_executor.shutdown()
+        _bus_executor = None # recreated for the new number of buses
+    return newbuses
+
+def get_1wire_data(ownetobj, expected_sensors, readpool=None, conversion_deadline=False,
+                   policy=None, node=None):
+    """Get data from 1 wire network and return a list of (node, payload) frames
+
+    Starts a conversion unless the deadline of one already started with
+    start_1wire_conversion is given. With a report policy, returns an empty
+    list when the readings aren't due to be reported."""
+    if conversion_deadline is False:
+        conversion_deadline = start_1wire_conversion(ownetobj)
+    if conversion_deadline is None:
+        return []
+    _wait_for_conversion(conversion_deadline)
+
+    sensortemps = _read_1wire_temps(ownetobj, expected_sensors, readpool)
+    return _encode_1wire_frame(node or setup.settings['emonsocket']['node'], expected_sensors,
+                               sensortemps, policy)
 
+def _read_1wire_temps(ownetobj, expected_sensors, readpool):
+    """Read temperatures of sensors, None for any that failed"""
+    # read all sensors at once if a pool is avaliable, otherwise work through list of sensors
+    if readpool is None:
+        return [_read_temp_sensor(ownetobj, sensor) for sensor in expected_sensors]
+    return [_record_temp_sensor(sensor, temp) for sensor, temp in
+            zip(expected_sensors, readpool.read_temps(expected_sensors))]
+
+def _encode_1wire_frame(node, expected_sensors, sensortemps, policy):
+    """Log temperatures and return a list holding their frame for node, empty if none to send
+
+    Failed reads are None, logged as nothing and sent as temperaturenull."""
     result_count = 0 #count results
+    temperaturenull = float(setup.settings['emonsocket']['temperaturenull'])
+    nulledtemps = [temperaturenull if temp is None else temp for temp in sensortemps]
+
+    if policy is not None and not policy.due(list(zip(expected_sensors, nulledtemps)), read_time):
+        return []
 
-    # work through list of sensors
-    for sensor in expected_sensors:
-        temp = _read_temp_sensor(ownetobj, sensor)
-        if temp is not float(setup.settings['emonsocket']['temperaturenull']):
+    for sensor, temp in zip(expected_sensors, sensortemps):
+        if temp is not None:
             result_count += 1
-        outputstr += ' ' + ' '.join(map(str,emonhub_coder.encode("h", round(temp * 10 ))))
+            datalogger.log_sensor(read_time, sensor, temp)
+    temps = [round(temp * 10) for temp in nulledtemps]
 
-    logging.debug(outputstr)
+    #pack whole frame using emonhubs own module
+    payload = emonhub_coder.encode_many("h", temps)
+
+    logging.debug(emonhub_coder.frame_text(node, payload))
 
     if result_count == 0:
-        return ''
-    return outputstr + '\r\n'
+        return []
+    return [(node, payload)]
 
 def _read_temp_sensor(ownetobj, sensor):
     """Read temperature sensor and return result"""
+    start = time.monotonic()
     try:  # just in case it has been unplugged
         # get the temperature from that sensor
         temp = float(ownetobj.read(sensor + '/latesttemp'))
     except pyownet.protocol.Error:  # it has been unplugged
+        temp = None
+    onewire_pool.READ_SECONDS.observe(time.monotonic() - start, sensor)
+    return _record_temp_sensor(sensor, temp)
+
+def _record_temp_sensor(sensor, temp):
+    """Report temperature sensor reading, temp is None if the read failed, and return it"""
+    if temp is None:
         logging.warning('Sensor %s gone away - ignoring', sensor)
-        temp = float(setup.settings['emonsocket']['temperaturenull'])
-        #continue  # so we'll jump to the next in the list
+        READ_FAILURES.inc(sensor)
     else:
         # print sensor name and current value
         logging.info( 'Logging Sensor {!s}: {:-6.2f}'.format(sensor, temp))
-        stringout = '{}:{!s}:{:+06.2f}\n'.format(read_time, sensor, temp)
-        datalogger.log(stringout)
     return temp
 
 def initialise_heatmiser(configfile=None):
@@ -199,99 +410,84 @@ def _heatmiser_initial_read(controller):
         else:
             logging.info(disptext)
 
-def get_heatmiser_data():
-    """Get data from heatmiser network and and return formatted string"""
-    try:
-        #read all fields needed now
-        allread = hmn.All.read_fields(['sensorsavaliable',
-                                        'airtemp',
-                                        'remoteairtemp',
-                                        'heatingdemand',
-                                        'hotwaterdemand'], 0)
-        #read currenttime, which will get time from sensor every 24 hours and hence check .
-        hmn.All.read_field('currenttime')
-    except (SerialException, HeatmiserResponseError, HeatmiserControllerTimeError) as errcatch:
-        logging.warning("All failed to read due to %s", str(errcatch))
-        return ''
-    else:
-        #get demands and temps replacing nones
-        demands = [99 if row is None or row[3] is None else row[3] for row in allread]
-        hotwater = 2 if allread is None or allread[0] is None else allread[0][4]
-        temps = [float(setup.settings['emonsocket']['temperaturenull'])
-                    if temp is None else temp for temp in hmn.All.read_air_temp()]
-
-        logging.debug('Temps %s', temps)
-        logging.debug('Demands %s', demands + [hotwater])
-
-        #enocde using emonhubs own module
-        encodedtemps = [' '.join(map(str,emonhub_coder.encode("h",temp * 10 ))) for temp in temps ]
-
-        logging.info('Logging heatmiser data')
-        stringout = str(read_time)
-        tempstring = ':TEMP' + ','.join(str(tep) for tep in temps)
-        demandsstring = 'DEMAND' + ','.join(str(tep) for tep in demands)
-        hotwaterstring = 'HOTW' + str(hotwater)
-        datalogger.log(stringout + tempstring + demandsstring + hotwaterstring + '\n')
-
-        #zip temp and demands and join string
-        outputstr = ' '.join([setup.settings['emonsocket']['hmnode'], str(hotwater)]
-                                + ['%s %d'%pair for pair in zip(encodedtemps, demands)])
-
-        logging.debug(outputstr)
-        return outputstr + '\r\n'
-
-class LocalDatalogger():
-    """Manages a local daily data logging file."""
-    def __init__(self, logfolder):
-        self._logfolder = logfolder
-
-        self._outputfile = None
-        self._openfilename = False
-        self._file_day_stamp = False
-
-        self._open_file(time.time())
-
-    def _check_day(self, timestamp):
-        """Open new file if the day has changed."""
-        daystamp = timestamp//86400
-        if self._file_day_stamp != daystamp:
-            self._close_file()
-            self._open_file(timestamp)
-
-    def _open_file(self, timestamp):
-        """Open data file and store handle"""
-        self._file_day_stamp = timestamp//86400
-        try:
-            self._openfilename = self._logfolder + "/testlog"+str(self._file_day_stamp)+".txt"
-            self._outputfile = open(self._openfilename,"a") #removed b
-        except IOError as errcatch:
-            self._openfilename = False
-            self._file_day_stamp = False
-            logging.warning('failed to create log file : I/O error(%d): %s',
-                                errcatch.errno, errcatch.strerror)
-        else:
-            logging.info('opened file %s', self._openfilename)
-
-    def _close_file(self):
-        """Close data file."""
-        if self._file_day_stamp is not False:
-            self._outputfile.close()
-            logging.info('closed file %s', self._openfilename)
-            self._openfilename = False
-            self._file_day_stamp = False
-    
-    def log(self, stringout):
-        """Log data to todays log file."""
-        self._check_day(time.time())
-        if self._file_day_stamp is not False:
-            try:
-                self._outputfile.write(stringout)
-            except IOError as errcatch:
-                self._close_file()
-                logging.warning('failed to write to log file : I/O error(%d): %s',
-                                    errcatch.errno, errcatch.strerror)
-            else:
-                logging.debug('logged to file: %s', stringout)
+def get_heatmiser_data(policy=None):
+    """Get data from heatmiser network and return a list of (node, payload) frames
+
+    With a report policy, returns an empty list when the readings aren't
+    due to be reported."""
+    #read fields due now from each stat, rows are in heatmiser_poller.FRAME_FIELDS order
+    #and None for stats that failed or are backed off
+    allread = hmpoller.poll()
+    if all(row is None for row in allread):
+        logging.warning("All failed to read, no heatmiser data")
+        return []
+
+    #get demands and temps replacing nones
+    demands = [99 if row is None or row[3] is None else row[3] for row in allread]
+    hotwater = 2 if allread[0] is None else allread[0][4]
+    temps = [float(setup.settings['emonsocket']['temperaturenull'])
+                if temp is None else temp for temp in map(heatmiser_poller.air_temp, allread)]
+
+    logging.debug('Temps %s', temps)
+    logging.debug('Demands %s', demands + [hotwater])
+
+    tempids, demandids = binlog.heatmiser_sensor_ids(len(temps))
+    if policy is not None and not policy.due(list(zip(tempids, temps)) +
+                                             list(zip(demandids, demands)) +
+                                             [('HOTW', hotwater)], read_time):
+        return []
+
+    logging.info('Logging heatmiser data')
+    datalogger.log_heatmiser(read_time, temps, demands, hotwater)
+
+    #interleave temps and demands and pack whole frame using emonhubs own module
+    values = [hotwater]
+    for temp, demand in zip(temps, demands):
+        values += [round(temp * 10), demand]
+    node = setup.settings['emonsocket']['hmnode']
+    payload = emonhub_coder.encode_many('B' + 'hB' * len(temps), values)
+
+    logging.debug(emonhub_coder.frame_text(node, payload))
+    return [(node, payload)]
+
+def initialise_heatmiser_poller(hmnetwork, samplingsettings):
+    """Poller reading slow changing heatmiser fields less often, unless configured not to,
+    and backing off stats that fail"""
+    if hmnetwork is None:
+        return None
+    return heatmiser_poller.HeatmiserPoller(
+        hmnetwork, errors=(SerialException, HeatmiserResponseError, HeatmiserControllerTimeError),
+        **_heatmiser_poller_settings(samplingsettings))
+
+def _heatmiser_poller_settings(samplingsettings):
+    """HeatmiserPoller settings that can be changed while it is running"""
+    tiers = heatmiser_poller.TIERED
+    if not _as_bool(samplingsettings.get('heatmiser_tiered', True)):
+        tiers = heatmiser_poller.UNTIERED
+    return {'tiers': tiers, 'backoff': float(samplingsettings.get('heatmiser_backoff', 60)),
+            'max_backoff': float(samplingsettings.get('heatmiser_max_backoff', 3600))}
+
+def initialise_datalogger(logsettings):
+    """Initialise local data logger, buffered text unless configured otherwise"""
+    if logsettings.get('format', 'text') == 'binary':
+        logger = binlog.BinaryDatalogger(logsettings['logfolder'],
+                                         int(logsettings.get('flush_bytes', 4096)),
+                                         float(logsettings.get('flush_age', 300)))
+        atexit.register(logger.close)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        return logger
+
+    if not _as_bool(logsettings.get('buffered', True)):
+        return LocalDatalogger(logsettings['logfolder'])
+
+    logger = BufferedDatalogger(logsettings['logfolder'],
+                                int(logsettings.get('flush_bytes', 4096)),
+                                float(logsettings.get('flush_age', 300)),
+                                logsettings.get('fsync', 'never'))
+    # write out the buffer when stopped, systemd stops the service with SIGTERM
+    atexit.register(logger.close)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    return logger
 
 def get_args(desc_text):
     """Setups and parser and processes the arguements"""
@@ -313,18 +509,259 @@ def get_args(desc_text):
     # process the arguments
     return parser.parse_args()
 
-def send_message(setuparray, message_text):
-    """Send a message over socket interface."""
-    if len(message_text) > 0:
-        try:
-            soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            soc.connect((setuparray.settings['emonsocket']['host'],
-                            int(setuparray.settings['emonsocket']['port'])))
-            logging.info('socket send %s', message_text)
-            logging.debug(soc.sendall(message_text.encode('utf-8')))
-            soc.close()
-        except IOError as mainerrcatch:
-            logging.warning('could not connect to emonhub due to %s', mainerrcatch)
+def initialise_emonhub(socketsettings, logfolder):
+    """Initialise persistent connection to emonhub socket interfacer, with spool for unsent frames
+
+    Frames are sent as text unless binary is set, which can't change while running."""
+    binary = _as_bool(socketsettings.get('binary', False))
+    spoolfolder = socketsettings.get('spool_folder', logfolder + '/spool')
+    if binary: # kept apart from text frames spooled before switching
+        spoolfolder = os.path.join(spoolfolder, 'binary')
+    try:
+        framespool = spool.FrameSpool(spoolfolder,
+                                      int(socketsettings.get('spool_max_bytes', 50 * 1024 * 1024)),
+                                      binary=binary)
+    except (IOError, OSError) as errcatch:
+        logging.warning('failed to open spool, unsent frames will be lost: %s', errcatch)
+        framespool = None
+
+    client = emonhub_client.EmonhubClient(socketsettings['host'],
+                                        int(socketsettings['port']),
+                                        spool=framespool, binary=binary,
+                                        **_emonhub_settings(socketsettings))
+
+    registry = metrics.REGISTRY
+    registry.counter('emonreporter_emonhub_send_failures_total',
+                     'Sends to emonhub that failed').set_function(lambda: client.send_failures)
+    registry.counter('emonreporter_emonhub_connects_total',
+                     'Connections made to emonhub').set_function(lambda: client.connects)
+    registry.gauge('emonreporter_emonhub_connected',
+                   '1 while connected to emonhub').set_function(lambda: int(client.connected))
+    if framespool is not None:
+        registry.gauge('emonreporter_spool_frames',
+                       'Frames waiting in the spool').set_function(lambda: framespool.depth)
+        registry.gauge('emonreporter_spool_bytes',
+                       'Disk used by the spool').set_function(lambda: framespool.size_bytes)
+        registry.counter('emonreporter_spool_evicted_total',
+                         'Frames dropped when the spool was full').set_function(
+                             lambda: framespool.evicted)
+    return client
+
+def _emonhub_settings(socketsettings):
+    """EmonhubClient settings that can be changed while it is running"""
+    return {'connect_timeout': float(socketsettings.get('connect_timeout', 5)),
+            'persistent': _as_bool(socketsettings.get('persistent', False)),
+            'timestamped': _as_bool(socketsettings.get('timestamped', False)),
+            'drain_batch_bytes': int(socketsettings.get('spool_batch_bytes', 1024))}
+
+def initialise_metrics(metricssettings):
+    """Start the metrics endpoint if a listen address or unix socket path is configured"""
+    listen = metricssettings.get('listen', '')
+    if not listen:
+        return None
+    try:
+        server = metrics.MetricsServer(listen)
+    except (IOError, OSError) as errcatch:
+        logging.warning('could not start metrics endpoint on %s: %s', listen, errcatch)
+        return None
+    logging.info('serving metrics on %s', listen)
+    return server
+
+def _as_bool(value):
+    """Convert unvalidated config value to boolean"""
+    return str(value).lower() in ('true', 'yes', 'on', '1')
+
+def send_message(client, frames, frame_time=None):
+    """Send (node, payload) frames over socket interface."""
+    client.send_packed(frames, frame_time)
+
+def initialise_sampler(settings, sample_interval, cycle):
+    """Scheduler running cycle every sample_interval, phase aligned to the wall clock.
+
+    Returns the scheduler, the timer of cycle and the configured heatmiser
+    interval, 0 if the heatmiser should be polled with every cycle."""
+    samplingsettings = settings.get('sampling', {})
+    sampler = scheduler.Scheduler()
+    sampletimer = sampler.call_every(sample_interval, cycle, align=True,
+                                     catch_up=int(samplingsettings.get('catch_up', 0)))
+    return sampler, sampletimer, float(samplingsettings.get('heatmiser_interval', 0))
+
+def initialise_report_policy(reportsettings, sample_interval, source='sample'):
+    """Report policy from the reporting settings, None to report every reading
+
+    The interval is only adapted if sample_interval is given."""
+    deadband = float(reportsettings.get('deadband', 0))
+    if deadband <= 0:
+        return None
+    fast_interval = float(reportsettings.get('fast_interval', 0)) or None
+    policy = report_policy.ReportPolicy(deadband, float(reportsettings.get('heartbeat', 0)),
+                                        sample_interval, fast_interval)
+    logging.info("  reporting changes over %.2f, heartbeat %s seconds, fast interval %s",
+                    deadband, reportsettings.get('heartbeat', 0), fast_interval)
+
+    registry = metrics.REGISTRY
+    registry.counter('emonreporter_frames_offered_total', 'Frames sampled',
+                     ['source']).set_function(lambda: policy.frames_offered, source)
+    registry.counter('emonreporter_frames_reported_total', 'Frames sent and logged',
+                     ['source']).set_function(lambda: policy.frames_reported, source)
+    if sample_interval is not None:
+        registry.gauge('emonreporter_sample_interval_seconds', 'Current sample interval',
+                       ['source']).set_function(lambda: policy.interval, source)
+    return policy
+
+def adapt_sample_interval(policy, timer):
+    """Change the interval of timer to the one the report policy asks for"""
+    if policy is None:
+        return
+    interval = policy.next_interval()
+    if interval != timer.interval:
+        logging.info("sample interval now %.1f seconds", interval)
+        timer.interval = interval
+    logging.info("reported %d of %d frames, %.0f%% suppressed", policy.frames_reported,
+                    policy.frames_offered, 100 * policy.suppressed)
+
+def schedule_heatmiser(interval):
+    """Poll the heatmiser every interval seconds on its own timer, or with each 1-wire cycle if 0"""
+    global heatmiser_interval, hmsampletimer, hmreportpolicy
+    if hmsampletimer is not None:
+        hmsampletimer.cancel()
+        hmsampletimer = None
+    heatmiser_interval = interval
+    hmreportpolicy = _heatmiser_report_policy()
+    if hmn is not None and interval:
+        logging.info("  heatmiser interval: %d seconds", interval)
+        hmsampletimer = sampler.call_every(interval, heatmiser_cycle, align=True)
+
+def _heatmiser_report_policy():
+    """Report policy for heatmiser readings, shared with the 1-wire unless on their own interval"""
+    if hmn is None or not heatmiser_interval:
+        return reportpolicy
+    # heatmiser readings aren't sampled faster, only filtered
+    return initialise_report_policy(setup.settings.get('reporting', {}), None, 'heatmiser')
+
+def watch_settings(configfile):
+    """Reload settings between cycles when configfile changes"""
+    watcher = config_watch.ConfigWatcher(configfile)
+    if watcher.method == 'inotify':
+        sampler.add_reader(watcher, reload_settings, watcher, configfile)
+    else:
+        sampler.call_every(SETTINGS_INTERVAL, reload_settings, watcher, configfile)
+    return watcher
+
+def reload_settings(watcher, configfile):
+    """Apply a changed config file, rebuilding only what its changes affect
+
+    Runs from the scheduler, so never part way through a cycle."""
+    global setup, onewirebuses, reportpolicy, hmreportpolicy
+    if not watcher.changed():
+        return
+    start = time.monotonic()
+    try:
+        newsetup = hms.HeatmiserControllerFileSetup(configfile)
+    except hms.HeatmiserControllerSetupInitError as errcatch:
+        logging.warning("config file changed but not reloaded: %s", errcatch)
+        return
+    changed = config_watch.changed_sections(setup.settings, newsetup.settings)
+    if not changed:
+        return
+    problem = _settings_problem(newsetup.settings)
+    if problem is not None:
+        # nothing is rebuilt, so the file is applied in full once it's fixed
+        logging.warning("config file changed but not reloaded: %s", problem)
+        return
+    setup = newsetup
+    rebuilt = []
+
+    # emonsocket holds the nodes the buses send to
+    if '1wire' in changed or 'emonsocket' in changed:
+        onewirebuses = reload_1wire_buses(onewirebuses)
+        rebuilt.append('1wire')
+    if 'emonsocket' in changed:
+        emonhub.configure(setup.settings['emonsocket']['host'], setup.settings['emonsocket']['port'],
+                          **_emonhub_settings(setup.settings['emonsocket']))
+        if _as_bool(setup.settings['emonsocket'].get('binary', False)) != emonhub.binary:
+            logging.warning("changes to emonsocket binary need a restart to take effect")
+        rebuilt.append('emonhub')
+    if 'reporting' in changed:
+        reportpolicy = initialise_report_policy(setup.settings.get('reporting', {}),
+                                                sample_interval)
+        hmreportpolicy = _heatmiser_report_policy()
+        sampletimer.interval = sample_interval
+        rebuilt.append('reporting')
+    if 'sampling' in changed:
+        samplingsettings = setup.settings.get('sampling', {})
+        sampletimer.catch_up = int(samplingsettings.get('catch_up', 0))
+        if hmpoller is not None:
+            hmpoller.configure(**_heatmiser_poller_settings(samplingsettings))
+        interval = float(samplingsettings.get('heatmiser_interval', 0))
+        if interval != heatmiser_interval:
+            schedule_heatmiser(interval)
+        rebuilt.append('sampling')
+    for section in RESTART_SECTIONS:
+        if section in changed:
+            logging.warning("changes to [%s] need a restart to take effect", section)
+
+    seconds = time.monotonic() - start
+    RELOAD_SECONDS.observe(seconds)
+    for component in rebuilt:
+        RELOAD_REBUILT.inc(component)
+    logging.info("config reloaded in %.1f ms, changed %s, rebuilt %s", seconds * 1000,
+                    ', '.join(changed), ', '.join(rebuilt) or 'nothing')
+
+def _settings_problem(settings):
+    """Why settings can't be applied while running, None if they can"""
+    onewire = settings.get('1wire', {})
+    required = [(settings.get(section, {}), '[%s]' % section, key, kind)
+                for section, key, kind in REQUIRED_SETTINGS]
+    required += [(onewire[name], '[1wire] [[%s]]' % name, 'sensors', None)
+                 for name in getattr(onewire, 'sections', [])]
+    for values, label, key, kind in required:
+        if key not in values:
+            return "no %s in %s" % (key, label)
+        if kind is not None:
+            try:
+                kind(values[key])
+            except (TypeError, ValueError):
+                return "%s in %s isn't a number" % (key, label)
+    return None
+
+def sample_cycle():
+    """Sample 1-wire sensors, polling the heatmiser during the conversion unless on its own interval"""
+    global read_time
+    read_time = int(time.time()) # we only record to integer seconds
+
+    logging.info("Logging cyle at %d", read_time)
+    cycletimer.start()
+
+    # start 1 wire conversion and poll the slow heatmiser bus while it runs
+    with cycletimer.stage('1wire conversion'):
+        conversions = start_1wire_conversions(onewirebuses)
+
+    hm_message = []
+    if hmn is not None and not heatmiser_interval:
+        with cycletimer.stage('heatmiser'):
+            hm_message = get_heatmiser_data(reportpolicy)
+
+    with cycletimer.stage('1wire read'):
+        output_message = get_1wire_buses_data(onewirebuses, conversions, reportpolicy)
+    output_message += hm_message
+
+    with cycletimer.stage('send'):
+        send_message(emonhub, output_message, read_time)
+    cycletimer.finish()
+    adapt_sample_interval(reportpolicy, sampletimer)
+
+def heatmiser_cycle():
+    """Poll the heatmiser stats and send, when they have their own interval"""
+    global read_time
+    read_time = int(time.time())
+    logging.info("Logging heatmiser at %d", read_time)
+    hmtimer.start()
+    with hmtimer.stage('heatmiser'):
+        hm_message = get_heatmiser_data(hmreportpolicy)
+    with hmtimer.stage('send'):
+        send_message(emonhub, hm_message, read_time)
+    hmtimer.finish()
 
 
 if __name__ == "__main__":
@@ -344,30 +781,30 @@ if __name__ == "__main__":
     logging.info("  sample interval: %d seconds", sample_interval )
 
     onewirenetwork, sensorlist1wire = initialise_1wire()
+    if onewirenetwork is None:
+        logging.warning("1 wire bus not reached, no 1 wire sensors will be sampled")
+    onewirepool = initialise_1wire_pool(onewirenetwork)
+    onewirebuses = initialise_1wire_buses(onewirenetwork, sensorlist1wire, onewirepool)
 
     hmn = initialise_heatmiser(localconfigfile)
+    hmpoller = initialise_heatmiser_poller(hmn, setup.settings.get('sampling', {}))
 
-    datalogger = LocalDatalogger(setup.settings['logging']['logfolder'])
+    datalogger = initialise_datalogger(setup.settings['logging'])
 
-    logging.info("Entering reading loop")
+    emonhub = initialise_emonhub(setup.settings['emonsocket'], setup.settings['logging']['logfolder'])
+
+    metricsserver = initialise_metrics(setup.settings.get('metrics', {}))
 
-    # now loop forever reading the identified sensors
-    while 1:
-        # determine how long to wait until next interval
-        # note this will skip some if specified interval is too short
-        #  - it finds the next after now, not next after last
-        sleeptime = sample_interval - (time.time() % sample_interval)
-        time.sleep(sleeptime)
-
-        # get time now and record it
-        read_time = int(time.time()) # we only record to integer seconds
-        
-        output_message = ''
-        
-        logging.info("Logging cyle at %d", read_time)
-        output_message += get_1wire_data(onewirenetwork, sensorlist1wire)
-        
-        if hmn is not None:
-            output_message += get_heatmiser_data()
-
-        send_message(setup, output_message)
+    cycletimer = cycle_timer.CycleTimer()
+    hmtimer = cycle_timer.CycleTimer(name='heatmiser')
+
+    sampler, sampletimer, heatmiser_interval = initialise_sampler(setup.settings, sample_interval,
+                                                                  sample_cycle)
+    reportpolicy = initialise_report_policy(setup.settings.get('reporting', {}), sample_interval)
+    hmsampletimer = None
+    schedule_heatmiser(heatmiser_interval)
+
+    configwatcher = watch_settings(localconfigfile)
+
+    logging.info("Entering reading loop")
+    sampler.run()
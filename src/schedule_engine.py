@@ -0,0 +1,135 @@
+"""Schedule_Engine
+
+Turns a stat's calendar of targets in to the program, frost and holiday
+settings of a Heatmiser stat.
+
+A stat holds at most four periods a day, so days with more targets are
+compressed. The temperatures held for the shortest time are skipped, by
+dropping the target that follows each and pulling its temperature
+forward. The target in effect now and the next change are always kept.
+If no target follows the one in effect the stat is left on frost at its
+temperature, and if the next change is more than a day away it is held
+on holiday until then.
+
+Targets to drop are picked with a heap and each day's targets are found
+by bisecting their times, so planning is O(n log n) in the number of
+targets rather than rescanning them for every day, and only the days a
+plan needs are compressed.
+
+"""
+
+from __future__ import absolute_import
+import bisect
+import collections
+import heapq
+import logging
+from datetime import datetime, time, timedelta
+
+_log = logging.getLogger("EmonReporter.schedule_engine")
+
+PERIODS_PER_DAY = 4
+DAYS = 7 # a stat's program repeats weekly
+HOLIDAY_AFTER = timedelta(hours=24)
+
+Plan = collections.namedtuple('Plan', ['temp', 'frost', 'holiday_hours', 'days'])
+Plan.__doc__ = """Settings for a stat planned at a time.
+
+temp is the temperature in effect, held on frost if frost is True or on
+holiday for holiday_hours if that isn't 0. days holds (date, periods)
+for each day from today, periods being up to four (time of day,
+temperature) pairs in time order."""
+
+def compress(targets, now, per_day=PERIODS_PER_DAY, until=None):
+    """Targets from the one in effect at now, with at most per_day on each date.
+
+    targets are time ordered {'time', 'temp'} dictionaries with timezone
+    aware times. The result holds new dictionaries with times in now's
+    timezone, the target in effect counting towards today's limit. If
+    until is given, targets after that date are left out."""
+    times = [target['time'] for target in targets]
+    return _compress(targets, _in_effect(times, now), now, per_day, until)
+
+def plan(targets, now, days=DAYS, per_day=PERIODS_PER_DAY):
+    """Plan for a stat with targets, as taken by compress, at now.
+
+    Returns None if there are no targets."""
+    if not targets:
+        return None
+    times = [target['time'] for target in targets]
+    start = _in_effect(times, now)
+    if start + 1 == len(targets):
+        return Plan(targets[start]['temp'], True, 0, [])
+
+    # the next change is never dropped, so the holiday can be set before compressing
+    holiday_hours = 0
+    if times[start + 1] - now > HOLIDAY_AFTER:
+        holiday_hours = int((times[start + 1] - now).total_seconds() // 3600)
+    resume = now + timedelta(hours=holiday_hours)
+
+    until = max(now.date() + timedelta(days=days - 1),
+                resume.astimezone(now.tzinfo).date() + timedelta(days=7))
+    kept = _compress(targets, start, now, per_day, until)
+    temp = kept[0]['temp']
+    times = [target['time'] for target in kept]
+    programs = []
+    for offset in range(days):
+        daystart = datetime.combine(now.date() + timedelta(days=offset), time(), now.tzinfo)
+        dayend = daystart + timedelta(days=1)
+        periods = _periods(kept, times, max(daystart, resume), dayend)
+        if daystart <= resume < dayend and len(periods) < per_day:
+            # hold the temperature in effect from when it started, or midnight, so the
+            # plan stays the same between changes, and as the program repeats, fill the
+            # slots before that with next week's targets
+            periods.insert(0, (max(daystart, kept[0]['time']).time(), temp))
+            nextweek = _periods(kept, times, daystart + timedelta(days=7),
+                                dayend + timedelta(days=7))
+            periods[0:0] = [period for period in nextweek
+                            if period[0] < periods[0][0]][:per_day - len(periods)]
+        programs.append((daystart.date(), periods))
+    return Plan(temp, False, holiday_hours, programs)
+
+def _in_effect(times, now):
+    """Index of the target in effect at now, the first if none is"""
+    start = bisect.bisect_right(times, now) - 1
+    if start < 0 and times:
+        _log.warning("no target in effect at %s, using the first", now)
+    return max(start, 0)
+
+def _compress(targets, start, now, per_day, until):
+    """compress from the target at start"""
+    today = now.date()
+    # a day's last temperature can be pulled forward from the day after
+    last_date = None if until is None else until + timedelta(days=1)
+    kept = []
+    for target in targets[start:]:
+        target = {'time': target['time'].astimezone(now.tzinfo), 'temp': target['temp']}
+        if last_date is not None and target['time'].date() > last_date:
+            break
+        kept.append(target)
+
+    result = []
+    first = 0
+    while first < len(kept):
+        date = max(kept[first]['time'].date(), today)
+        last = first + 1
+        while last < len(kept) and kept[last]['time'].date() == date:
+            last += 1
+        # drop the targets ending the shortest held temperatures, never the one in
+        # effect or the next change
+        drop = set(heapq.nsmallest(last - first - per_day, range(max(first, 2), last),
+                                   key=lambda index: kept[index]['time'] -
+                                   kept[index - 1]['time']))
+        for index in range(first, last):
+            if index in drop:
+                result[-1]['temp'] = kept[index]['temp']
+            else:
+                result.append(kept[index])
+        first = last
+    if last_date is not None:
+        result = [target for target in result if target['time'].date() <= until]
+    return result
+
+def _periods(kept, times, start, end):
+    """(time of day, temperature) of the targets from start up to end"""
+    return [(target['time'].time(), target['temp'])
+            for target in kept[bisect.bisect_left(times, start):bisect.bisect_left(times, end)]]
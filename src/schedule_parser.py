@@ -0,0 +1,56 @@
+"""Schedule_Parser
+
+Streams the stats and their targets out of a schedule xml file.
+
+The file is read with ElementTree iterparse and each target and stat is
+cleared as soon as it has been used, so memory stays at one stat however
+many weeks the calendar spans. Each target's time is parsed once, and as
+targets are listed in time order, those of a stat after the first one
+beyond the horizon are skipped without being parsed.
+
+"""
+
+from __future__ import absolute_import
+from datetime import datetime, timedelta
+import xml.etree.ElementTree as ElementTree
+
+HORIZON = timedelta(days=16) # beyond the longest likely holiday
+
+def parse_time(text):
+    """Timezone aware datetime of an rfc3339 timestamp"""
+    if text.endswith(('Z', 'z')):
+        text = text[:-1] + '+00:00'
+    return datetime.fromisoformat(text)
+
+def iter_stats(source, now, horizon=HORIZON):
+    """Yield (name, targets) for each stat in source, a path or file object.
+
+    targets is a list of {'time', 'temp'} dictionaries in time order,
+    ending at the last target no later than now + horizon. now must be
+    timezone aware."""
+    cutoff = now + horizon
+    path = [] # open elements, to remove each stat from its parent once used
+    name, targets, beyond = None, [], False
+    for event, element in ElementTree.iterparse(source, ('start', 'end')):
+        if event == 'start':
+            path.append(element)
+            if element.tag == 'stat':
+                name, targets, beyond = None, [], False
+            continue
+
+        path.pop()
+        if element.tag == 'target':
+            if not beyond:
+                time = parse_time(element.get('time'))
+                if time <= cutoff:
+                    targets.append({'time': time, 'temp': float(element.text)})
+                else:
+                    beyond = True
+            element.clear()
+        elif element.tag == 'name' and name is None:
+            name = element.text
+        elif element.tag == 'stat':
+            yield name, targets
+            element.clear()
+            if path:
+                path[-1].remove(element)
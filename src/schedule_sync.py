@@ -0,0 +1,144 @@
+"""Schedule_Sync
+
+Keeps the stats' programs in step with a remote schedule from within the
+reporter.
+
+Polled from the reporter's event loop, each poll makes one conditional
+GET for the schedule. The parsed targets and plans of every stat are kept
+in memory against the ETag and Last-Modified of the copy held, so the file
+is parsed again only when it changes or the parsed window runs short, and
+then only stats whose targets differ are planned again. A plan holds
+until its stat's next target or midnight, when today's window moves on,
+whichever is sooner.
+
+Plans are written by a job handed to the heatmiser interfacer, which runs
+it in its own thread between polls, so writes share the bus rather than
+contend for the serial port.
+
+"""
+
+from __future__ import absolute_import
+import bisect
+import collections
+import logging
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, time, timedelta
+
+import schedule_engine
+import schedule_parser
+import schedule_writer
+
+_log = logging.getLogger("EmonReporter.schedule_sync")
+
+REPARSE_AFTER = timedelta(days=7) # targets parsed beyond the horizon, so weeks pass between parses
+WRITTEN_SUFFIX = '.written'
+
+def _localnow():
+    """Now in the local time zone, which the stats keep"""
+    return datetime.now().astimezone()
+
+class ScheduleSync(object):
+    """Fetches, plans and writes the schedule, reworking only what has changed.
+
+    getter is an XmlGetter and submit is called with jobs to run against
+    the heatmiser network, returning False if there is nowhere to run them."""
+    def __init__(self, getter, url, destfile, submit, clock=_localnow):
+        self._getter = getter
+        self._url = url
+        self._destfile = destfile
+        self._submit = submit
+        self._clock = clock
+        self._key = None # validators of the copy parsed
+        self._parsed_until = None
+        self._stats = {} # name -> {'targets', 'plan', 'until'}
+        self._unwritten = {} # name -> plan waiting for the bus
+        self._failed = collections.deque() # stats whose write failed, filled from the bus thread
+        self._writer = None
+
+        self.parses = 0
+        self.plans = 0
+
+    def poll(self):
+        """Fetch the schedule if it has changed and write any plans that are due."""
+        now = self._clock()
+        try:
+            self._getter.check_file(self._url, self._destfile)
+        except IOError as errcatch:
+            _log.warning("schedule not fetched due to %s", errcatch)
+        key = self._getter.validators(self._destfile)
+        if key != self._key or self._parsed_until is None or \
+                now + schedule_parser.HORIZON > self._parsed_until:
+            if self._load(now):
+                self._key = key
+
+        while self._failed:
+            name = self._failed.popleft()
+            if name in self._stats:
+                self._stats[name]['plan'] = None # planned again, as a holiday counts from now
+
+        for name, stat in self._stats.items():
+            if stat['plan'] is not None and now < stat['until']:
+                continue
+            plan = schedule_engine.plan(stat['targets'], now)
+            self.plans += 1
+            stat['until'] = self._plan_until(stat['targets'], now)
+            if plan is None:
+                _log.warning("schedule has no targets for %s", name)
+                stat['plan'] = False # nothing to write until the targets change
+                continue
+            if plan != stat['plan']:
+                self._unwritten[name] = plan
+            stat['plan'] = plan
+
+        if self._unwritten and self._submit(self._job(dict(self._unwritten))):
+            self._unwritten.clear()
+
+    def _load(self, now):
+        """Parse the copy held, keeping the plans of stats whose targets are unchanged."""
+        try:
+            parsed = list(schedule_parser.iter_stats(
+                self._destfile, now, schedule_parser.HORIZON + REPARSE_AFTER))
+        except (IOError, ValueError, ElementTree.ParseError) as errcatch:
+            _log.warning("schedule not parsed due to %s", errcatch)
+            return False
+        self.parses += 1
+        self._parsed_until = now + schedule_parser.HORIZON + REPARSE_AFTER
+        stats = {}
+        for name, targets in parsed:
+            old = self._stats.get(name)
+            if old is not None and old['targets'] == targets:
+                stats[name] = old
+            else:
+                stats[name] = {'targets': targets, 'plan': None, 'until': None}
+        self._stats = stats
+        for name in list(self._unwritten):
+            if name not in stats:
+                del self._unwritten[name]
+        return True
+
+    @staticmethod
+    def _plan_until(targets, now):
+        """When a plan made at now stops holding, at the next target or midnight."""
+        until = datetime.combine(now.date() + timedelta(days=1), time(), now.tzinfo)
+        times = [target['time'] for target in targets]
+        index = bisect.bisect_right(times, now)
+        if index < len(times):
+            until = min(until, times[index])
+        return until
+
+    def _job(self, plans):
+        """Job writing plans, run with the heatmiser network and its errors."""
+        def write_plans(hmnetwork, errors):
+            if self._writer is None:
+                self._writer = schedule_writer.ScheduleWriter(
+                    schedule_writer.ScheduleCache(self._destfile + WRITTEN_SUFFIX), errors)
+            for name, plan in plans.items():
+                device = schedule_writer.find_device(hmnetwork, name)
+                if device is None:
+                    _log.warning("schedule has %s, which isn't a stat on the network", name)
+                    continue
+                failures = self._writer.write_failures
+                self._writer.write(device, plan)
+                if self._writer.write_failures != failures:
+                    self._failed.append(name)
+        return write_plans
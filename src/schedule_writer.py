@@ -0,0 +1,168 @@
+"""Schedule_Writer
+
+Puts schedule plans in place on Heatmiser stats, writing only what has
+changed.
+
+The program, frost and holiday settings last written to each stat are
+kept in a cache file, keyed by controller address. A plan is turned in
+to the stat fields it needs and only the fields that differ from the
+cache are written, adjacent ones in a single frame, so refreshing an
+unchanged schedule costs no bus traffic. Written fields are read back
+and only those that match are cached, so a write that failed or was
+garbled is tried again next time.
+
+"""
+
+from __future__ import absolute_import
+import json
+import logging
+import os
+import time
+
+import schedule_engine
+
+_log = logging.getLogger("EmonReporter.schedule_writer")
+
+DAY_FIELDS = ['mon_heat', 'tues_heat', 'wed_heat', 'thurs_heat', 'fri_heat', 'sat_heat',
+              'sun_heat']
+# writable fields in the order of their addresses on the stat
+FIELD_ORDER = ['frosttemp', 'runmode', 'holidayhours'] + DAY_FIELDS
+
+RUNMODE_HEATING = 0
+RUNMODE_FROST = 1
+FROST_RANGE = (7, 17)
+TEMP_RANGE = (5, 35)
+MAX_HOLIDAY_HOURS = 720
+UNUSED_PERIOD = [24, 0, 12]
+HOLIDAY_SLACK = 3600 # seconds the end of a holiday can move before it is written again
+
+def _clip(temp, limits):
+    return int(min(max(round(temp), limits[0]), limits[1]))
+
+def plan_fields(plan, now, day_program=True):
+    """Stat fields and their values for plan at now, a unix time.
+
+    Returns the fields and when the holiday ends, 0 if there is none.
+    Programs are left out for a stat in weekday and weekend mode."""
+    fields = {'runmode': RUNMODE_FROST if plan.frost else RUNMODE_HEATING}
+    if plan.frost:
+        fields['frosttemp'] = _clip(plan.temp, FROST_RANGE)
+        return fields, 0
+
+    hours = min(plan.holiday_hours, MAX_HOLIDAY_HOURS)
+    fields['holidayhours'] = hours
+    if hours:
+        fields['frosttemp'] = _clip(plan.temp, FROST_RANGE)
+    if day_program:
+        for date, periods in plan.days:
+            program = []
+            for periodtime, temp in periods:
+                program += [periodtime.hour, periodtime.minute, _clip(temp, TEMP_RANGE)]
+            fields[DAY_FIELDS[date.weekday()]] = \
+                program + UNUSED_PERIOD * (schedule_engine.PERIODS_PER_DAY - len(periods))
+    return fields, now + hours * 3600 if hours else 0
+
+def find_device(hmnetwork, name):
+    """Stat in hmnetwork with name as its name or long name, None if there isn't one."""
+    for device in hmnetwork.controllers:
+        if name in (getattr(device, 'name', None), getattr(device, 'long_name', None)):
+            return device
+    return None
+
+def changed_fields(fields, holiday_end, written, now):
+    """Fields whose values differ from those written, as cached.
+
+    holidayhours counts down on the stat, so it is compared by when the
+    holiday ends."""
+    changed = dict((name, value) for name, value in fields.items()
+                   if name != 'holidayhours' and written['fields'].get(name) != value)
+    if 'holidayhours' in fields:
+        written_end = written['holiday_end']
+        if written_end is None:
+            changed['holidayhours'] = fields['holidayhours']
+        elif holiday_end == 0:
+            if written_end > now: # still on the holiday last written
+                changed['holidayhours'] = 0
+        elif abs(holiday_end - written_end) > HOLIDAY_SLACK:
+            changed['holidayhours'] = fields['holidayhours']
+    return changed
+
+class ScheduleCache(object):
+    """Settings last written to each stat, kept in a json file."""
+    def __init__(self, path):
+        self._path = path
+        try:
+            with open(path) as cachefile:
+                self._stats = json.load(cachefile)
+        except (IOError, ValueError):
+            self._stats = {}
+
+    def get(self, address):
+        """Fields written to the stat at address and the end of its holiday, None if unknown."""
+        return self._stats.get(str(address), {'fields': {}, 'holiday_end': None})
+
+    def update(self, address, fields, holiday_end=None):
+        """Record fields as written, and the holiday end if holidayhours is among them."""
+        written = self._stats.setdefault(str(address), {'fields': {}, 'holiday_end': None})
+        written['fields'].update(fields)
+        if 'holidayhours' in fields:
+            written['holiday_end'] = holiday_end
+
+    def forget(self, address):
+        """Drop what is known of a stat, so everything is written next time."""
+        self._stats.pop(str(address), None)
+
+    def save(self):
+        """Write the cache out, replacing the old file only once complete."""
+        temppath = self._path + '.tmp'
+        with open(temppath, 'w') as cachefile:
+            json.dump(self._stats, cachefile, sort_keys=True)
+        os.replace(temppath, self._path)
+
+class ScheduleWriter(object):
+    """Writes plans to stats, sending only the fields that have changed."""
+    def __init__(self, cache, errors=(IOError,), clock=time.time):
+        self.cache = cache
+        self._errors = errors
+        self._clock = clock
+
+        self.fields_written = 0
+        self.write_failures = 0
+
+    def write(self, device, plan):
+        """Put plan in place on device, returning the number of fields written."""
+        now = self._clock()
+        day_program = DAY_FIELDS[0] in getattr(device.heat_schedule, 'entrynames', ())
+        if not day_program and not plan.frost:
+            _log.warning("C%i isn't in day program mode, only frost and holiday set",
+                            device.address)
+        fields, holiday_end = plan_fields(plan, now, day_program)
+        changed = changed_fields(fields, holiday_end, self.cache.get(device.address), now)
+        if not changed:
+            _log.debug("C%i schedule unchanged", device.address)
+            return 0
+
+        names = [name for name in FIELD_ORDER if name in changed]
+        try:
+            device.set_fields(names, [changed[name] for name in names])
+            readback = device.read_fields(names, 0)
+        except self._errors as errcatch:
+            # what was written is unknown, so it is all written again next time
+            _log.warning("C%i failed to write schedule due to %s", device.address, errcatch)
+            self.cache.forget(device.address)
+            self.cache.save()
+            self.write_failures += 1
+            return 0
+
+        verified = {}
+        for name, value in zip(names, readback):
+            if value == changed[name]:
+                verified[name] = changed[name]
+            else:
+                _log.warning("C%i %s read back as %s, not %s", device.address, name, value,
+                                changed[name])
+        self.cache.update(device.address, verified, holiday_end)
+        self.cache.save()
+        self.fields_written += len(names)
+        _log.info("C%i wrote %s", device.address, ', '.join(names))
+        return len(names)
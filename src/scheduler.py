@@ -0,0 +1,223 @@
+"""Scheduler
+
+Single threaded event loop for the reporter. The loop sleeps in the
+selector until the next timer deadline, until a registered file or socket
+becomes readable, or until a signal arrives, so an idle reporter costs
+next to nothing.
+
+"""
+
+from __future__ import absolute_import
+import heapq
+import itertools
+import logging
+import selectors
+import signal
+import socket
+import time
+
+class Timer(object):
+    """Handle for a callback scheduled on a Scheduler."""
+    def __init__(self, deadline, interval, callback, args, catch_up=0):
+        self.deadline = deadline
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.catch_up = catch_up # missed slots still run after an overrun, the rest are skipped
+        self.cancelled = False
+
+        # repeating timer statistics
+        self.runs = 0
+        self.overruns = 0 # times the next slot had already passed when a run finished
+        self.skipped = 0 # slots not run at all
+        self.caught_up = 0 # slots run late
+
+    def cancel(self):
+        """Stop the callback from running again."""
+        self.cancelled = True
+
+class Scheduler(object):
+    """Runs timed, file readiness and signal callbacks from one thread."""
+    def __init__(self, clock=time.monotonic, wallclock=time.time):
+        self._clock = clock
+        self._wallclock = wallclock
+        self._selector = selectors.DefaultSelector()
+        self._timers = []
+        self._sequence = itertools.count() # tie breaker for equal deadlines
+        self._signal_handlers = {}
+        self._old_wakeup_fd = None
+        self._running = False
+
+        # socket pair used to wake the selector from signals and other threads
+        self._wakeup_read, self._wakeup_write = socket.socketpair()
+        self._wakeup_read.setblocking(False)
+        self._wakeup_write.setblocking(False)
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ,
+                                    (self._read_wakeup, ()))
+
+        # loop statistics, latency is how late timers run after their deadline
+        self.wakeups = 0
+        self.timers_run = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def time(self):
+        """Return the current time on the scheduler clock."""
+        return self._clock()
+
+    def call_at(self, deadline, callback, *args):
+        """Run callback once at deadline on the scheduler clock."""
+        return self._push(Timer(deadline, None, callback, args))
+
+    def call_later(self, delay, callback, *args):
+        """Run callback once after delay seconds."""
+        return self.call_at(self._clock() + delay, callback, *args)
+
+    def call_every(self, interval, callback, *args, align=False, catch_up=0):
+        """Run callback every interval seconds, starting one interval from now.
+
+        align starts at the next whole multiple of interval on the wall clock,
+        so samples land on the same phase as the old time.time() % interval
+        loops; after that the monotonic clock is used, so clock steps don't
+        move the slots. If a run finishes after its next slot, up to catch_up
+        missed slots are run straight away and the rest are skipped."""
+        if align:
+            first = interval - self._wallclock() % interval
+        else:
+            first = interval
+        return self._push(Timer(self._clock() + first, interval, callback, args, catch_up))
+
+    def add_reader(self, fileobj, callback, *args):
+        """Run callback whenever fileobj is readable."""
+        self._selector.register(fileobj, selectors.EVENT_READ, (callback, args))
+
+    def remove_reader(self, fileobj):
+        """Stop watching fileobj."""
+        try:
+            self._selector.unregister(fileobj)
+        except KeyError:
+            pass
+
+    def add_signal_handler(self, signum, callback, *args):
+        """Run callback from the loop when signal signum is received."""
+        if self._old_wakeup_fd is None:
+            self._old_wakeup_fd = signal.set_wakeup_fd(self._wakeup_write.fileno())
+        self._signal_handlers[signum] = (callback, args)
+        # python level handler does nothing, the signal number arrives on the wakeup socket
+        signal.signal(signum, self._null_signal_handler)
+
+    def wakeup(self):
+        """Wake the loop, safe to call from other threads."""
+        try:
+            self._wakeup_write.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            pass # already a wakeup pending
+
+    def stop(self):
+        """Stop the loop after the current iteration."""
+        self._running = False
+        self.wakeup()
+
+    def run(self):
+        """Run the loop until stop is called."""
+        self._running = True
+        while self._running:
+            self.run_once()
+
+    def run_once(self, timeout=None):
+        """Wait for the next event, or timeout, and run any due callbacks."""
+        next_timeout = self._next_timeout()
+        if timeout is None or (next_timeout is not None and next_timeout < timeout):
+            timeout = next_timeout
+
+        events = self._selector.select(timeout)
+        self.wakeups += 1
+
+        for key, _ in events:
+            callback, args = key.data
+            self._run_callback(callback, args)
+
+        self._run_due_timers()
+
+    def close(self):
+        """Release the selector, wakeup sockets and signal wakeup fd."""
+        if self._old_wakeup_fd is not None:
+            signal.set_wakeup_fd(self._old_wakeup_fd)
+            self._old_wakeup_fd = None
+        self._selector.close()
+        self._wakeup_read.close()
+        self._wakeup_write.close()
+
+    def _push(self, timer):
+        """Add timer to the heap."""
+        heapq.heappush(self._timers, (timer.deadline, next(self._sequence), timer))
+        return timer
+
+    def _next_timeout(self):
+        """Seconds until the next live timer, None if there are no timers."""
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+        if not self._timers:
+            return None
+        return max(0.0, self._timers[0][0] - self._clock())
+
+    def _run_due_timers(self):
+        """Run all timers whose deadline has passed, rescheduling repeating ones."""
+        now = self._clock()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, timer = heapq.heappop(self._timers)
+            if timer.cancelled:
+                continue
+
+            latency = now - timer.deadline
+            self.timers_run += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+            self._run_callback(timer.callback, timer.args)
+
+            if timer.interval is not None:
+                self._reschedule(timer)
+
+    def _reschedule(self, timer):
+        """Queue the next run of a repeating timer, accounting for overruns."""
+        timer.runs += 1
+        # next deadline follows the last one, not now, so repeats don't drift
+        timer.deadline += timer.interval
+        now = self._clock()
+        if timer.deadline <= now:
+            # fell behind, run what catch up allows and skip the rest
+            timer.overruns += 1
+            missed = int((now - timer.deadline) // timer.interval) + 1
+            late = min(missed, timer.catch_up)
+            skipped = missed - late
+            timer.deadline += skipped * timer.interval
+            timer.skipped += skipped
+            timer.caught_up += late
+            logging.getLogger("EmonReporter").warning(
+                "%s overran its %.1f s interval, running %d late, skipping %d",
+                getattr(timer.callback, '__name__', timer.callback), timer.interval, late, skipped)
+        self._push(timer)
+
+    def _run_callback(self, callback, args):
+        """Run a callback, logging rather than propagating any failure."""
+        try:
+            callback(*args)
+        except Exception:
+            logging.getLogger("EmonReporter").exception("Scheduled callback %s failed", callback)
+
+    def _read_wakeup(self):
+        """Empty the wakeup socket and dispatch any signals received."""
+        try:
+            data = self._wakeup_read.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        for signum in bytearray(data):
+            if signum in self._signal_handlers:
+                callback, args = self._signal_handlers[signum]
+                self._run_callback(callback, (signum,) + args)
+
+    @staticmethod
+    def _null_signal_handler(signum, frame):
+        """Placeholder python handler, work is done from the loop."""
+        pass
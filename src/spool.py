@@ -0,0 +1,229 @@
+"""Spool
+
+Bounded on-disk store for frames that could not be sent to emonhub.
+
+Frames, text or for a binary spool bytes, are appended to numbered segment
+files as length and crc checked records carrying their read time. A small
+index file records how far the spool has been drained. Partial records
+left by a crash are truncated when the spool is opened, and the oldest
+segments are dropped when the spool is over its size limit.
+
+"""
+
+from __future__ import absolute_import
+import json
+import logging
+import os
+import struct
+import zlib
+
+_log = logging.getLogger("EmonReporter.spool")
+
+# record header, payload length, crc32 of payload, read time
+_HEADER = struct.Struct('<IIq')
+_SEGMENT_PREFIX = 'segment'
+_SEGMENT_SUFFIX = '.spool'
+_INDEX_NAME = 'spool.index'
+
+class FrameSpool(object):
+    """Append only, size bounded, crash safe spool of timestamped frames."""
+    def __init__(self, folder, max_bytes=50 * 1024 * 1024, segment_bytes=1024 * 1024, fsync=True,
+                 binary=False):
+        self._folder = folder
+        self._binary = binary
+        self._max_bytes = max_bytes
+        self._segment_bytes = segment_bytes
+        self._fsync = fsync
+
+        self._segments = {} # segment number -> [size in bytes, pending records]
+        self._cursor = (0, 0) # (segment number, offset) of next record to drain
+        self._write_file = None
+        self._write_segment = None
+
+        self.depth = 0 # records waiting to be drained
+        self.size_bytes = 0
+        self.evicted = 0
+
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self._recover()
+
+    def append(self, read_time, frame):
+        """Add a frame to the end of the spool."""
+        payload = frame if self._binary else frame.encode('utf-8')
+        record = _HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff,
+                                int(read_time)) + payload
+
+        if self._write_file is None or \
+                (self._segments[self._write_segment][0] > 0 and
+                 self._segments[self._write_segment][0] + len(record) > self._segment_bytes):
+            self._roll_segment()
+
+        self._write_file.write(record)
+        self._write_file.flush()
+        if self._fsync:
+            os.fsync(self._write_file.fileno())
+
+        self._segments[self._write_segment][0] += len(record)
+        self._segments[self._write_segment][1] += 1
+        self.size_bytes += len(record)
+        self.depth += 1
+
+        self._evict()
+
+    def read_batch(self, max_bytes, measure=None):
+        """Return up to max_bytes of the oldest records and a position for commit.
+
+        Records are (read_time, frame) tuples. measure(read_time, frame) gives
+        the bytes a record counts against max_bytes, as sent rather than as
+        stored, its stored length if not given. At least one record is
+        returned if any are waiting, and a batch never spans segments."""
+        self._skip_finished_segments()
+        if self.depth == 0:
+            return [], None
+
+        segment, offset = self._cursor
+        records = []
+        batch_bytes = 0
+        with open(self._segment_path(segment), 'rb') as segfile:
+            segfile.seek(offset)
+            while offset < self._segments[segment][0]:
+                header = segfile.read(_HEADER.size)
+                length, _, read_time = _HEADER.unpack(header)
+                frame = segfile.read(length)
+                if not self._binary:
+                    frame = frame.decode('utf-8')
+                size = length if measure is None else measure(read_time, frame)
+                if records and batch_bytes + size > max_bytes:
+                    break
+                records.append((read_time, frame))
+                batch_bytes += size
+                offset += _HEADER.size + length
+
+        return records, (segment, offset, len(records))
+
+    def commit(self, position):
+        """Mark the records returned with position as delivered."""
+        segment, offset, count = position
+        if segment not in self._segments:
+            return # evicted while the batch was being sent
+        self._cursor = (segment, offset)
+        self._segments[segment][1] -= count
+        self.depth -= count
+        self._skip_finished_segments()
+        self._write_index()
+
+    def close(self):
+        """Close the segment being written."""
+        if self._write_file is not None:
+            self._write_file.close()
+            self._write_file = None
+
+    def _recover(self):
+        """Load the index and segments, truncating any partial trailing records."""
+        numbers = sorted(int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)])
+                            for name in os.listdir(self._folder)
+                            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX))
+
+        try:
+            with open(os.path.join(self._folder, _INDEX_NAME)) as indexfile:
+                index = json.load(indexfile)
+            self._cursor = (index['segment'], index['offset'])
+        except (IOError, ValueError, KeyError):
+            self._cursor = (numbers[0] if numbers else 0, 0)
+
+        for number in numbers:
+            if number < self._cursor[0]:
+                # fully drained segment left behind by a crash
+                os.remove(self._segment_path(number))
+                continue
+            start = self._cursor[1] if number == self._cursor[0] else 0
+            size, records = self._scan_segment(number, start)
+            self._segments[number] = [size, records]
+            self.size_bytes += size
+            self.depth += records
+
+        if self._segments and self._cursor[0] not in self._segments:
+            self._cursor = (min(self._segments), 0)
+
+        if self.depth:
+            _log.info('spool holds %d unsent frames', self.depth)
+
+    def _scan_segment(self, number, start):
+        """Count valid records in a segment from start, truncating at the first bad one."""
+        path = self._segment_path(number)
+        records = 0
+        offset = 0
+        with open(path, 'rb') as segfile:
+            while True:
+                header = segfile.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                length, crc, _ = _HEADER.unpack(header)
+                payload = segfile.read(length)
+                if len(payload) < length or zlib.crc32(payload) & 0xffffffff != crc:
+                    break
+                if offset >= start:
+                    records += 1
+                offset += _HEADER.size + length
+
+        if offset < os.path.getsize(path):
+            _log.warning('truncating damaged spool segment %s at %d bytes', path, offset)
+            with open(path, 'r+b') as segfile:
+                segfile.truncate(offset)
+        return offset, records
+
+    def _roll_segment(self):
+        """Start a new segment file for appending."""
+        self.close()
+        self._write_segment = max(self._segments) + 1 if self._segments else self._cursor[0]
+        self._segments.setdefault(self._write_segment, [0, 0])
+        self._write_file = open(self._segment_path(self._write_segment), 'ab')
+
+    def _skip_finished_segments(self):
+        """Delete drained segments and move the cursor to the next one."""
+        segment, offset = self._cursor
+        while segment in self._segments and segment != self._write_segment and \
+                offset >= self._segments[segment][0]:
+            self._remove_segment(segment)
+            if self._segments:
+                segment = min(self._segments)
+            else:
+                segment += 1
+            offset = 0
+            self._cursor = (segment, offset)
+
+    def _evict(self):
+        """Drop the oldest segments until the spool is within its size limit."""
+        while self.size_bytes > self._max_bytes and len(self._segments) > 1:
+            oldest = min(self._segments)
+            lost = self._segments[oldest][1]
+            self.depth -= lost
+            self.evicted += lost
+            self._remove_segment(oldest)
+            if self._cursor[0] == oldest:
+                self._cursor = (min(self._segments), 0)
+            self._write_index()
+            _log.warning('spool full, dropped %d oldest frames', lost)
+
+    def _remove_segment(self, segment):
+        """Delete a segment file and forget it."""
+        self.size_bytes -= self._segments.pop(segment)[0]
+        try:
+            os.remove(self._segment_path(segment))
+        except OSError as errcatch:
+            _log.warning('could not remove spool segment: %s', errcatch)
+
+    def _write_index(self):
+        """Atomically record the drain position."""
+        path = os.path.join(self._folder, _INDEX_NAME)
+        with open(path + '.tmp', 'w') as indexfile:
+            json.dump({'segment': self._cursor[0], 'offset': self._cursor[1]}, indexfile)
+            indexfile.flush()
+            if self._fsync:
+                os.fsync(indexfile.fileno())
+        os.replace(path + '.tmp', path)
+
+    def _segment_path(self, number):
+        """File name for segment number."""
+        return os.path.join(self._folder, '%s%08d%s' % (_SEGMENT_PREFIX, number, _SEGMENT_SUFFIX))
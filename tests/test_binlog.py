@@ -0,0 +1,106 @@
+"""Unittests for src.binlog module"""
+import unittest
+import os
+import shutil
+import tempfile
+import time
+
+from emonreporter import binlog
+
+DAY = 86400
+
+class TestBinaryDatalogger(unittest.TestCase):
+    """Round trip, recovery and reader parity tests"""
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, logger, cycles, start=DAY * 3):
+        for cycle in range(cycles):
+            read_time = start + cycle * 60
+            logger.log_heatmiser(read_time, [20, 21], [0, 1], 1)
+            logger.log_sensor(read_time, '/28.A', 15.25 + cycle / 100)
+            logger.log_sensor(read_time, '/28.B', -3.5)
+
+    def test_round_trip(self):
+        logger = binlog.BinaryDatalogger(self.folder, flush_bytes=64)
+        self._write(logger, 10)
+        logger.close()
+        results = binlog.read_range(self.folder, DAY * 3 + 60, DAY * 3 + 300, ['/28.A', 'HOTW'])
+        self.assertEqual(sorted(results), ['/28.A', 'HOTW'])
+        self.assertEqual(list(results['/28.A'][0]), [DAY * 3 + 60 * i for i in range(1, 5)])
+        self.assertEqual(list(results['/28.A'][1]), [15.26, 15.27, 15.28, 15.29])
+
+    def test_flushed_by_age(self):
+        logger = binlog.BinaryDatalogger(self.folder, flush_bytes=100000, flush_age=0.05)
+        self._write(logger, 2)
+        for _ in range(100):
+            if logger.flushes:
+                break
+            time.sleep(0.01)
+        results = binlog.read_range(self.folder, DAY * 3, DAY * 4, ['/28.B'])
+        logger.close()
+        self.assertEqual(list(results['/28.B'][1]), [-3.5, -3.5])
+
+    def test_unflushed_day_empty(self):
+        logger = binlog.BinaryDatalogger(self.folder)
+        self._write(logger, 2)
+        paths = binlog.day_paths(self.folder, 3)
+        header = binlog.read_header(paths[0])
+        self.assertIsNotNone(header)
+        self.assertEqual(binlog.read_range(self.folder, DAY * 3, DAY * 4), {})
+        self.assertEqual(binlog._read_day_struct(header, paths[1], paths[2], DAY * 3, DAY * 4,
+                                                 None), {})
+        logger.close()
+
+    def test_day_rollover(self):
+        logger = binlog.BinaryDatalogger(self.folder)
+        self._write(logger, 4, start=DAY * 4 - 120)
+        logger.close()
+        self.assertTrue(os.path.exists(binlog.day_paths(self.folder, 3)[1]))
+        self.assertTrue(os.path.exists(binlog.day_paths(self.folder, 4)[1]))
+        results = binlog.read_range(self.folder, 0, DAY * 5)
+        self.assertEqual(len(results['/28.B'][0]), 4)
+
+    def test_recovers_partial_write(self):
+        logger = binlog.BinaryDatalogger(self.folder)
+        self._write(logger, 2)
+        logger.close()
+        # data of a cycle that never got its time record, then a torn record
+        with open(binlog.day_paths(self.folder, 3)[1], 'ab') as datafile:
+            datafile.write(binlog.DATA_RECORD.pack(0, 999) + b'\x01')
+
+        logger = binlog.BinaryDatalogger(self.folder)
+        logger.log_sensor(DAY * 3 + 600, '/28.A', 1.0)
+        logger.close()
+        results = binlog.read_range(self.folder, DAY * 3, DAY * 4, ['TEMP0', '/28.A'])
+        self.assertEqual(list(results['TEMP0'][1]), [20, 20])
+        self.assertEqual(list(results['/28.A'][1]), [15.25, 15.26, 1.0])
+
+    def test_out_of_range_skipped(self):
+        logger = binlog.BinaryDatalogger(self.folder)
+        logger.log_sensor(DAY * 3, '/28.A', 1000.0)
+        logger.log_sensor(DAY * 3 + 60, '/28.A', 10.0)
+        logger.close()
+        results = binlog.read_range(self.folder, DAY * 3, DAY * 4)
+        self.assertEqual(list(results['/28.A'][1]), [10.0])
+
+    @unittest.skipIf(binlog.numpy is None, "numpy not installed")
+    def test_struct_reader_matches_numpy(self):
+        logger = binlog.BinaryDatalogger(self.folder, flush_bytes=64)
+        self._write(logger, 20)
+        logger.close()
+        header = binlog.read_header(binlog.day_paths(self.folder, 3)[0])
+        paths = binlog.day_paths(self.folder, 3)[1:]
+        start, end = DAY * 3 + 100, DAY * 3 + 700
+        fast = binlog._read_day_numpy(header, paths[0], paths[1], start, end, None)
+        slow = binlog._read_day_struct(header, paths[0], paths[1], start, end, None)
+        self.assertEqual(sorted(fast), sorted(slow))
+        for sensor, (times, values) in slow.items():
+            self.assertEqual(list(fast[sensor][0]), times)
+            self.assertEqual(list(fast[sensor][1]), values)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+"""Unittests for src.config_watch module"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from emonreporter.config_watch import ConfigWatcher, changed_sections
+
+class TestConfigWatcher(unittest.TestCase):
+    """Change detection tests"""
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'emonreporter.conf')
+        with open(self.path, 'w') as conffile:
+            conffile.write('[ 1wire ]\n  owport = 4304\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_mtime_changes(self):
+        watcher = ConfigWatcher(self.path, use_inotify=False)
+        self.assertEqual(watcher.method, 'mtime')
+        self.assertFalse(watcher.changed())
+        with open(self.path, 'a') as conffile:
+            conffile.write('  read_workers = 2\n')
+        self.assertTrue(watcher.changed())
+        self.assertFalse(watcher.changed())
+
+    def test_replaced_file(self):
+        watcher = ConfigWatcher(self.path, use_inotify=False)
+        with open(self.path + '.new', 'w') as conffile:
+            conffile.write('[ 1wire ]\n  owport = 4305\n')
+        os.replace(self.path + '.new', self.path)
+        self.assertTrue(watcher.changed())
+        watcher.close()
+
+class TestChangedSections(unittest.TestCase):
+    """Config comparison tests"""
+    def test_changed_sections(self):
+        old = {'1wire': {'sensors': ['/28.A']}, 'emonsocket': {'node': '18'}, 'metrics': {}}
+        new = {'1wire': {'sensors': ['/28.A', '/28.B']}, 'emonsocket': {'node': '18'},
+               'reporting': {'deadband': '0.5'}}
+        self.assertEqual(changed_sections(old, new), ['1wire', 'metrics', 'reporting'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+"""Unittests for src.datalogger module"""
+import unittest
+import os
+import shutil
+import tempfile
+import time
+
+from emonreporter.datalogger import BufferedDatalogger
+
+DAY = 86400
+
+class TestBufferedDatalogger(unittest.TestCase):
+    """Buffering, day rollover and shutdown tests"""
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _read_day(self, day):
+        path = os.path.join(self.folder, 'testlog%s.txt' % float(day))
+        if not os.path.exists(path):
+            return ''
+        with open(path) as logfile:
+            return logfile.read()
+
+    def test_buffered_until_close(self):
+        logger = BufferedDatalogger(self.folder, flush_bytes=10000, flush_age=60)
+        logger.log('100:/28.A:+21.50\n', 100)
+        logger.log('130:/28.A:+21.75\n', 130)
+        self.assertEqual(logger.flushes, 0)
+        self.assertEqual(self._read_day(0), '')
+        logger.close()
+        self.assertEqual(self._read_day(0), '100:/28.A:+21.50\n130:/28.A:+21.75\n')
+        self.assertEqual(logger.bytes_written, 34)
+
+    def test_day_rollover(self):
+        logger = BufferedDatalogger(self.folder, flush_bytes=10000, flush_age=60, fsync='close')
+        logger.log('yesterday\n', DAY * 5 - 1)
+        logger.log('today\n', DAY * 5)
+        logger.close()
+        self.assertEqual(self._read_day(4), 'yesterday\n')
+        self.assertEqual(self._read_day(5), 'today\n')
+
+    def test_flush_on_size(self):
+        logger = BufferedDatalogger(self.folder, flush_bytes=20, flush_age=60)
+        logger.log('0123456789\n', 10)
+        logger.log('0123456789\n', 10)
+        for _ in range(100):
+            if logger.flushes:
+                break
+            time.sleep(0.01)
+        self.assertEqual(logger.flushes, 1)
+        logger.close()
+
+if __name__ == '__main__':
+    unittest.main()
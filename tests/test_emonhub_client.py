@@ -0,0 +1,202 @@
+"""Unittests for src.emonhub_client module"""
+import unittest
+import shutil
+import socket
+import tempfile
+import threading
+
+from emonreporter import emonhub_coder
+from emonreporter.emonhub_client import EmonhubClient
+from emonreporter.emonhub_receiver import BinaryFrameReceiver
+from emonreporter.spool import FrameSpool
+
+class LocalSink(object):
+    """Local stand in for the emonhub socket interfacer"""
+    def __init__(self, close_after_read, read_bytes=4096):
+        self.close_after_read = close_after_read
+        self.read_bytes = read_bytes
+        self.received = []
+        self.accepted = 0
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(5)
+        self.port = self._server.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            self.accepted += 1
+            while True:
+                data = conn.recv(self.read_bytes)
+                if not data:
+                    break
+                self.received.append(data)
+                if self.close_after_read:
+                    break
+            conn.close()
+
+    def close(self):
+        # shutdown wakes the accept, close alone leaves the port listening until it returns
+        self._server.shutdown(socket.SHUT_RDWR)
+        self._server.close()
+
+class TestEmonhubClient(unittest.TestCase):
+    """Connection reuse, reconnect and backoff tests"""
+    def _wait_for(self, sink, count):
+        for _ in range(200):
+            if len(sink.received) >= count:
+                return
+            threading.Event().wait(0.01)
+
+    def _wait_for_bytes(self, sink, length):
+        for _ in range(200):
+            if len(b''.join(sink.received)) >= length:
+                return
+            threading.Event().wait(0.01)
+
+    def test_connection_reused(self):
+        sink = LocalSink(False)
+        client = EmonhubClient('127.0.0.1', sink.port, persistent=True)
+        for _ in range(3):
+            self.assertTrue(client.send('18 1 2\r\n'))
+        self._wait_for_bytes(sink, len(b'18 1 2\r\n') * 3)
+        client.close()
+        sink.close()
+        self.assertEqual(client.connects, 1)
+        self.assertEqual(b''.join(sink.received), b'18 1 2\r\n' * 3)
+
+    def test_reconnect_after_hub_closes(self):
+        sink = LocalSink(True)
+        client = EmonhubClient('127.0.0.1', sink.port)
+        self.assertTrue(client.send('18 1\r\n'))
+        self._wait_for(sink, 1)
+        threading.Event().wait(0.05)
+        self.assertTrue(client.send('18 2\r\n'))
+        self._wait_for(sink, 2)
+        client.close()
+        sink.close()
+        self.assertEqual(client.connects, 2)
+        self.assertEqual(sink.received, [b'18 1\r\n', b'18 2\r\n'])
+
+    def test_default_connection_per_send(self):
+        sink = LocalSink(True, read_bytes=1024) # as the stock emonhub socket interfacer
+        client = EmonhubClient('127.0.0.1', sink.port)
+        for value in range(3):
+            self.assertTrue(client.send('18 %d\r\n' % value))
+        self._wait_for(sink, 3)
+        client.close()
+        sink.close()
+        self.assertEqual(client.connects, 3)
+        self.assertEqual(sink.received, [b'18 0\r\n', b'18 1\r\n', b'18 2\r\n'])
+
+    def test_backoff_when_unreachable(self):
+        sink = LocalSink(False)
+        port = sink.port
+        sink.close()
+        client = EmonhubClient('127.0.0.1', port, connect_timeout=0.5)
+        self.assertFalse(client.send('18 1\r\n'))
+        self.assertFalse(client.send('18 1\r\n'))
+        self.assertEqual(client.send_failures, 2)
+        self.assertFalse(client.connected)
+
+    def test_configure_keeps_or_moves_connection(self):
+        first, second = LocalSink(False), LocalSink(False)
+        client = EmonhubClient('127.0.0.1', first.port, persistent=True)
+        self.assertTrue(client.send('18 1\r\n'))
+        client.configure('127.0.0.1', first.port, persistent=True, timestamped=False)
+        self.assertTrue(client.connected)
+        client.configure('127.0.0.1', second.port)
+        self.assertFalse(client.connected)
+        self.assertTrue(client.send('18 2\r\n'))
+        self._wait_for(second, 1)
+        client.close()
+        first.close()
+        second.close()
+        self.assertEqual(client.connects, 2)
+        self.assertEqual(second.received, [b'18 2\r\n'])
+
+    def test_spool_drained_to_hub_reading_once(self):
+        # the stock emonhub socket interfacer reads up to 1024 bytes and closes
+        folder = tempfile.mkdtemp()
+        framespool = FrameSpool(folder, fsync=False)
+        for i in range(200):
+            framespool.append(1000 + i, '18 %d 0 1 2 3 4 5 6 7 8 9 10 11 12 13 14 15' % i)
+        sink = LocalSink(True, read_bytes=1024)
+        client = EmonhubClient('127.0.0.1', sink.port, persistent=False, timestamped=True,
+                               backoff_min=0, spool=framespool)
+        self.assertTrue(client.send('18 1\r\n', 2000))
+        while framespool.depth and client.drain():
+            pass
+        self._wait_for_bytes(sink, 201 * len(b'1000 18 1\r\n'))
+        client.close()
+        sink.close()
+        framespool.close()
+        shutil.rmtree(folder)
+        lines = b''.join(sink.received).splitlines()
+        self.assertEqual(framespool.depth, 0)
+        self.assertEqual(len(lines), 201)
+        self.assertEqual(lines[0], b'2000 18 1')
+        self.assertEqual(lines[1:], [b'%d 18 %d 0 1 2 3 4 5 6 7 8 9 10 11 12 13 14 15' % (1000 + i, i)
+                                     for i in range(200)])
+
+class TestBinaryTransport(unittest.TestCase):
+    """Packed frames sent as text or binary records"""
+    def _wait_for(self, receiver, count):
+        for _ in range(200):
+            if len(receiver.frames) >= count:
+                return
+            threading.Event().wait(0.01)
+
+    def test_packed_frames_as_text(self):
+        sink = LocalSink(False)
+        client = EmonhubClient('127.0.0.1', sink.port, timestamped=True)
+        payload = emonhub_coder.encode_many("h", [215, -3])
+        self.assertTrue(client.send_packed([('18', payload)], 1000))
+        for _ in range(200):
+            if sink.received:
+                break
+            threading.Event().wait(0.01)
+        client.close()
+        sink.close()
+        self.assertEqual(b''.join(sink.received), b'1000 18 215 0 253 255\r\n')
+
+    def test_binary_frames_received(self):
+        receiver = BinaryFrameReceiver()
+        client = EmonhubClient('127.0.0.1', receiver.port, binary=True)
+        payload = emonhub_coder.encode_many("Bh", [2, -55])
+        self.assertTrue(client.send_packed([('27', payload), ('18', b'')], 1000))
+        self.assertTrue(client.send('18 1 2\r\n', 1001))
+        self._wait_for(receiver, 3)
+        client.close()
+        receiver.close()
+        self.assertEqual(receiver.frames, [(1000, 27, payload), (1000, 18, b''),
+                                           (1001, 18, b'\x01\x02')])
+
+    def test_binary_spool_drained(self):
+        folder = tempfile.mkdtemp()
+        receiver = BinaryFrameReceiver()
+        port = receiver.port
+        receiver.close()
+        framespool = FrameSpool(folder, fsync=False, binary=True)
+        client = EmonhubClient('127.0.0.1', port, connect_timeout=0.5, backoff_min=0,
+                               spool=framespool, binary=True)
+        self.assertFalse(client.send_packed([('18', b'\x0a\x00')], 1000))
+        self.assertEqual(framespool.depth, 1)
+
+        receiver = BinaryFrameReceiver(port=port)
+        self.assertTrue(client.send_packed([('18', b'\x0b\x00')], 1030))
+        self._wait_for(receiver, 2)
+        client.close()
+        receiver.close()
+        framespool.close()
+        shutil.rmtree(folder)
+        self.assertEqual(receiver.frames, [(1030, 18, b'\x0b\x00'), (1000, 18, b'\x0a\x00')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+"""Unittests for src.emonhub_coder module"""
+import unittest
+import struct
+
+from emonreporter import emonhub_coder
+
+class TestBatchCoder(unittest.TestCase):
+    """Batch encode and decode against the single value functions"""
+    def test_encode_frame_matches_single(self):
+        values = [215, -100, 3000, 0]
+        expected = '18 ' + ' '.join(' '.join(map(str, emonhub_coder.encode("h", value)))
+                                     for value in values)
+        self.assertEqual(emonhub_coder.encode_frame('18', "h", values), expected)
+
+    def test_mixed_datacodes(self):
+        payload = emonhub_coder.encode_many("Bhh", [2, -55, 210])
+        self.assertEqual(emonhub_coder.decode_many("Bhh", payload), (2, -55, 210))
+        self.assertEqual(emonhub_coder.decode_many(["B", "h", "h"], list(bytearray(payload))),
+                         (2, -55, 210))
+
+    def test_decode_repeated_code(self):
+        payload = list(emonhub_coder.encode("h", 215)) + list(emonhub_coder.encode("h", -3))
+        self.assertEqual(emonhub_coder.decode_many("h", payload), (215, -3))
+
+    def test_invalid_datacode(self):
+        with self.assertRaises(ValueError):
+            emonhub_coder.encode_many("x", [1])
+        with self.assertRaises(ValueError):
+            emonhub_coder.encode_many("hh", [1, 2, 3])
+
+    @unittest.skipIf(emonhub_coder.numpy is None, "numpy not installed")
+    def test_numpy_matches_struct(self):
+        numpy = emonhub_coder.numpy
+        for datacode, values in [("h", [215, -3]), ("l", [70000, -1]), ("B", [0, 255]),
+                                 ("f", [21.5, -0.25])]:
+            self.assertEqual(emonhub_coder.encode_many(datacode, numpy.array(values)),
+                             emonhub_coder.encode_many(datacode, values))
+        for datacode, values in [("h", [21.5]), ("h", [40000]), ("B", [-1]), ("f", [1e40])]:
+            with self.assertRaises((struct.error, OverflowError)):
+                emonhub_coder.encode_many(datacode, values)
+            with self.assertRaises((struct.error, OverflowError)):
+                emonhub_coder.encode_many(datacode, numpy.array(values))
+
+class TestBinaryFrames(unittest.TestCase):
+    """Binary transport records"""
+    def test_pack_unpack_round_trip(self):
+        payload = emonhub_coder.encode_many("h", [215, -3])
+        data = (emonhub_coder.pack_frame(1600000000, '18', payload) +
+                emonhub_coder.pack_frame(1600000001, 27, b''))
+        frames, rest = emonhub_coder.unpack_frames(data + data[:5])
+        self.assertEqual(frames, [(1600000000, 18, payload), (1600000001, 27, b'')])
+        self.assertEqual(rest, data[:5])
+        self.assertEqual(emonhub_coder.frame_text(18, payload),
+                         emonhub_coder.encode_frame('18', "h", [215, -3]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+"""Unittests for src.emonreporter module"""
+import time
+import unittest
+from unittest import mock
+
+import pyownet
+
+import emonreporter.emonreporter as er
+
+class CountingInterfacer(er.ehi.EmonHubInterfacer):
+    """Source producing a numbered reading every interval"""
+    def __init__(self, name, queue_size=16):
+        super(CountingInterfacer, self).__init__(name, queue_size)
+        self.count = 0
+
+    def sample(self):
+        self.count += 1
+        return [er.ehi.readings.Reading(self.name, '18', 0, ['COUNT'], ['state'], [self.count])]
+
+class ListReporter(er.ehr.EmonHubReporter):
+    """Sink keeping what it processes, taking delay seconds over each"""
+    def __init__(self, name, delay=0, queue_size=64):
+        super(ListReporter, self).__init__(name, queue_size)
+        self.delay = float(delay)
+        self.values = []
+
+    def process(self, reading):
+        time.sleep(self.delay)
+        self.values.append(reading.values[0])
+
+class OpenedHeatmiserInterfacer(er.ehi.EmonHeatmiserInterfacer):
+    """Heatmiser interfacer on a network that opens without a serial port"""
+    def open(self):
+        self._hmnetwork = object()
+
+    def sample(self):
+        return []
+
+class FakeOwserver(object):
+    """owserver proxy with temperature sensors whose readings are set by hand"""
+    def __init__(self, temps):
+        self.temps = temps
+
+    def write(self, path, data):
+        pass
+
+    def dir(self):
+        return [sensor + '/' for sensor in sorted(self.temps)]
+
+    def present(self, path):
+        return '/' + path.strip('/').split('/')[0] in self.temps
+
+    def read(self, path, timeout=None):
+        sensor = '/' + path.strip('/').split('/')[0]
+        if sensor not in self.temps:
+            raise pyownet.protocol.OwnetError(2, 'no device', path)
+        return ('%12.4f' % self.temps[sensor]).encode('ascii')
+
+    def close_connection(self):
+        pass
+
+class FakeSetup(object):
+    """Settings that never change"""
+    def __init__(self, settings):
+        self.settings = settings
+
+    def run(self):
+        pass
+
+    def check_settings(self):
+        return False
+
+class TestEmonReporter(unittest.TestCase):
+    """Interfacer to reporter dispatch tests"""
+    def setUp(self):
+        patches = [mock.patch.object(er.ehi, 'CountingInterfacer', CountingInterfacer, create=True),
+                   mock.patch.object(er.ehr, 'ListReporter', ListReporter, create=True)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_slow_reporter_doesnt_stall_others(self):
+        settings = {
+            'hub': {'loglevel': 'WARNING'},
+            'interfacers': {'count': {'Type': 'CountingInterfacer', 'init_settings': {},
+                                      'runtimesettings': {'interval': '0.01'}}},
+            'reporters': {'fast': {'Type': 'ListReporter', 'init_settings': {}},
+                          'slow': {'Type': 'ListReporter',
+                                   'init_settings': {'delay': '0.2', 'queue_size': '2'}}},
+        }
+        reporter = er.EmonReporter(FakeSetup(settings))
+        end = time.monotonic() + 0.5
+        while time.monotonic() < end:
+            reporter._scheduler.run_once(0.05)
+        fast, slow = reporter._reporters['fast'], reporter._reporters['slow']
+        interfacer = reporter._interfacers['count']
+        sampled, fastcount, slowcount = interfacer.count, len(fast.values), len(slow.values)
+        reporter.close()
+
+        self.assertGreater(sampled, 20)
+        self.assertGreaterEqual(fastcount, sampled - 2)
+        self.assertEqual(fast.values, sorted(fast.values))
+        self.assertLess(slowcount, 5)
+        self.assertGreater(slow.queue.dropped, 0)
+
+    def test_reporter_removed_when_unlisted(self):
+        settings = {'hub': {}, 'interfacers': {},
+                    'reporters': {'fast': {'Type': 'ListReporter', 'init_settings': {}}}}
+        reporter = er.EmonReporter(FakeSetup(settings))
+        self.assertIn('fast', reporter._reporters)
+        reporter._update_settings({'hub': {}, 'interfacers': {}, 'reporters': {}})
+        self.assertEqual(reporter._reporters, {})
+        reporter.close()
+
+    def test_schedule_sync_follows_settings(self):
+        schedule = {'url': 'http://localhost/schedule.xml', 'destfile': '/tmp/schedule.xml',
+                    'interval': '900'}
+        settings = {'hub': {}, 'interfacers': {}, 'reporters': {}, 'schedule': schedule}
+        reporter = er.EmonReporter(FakeSetup(settings))
+        sync, timers = reporter._schedule_sync, reporter._schedule_timers
+        self.assertIsNotNone(sync)
+        self.assertEqual(len(timers), 2)
+        # no heatmiser interfacer to write through
+        with self.assertLogs('EmonReporter', 'WARNING'):
+            self.assertFalse(reporter._submit_job('heatmiser', None))
+        reporter._update_settings(dict(settings, schedule=dict(schedule)))
+        self.assertIs(reporter._schedule_sync, sync)
+        reporter._update_settings(dict(settings, schedule={}))
+        self.assertIsNone(reporter._schedule_sync)
+        self.assertTrue(all(timer.cancelled for timer in timers))
+        reporter.close()
+
+    def test_threads_log_under_reporter(self):
+        interfacer = CountingInterfacer('count')
+        with self.assertLogs('EmonReporter', 'WARNING') as logs:
+            interfacer.set(colour='red')
+        self.assertEqual(logs.records[0].name, 'EmonReporter.count')
+
+    def test_onewire_found_and_filtered(self):
+        owserver = FakeOwserver({'/28.A': 21.5})
+        interfacer = er.ehi.EmonOneWireInterfacer('onewire', ['/28.A', '/28.B'], conversion_time=0,
+                                                  deadband=0.5, heartbeat=600)
+        with mock.patch.object(pyownet.protocol, 'proxy', return_value=owserver):
+            interfacer.open()
+        try:
+            first = interfacer.sample()
+            self.assertEqual(first[0].values, [21.5, None])
+            owserver.temps['/28.A'] = 21.7 # within the deadband
+            self.assertEqual(interfacer.sample(), [])
+            owserver.temps['/28.A'] = 22.5
+            self.assertEqual(interfacer.sample()[0].values, [22.5, None])
+        finally:
+            interfacer.close()
+
+    def test_jobs_refused_unless_heatmiser_running(self):
+        interfacer = OpenedHeatmiserInterfacer('heatmiser')
+        self.assertFalse(interfacer.submit(None)) # not started
+        interfacer.set(interval=3600)
+        interfacer.start()
+        end = time.monotonic() + 1
+        while interfacer._hmnetwork is None and time.monotonic() < end:
+            time.sleep(0.01) # opened in the interfacer's thread
+        self.assertTrue(interfacer.submit(None))
+        interfacer.set(pause='all')
+        self.assertFalse(interfacer.submit(None))
+        interfacer.stop = True
+        interfacer.join()
+        interfacer.set(pause='off')
+        self.assertFalse(interfacer.submit(None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,34 +1,114 @@
-"""Unittests for src.get_schedule module"""
-import unittest
-import logging
-import os
-
-from emonreporter.get_schedule import XmlGetter
-from emonreporter.get_config import username, password, url, destfile
-
-class TestXmlGetter(unittest.TestCase):
-    """Low level serial send and recieve message tests"""
-    def setUp(self):
-        try:
-            os.remove(destfile)
-        except OSError:
-            pass
-    
-    def test_password_error(self):
-        getter = XmlGetter(username, 'bob')
-        with self.assertRaises(IOError):
-            getter.check_file(url, destfile)
-        
-    def test_file_error(self):
-        getter = XmlGetter(username, password)
-        with self.assertRaises(IOError):
-            getter.check_file(url + "d", destfile)
-
-    def test_download(self):
-        getter = XmlGetter(username, password)
-        self.assertEqual(getter.check_file(url, destfile), True)
-        #should only be downloaded once
-        self.assertEqual(getter.check_file(url, destfile), False)
-       
-if __name__ == '__main__':
-    unittest.main()
+"""Unittests for src.get_schedule module"""
+import unittest
+import base64
+import os
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from emonreporter.get_schedule import XmlGetter, METADATA_SUFFIX
+
+USERNAME = 'user'
+PASSWORD = 'secret'
+SCHEDULE = b'<?xml version="1.0"?><calendar><stat><name>Kitchen</name></stat></calendar>'
+
+class ScheduleHandler(BaseHTTPRequestHandler):
+    """Serves the stand-in schedule with basic auth and conditional GET"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        server.clients.add(self.client_address)
+        expected = 'Basic ' + base64.b64encode(
+            ('%s:%s' % (USERNAME, PASSWORD)).encode()).decode()
+        if self.headers.get('Authorization') != expected:
+            self._reply(401, 'text/html', b'denied')
+        elif self.path != '/schedule.xml':
+            self._reply(404, 'text/html', b'missing')
+        elif self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.send_header('ETag', server.etag)
+            self.end_headers()
+        else:
+            self._reply(200, 'application/xml', server.body)
+
+    def _reply(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if status == 200:
+            self.send_header('ETag', self.server.etag)
+            self.send_header('Last-Modified', 'Sat, 10 Nov 2018 05:15:00 GMT')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class TestXmlGetter(unittest.TestCase):
+    """Conditional fetch against a local stand-in server"""
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), ScheduleHandler)
+        self.server.requests = []
+        self.server.clients = set()
+        self.server.etag = '"v1"'
+        self.server.body = SCHEDULE
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/schedule.xml' % self.server.server_port
+        self.folder = tempfile.mkdtemp()
+        self.destfile = os.path.join(self.folder, 'schedule.xml')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.folder)
+
+    def test_password_error(self):
+        getter = XmlGetter(USERNAME, 'bob')
+        with self.assertRaises(IOError):
+            getter.check_file(self.url, self.destfile)
+        self.assertFalse(os.path.exists(self.destfile))
+
+    def test_file_error(self):
+        getter = XmlGetter(USERNAME, PASSWORD)
+        with self.assertRaises(IOError):
+            getter.check_file(self.url + "d", self.destfile)
+
+    def test_download(self):
+        getter = XmlGetter(USERNAME, PASSWORD)
+        self.assertEqual(getter.check_file(self.url, self.destfile), True)
+        #should only be downloaded once
+        self.assertEqual(getter.check_file(self.url, self.destfile), False)
+        with open(self.destfile, 'rb') as xmlfile:
+            self.assertEqual(xmlfile.read(), SCHEDULE)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(len(self.server.clients), 1) # one connection reused
+        self.assertEqual(self.server.requests[1]['If-None-Match'], '"v1"')
+        self.assertEqual(self.server.requests[1]['If-Modified-Since'],
+                         'Sat, 10 Nov 2018 05:15:00 GMT')
+        self.assertEqual(int(os.stat(self.destfile).st_mtime), 1541826900)
+        self.assertEqual(sorted(os.listdir(self.folder)),
+                         ['schedule.xml', 'schedule.xml' + METADATA_SUFFIX])
+
+    def test_changed_file_replaced(self):
+        getter = XmlGetter(USERNAME, PASSWORD)
+        getter.check_file(self.url, self.destfile)
+        self.server.etag = '"v2"'
+        self.server.body = SCHEDULE.replace(b'Kitchen', b'Hall')
+        self.assertEqual(getter.check_file(self.url, self.destfile), True)
+        with open(self.destfile, 'rb') as xmlfile:
+            self.assertIn(b'Hall', xmlfile.read())
+
+    def test_missing_copy_fetched_unconditionally(self):
+        getter = XmlGetter(USERNAME, PASSWORD)
+        getter.check_file(self.url, self.destfile)
+        os.remove(self.destfile)
+        self.assertEqual(getter.check_file(self.url, self.destfile), True)
+        self.assertNotIn('If-None-Match', self.server.requests[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""Unittests for src.heatmiser_poller module"""
+import unittest
+
+from emonreporter.heatmiser_poller import (CountingPort, CircuitBreaker, HeatmiserPoller,
+                                           UNTIERED, air_temp)
+
+class FakeClock(object):
+    """Clock moved on by hand"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class FakePort(object):
+    """Serial port returning zero bytes"""
+    timeout = 1
+
+    def write(self, data):
+        return len(data)
+
+    def read(self, size=1):
+        return b'\0' * size
+
+class FakeStat(object):
+    """Stat recording which fields went to the bus"""
+    def __init__(self, address, adaptor):
+        self.set_address = address
+        self._adaptor = adaptor
+        self.dead = False
+        self.reads = []
+
+    def read_fields(self, fields, maxage):
+        self.reads.append((list(fields), maxage))
+        if maxage != -1:
+            self._adaptor.serport.write(b'\0' * 10)
+            if self.dead:
+                raise IOError('no response')
+            self._adaptor.serport.read(11 + len(fields))
+        return [0, 20.0 + self.set_address, None, 1, 0]
+
+class FakeAdaptor(object):
+    def __init__(self):
+        self.serport = FakePort()
+
+class FakeNetwork(object):
+    def __init__(self, count=1):
+        self.adaptor = FakeAdaptor()
+        self.controllers = [FakeStat(address, self.adaptor) for address in range(1, count + 1)]
+
+class TestCountingPort(unittest.TestCase):
+    """Byte counting wrapper tests"""
+    def test_counts_and_delegates(self):
+        port = FakePort()
+        counting = CountingPort(port)
+        counting.write(b'abc')
+        self.assertEqual(counting.read(5), b'\0' * 5)
+        self.assertEqual((counting.bytes_sent, counting.bytes_received), (3, 5))
+        counting.timeout = 3
+        self.assertEqual(port.timeout, 3)
+        self.assertEqual(counting.timeout, 3)
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Exponential backoff tests"""
+    def test_backoff_and_recovery(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(10, 25, clock)
+        self.assertEqual([breaker.failure() for _ in range(3)], [10, 20, 25])
+        self.assertFalse(breaker.allow())
+        clock.now = 25
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.closed)
+        breaker.success()
+        self.assertTrue(breaker.closed)
+        self.assertEqual(breaker.failure(), 10)
+
+    def test_no_backoff(self):
+        breaker = CircuitBreaker(0, 3600, FakeClock())
+        self.assertEqual(breaker.failure(), 0)
+        self.assertTrue(breaker.allow())
+
+class TestHeatmiserPoller(unittest.TestCase):
+    """Tiered poll tests"""
+    def test_tiers_read_with_their_ages(self):
+        network = FakeNetwork()
+        poller = HeatmiserPoller(network)
+        self.assertEqual(poller.poll(), [[0, 21.0, None, 1, 0]])
+        self.assertEqual([maxage for _, maxage in network.controllers[0].reads],
+                         [0, 3600, 86400, -1])
+        # the rows come from the cache, so only the tiers touch the bus
+        self.assertEqual(poller.last_bytes, 3 * 10 + (11 + 4) + (11 + 1) + (11 + 1))
+        self.assertEqual(poller.bus_bytes, poller.last_bytes)
+        self.assertIsInstance(network.adaptor.serport, CountingPort)
+
+    def test_untiered(self):
+        network = FakeNetwork()
+        HeatmiserPoller(network, UNTIERED).poll()
+        self.assertEqual(network.controllers[0].reads[0], (UNTIERED[0][1], 0))
+
+    def test_no_adaptor(self):
+        network = FakeNetwork()
+        network.controllers[0]._adaptor = network.adaptor
+        del network.adaptor
+        poller = HeatmiserPoller(network)
+        poller.poll()
+        self.assertEqual(poller.bus_bytes, 0)
+
+    def test_failing_stat_backed_off(self):
+        clock = FakeClock()
+        network = FakeNetwork(3)
+        dead = network.controllers[1]
+        dead.dead = True
+        poller = HeatmiserPoller(network, clock=clock, backoff=60)
+        rows = poller.poll()
+        self.assertEqual([row is None for row in rows], [False, True, False])
+
+        dead.reads = []
+        clock.now = 30
+        self.assertIsNone(poller.poll()[1])
+        self.assertEqual(dead.reads, []) # not tried while backed off
+
+        dead.dead = False
+        clock.now = 60
+        self.assertEqual(poller.poll()[1], [0, 22.0, None, 1, 0])
+        self.assertTrue(poller.breakers[1].closed)
+
+    def test_air_temp(self):
+        self.assertEqual(air_temp([0, 20.5, 18.0, 1, 0]), 20.5)
+        self.assertEqual(air_temp([1, 20.5, 18.0, 1, 0]), 18.0)
+        self.assertIsNone(air_temp([2, 20.5, 18.0, 1, 0]))
+        self.assertIsNone(air_temp(None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Unittests for src.logquery module"""
+import unittest
+import os
+import shutil
+import tempfile
+
+from emonreporter import logquery
+from emonreporter.datalogger import LocalDatalogger
+
+DAY = 86400
+
+class TestLogQuery(unittest.TestCase):
+    """Parsing, indexed range reads and downsampling tests"""
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        logger = LocalDatalogger(self.folder)
+        for read_time in range(DAY * 10 - 600, DAY * 10 + 3600, 60):
+            logger.log_heatmiser(read_time, [20, 21], [0, 1], 1)
+            logger.log_sensor(read_time, '/28.A', (read_time % 600) / 100)
+            logger.log_sensor(read_time, '/28.B', -3.5)
+        logger.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_parse_line(self):
+        self.assertEqual(logquery.parse_line('100:/28.A:+21.50\n'), (100, [('/28.A', 21.5)]))
+        self.assertEqual(logquery.parse_line('100:TEMP20,21DEMAND0,1HOTW1\n'),
+                         (100, [('TEMP0', 20.0), ('TEMP1', 21.0), ('DEMAND0', 0.0),
+                                ('DEMAND1', 1.0), ('HOTW', 1.0)]))
+        self.assertIsNone(logquery.parse_line('garbage\n'))
+
+    def test_range_across_days(self):
+        records = list(logquery.read_records(self.folder, DAY * 10 - 120, DAY * 10 + 120, 'HOTW'))
+        self.assertEqual([record[0] for record in records],
+                         [DAY * 10 - 120, DAY * 10 - 60, DAY * 10, DAY * 10 + 60])
+
+    def test_indexed_seek_matches_scan(self):
+        logquery.INDEX_STRIDE, stride = 256, logquery.INDEX_STRIDE
+        try:
+            start, end = DAY * 10 + 1234, DAY * 10 + 2400
+            indexed = list(logquery.read_records(self.folder, start, end, '/28.A'))
+            path = logquery.log_path(self.folder, 10)
+            self.assertTrue(os.path.exists(path + logquery.INDEX_SUFFIX))
+            index = logquery.SparseIndex(path)
+            self.assertGreater(index.offset_for(start), 0)
+            self.assertGreater(len(index.times), 10)
+        finally:
+            logquery.INDEX_STRIDE = stride
+        scanned = [record for record in logquery.read_records(self.folder, DAY * 10, end, '/28.A')
+                   if record[0] >= start]
+        self.assertEqual(indexed, scanned)
+        self.assertEqual(indexed[0][0], DAY * 10 + 1260)
+
+    def test_index_extended_after_append(self):
+        path = logquery.log_path(self.folder, 10)
+        logquery.SparseIndex(path).offset_for(DAY * 10 + 60)
+        logger = LocalDatalogger(self.folder)
+        logger.log_sensor(DAY * 10 + 7200, '/28.A', 9.0)
+        logger.close()
+        records = list(logquery.read_records(self.folder, DAY * 10 + 7000, DAY * 11, '/28.A'))
+        self.assertEqual(records, [(DAY * 10 + 7200, '/28.A', 9.0)])
+
+    def test_downsample(self):
+        rows = list(logquery.query(self.folder, '/28.A', DAY * 10, DAY * 10 + 1200, 600))
+        self.assertEqual(len(rows), 2)
+        bucket, low, mean, high, count = rows[0]
+        self.assertEqual((bucket, low, high, count), (DAY * 10, 0.0, 5.4, 10))
+        self.assertAlmostEqual(mean, 2.7)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""Unittests for src.metrics module"""
+import unittest
+import os
+import shutil
+import socket
+import tempfile
+import urllib.request
+
+from emonreporter import metrics
+
+class TestMetrics(unittest.TestCase):
+    """Metric types and text format tests"""
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter_and_gauge(self):
+        counter = self.registry.counter('reads_total', 'Reads', ['sensor'])
+        counter.inc('/28.A')
+        counter.inc('/28.A', amount=2)
+        self.assertIs(self.registry.counter('reads_total', 'Reads', ['sensor']), counter)
+        depth = [5]
+        self.registry.gauge('depth', 'Depth').set_function(lambda: depth[0])
+        depth[0] = 7
+        text = self.registry.render()
+        self.assertIn('# TYPE reads_total counter\n', text)
+        self.assertIn('reads_total{sensor="/28.A"} 3\n', text)
+        self.assertIn('depth 7\n', text)
+        with self.assertRaises(ValueError):
+            self.registry.gauge('reads_total', 'Reads')
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('read_seconds', 'Reads', ['sensor'], buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, 'a"b')
+        self.assertEqual(histogram.count('a"b'), 4)
+        lines = self.registry.render().splitlines()
+        self.assertIn('read_seconds_bucket{sensor="a\\"b",le="0.1"} 2', lines)
+        self.assertIn('read_seconds_bucket{sensor="a\\"b",le="1.0"} 3', lines)
+        self.assertIn('read_seconds_bucket{sensor="a\\"b",le="+Inf"} 4', lines)
+        self.assertIn('read_seconds_sum{sensor="a\\"b"} 3.65', lines)
+
+class TestMetricsServer(unittest.TestCase):
+    """Endpoint tests over TCP and a unix socket"""
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.registry.counter('sends_total', 'Sends').inc()
+
+    def test_tcp(self):
+        server = metrics.MetricsServer('127.0.0.1:0', self.registry)
+        try:
+            url = 'http://127.0.0.1:%d/metrics' % server.address[1]
+            with urllib.request.urlopen(url, timeout=5) as response:
+                self.assertEqual(response.headers['Content-Type'], metrics.CONTENT_TYPE)
+                self.assertIn(b'sends_total 1\n', response.read())
+        finally:
+            server.close()
+
+    def test_unix_socket(self):
+        folder = tempfile.mkdtemp()
+        path = os.path.join(folder, 'metrics.sock')
+        server = metrics.MetricsServer(path, self.registry)
+        try:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(path)
+            client.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+            response = b''
+            while True:
+                data = client.recv(4096)
+                if not data:
+                    break
+                response += data
+            client.close()
+            self.assertTrue(response.startswith(b'HTTP/1.0 200'))
+            self.assertIn(b'sends_total 1\n', response)
+        finally:
+            server.close()
+            shutil.rmtree(folder)
+        self.assertFalse(os.path.exists(path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Unittests for src.onewire_discovery module"""
+import unittest
+import os
+import shutil
+import tempfile
+
+import pyownet
+
+from emonreporter.onewire_discovery import DiscoveryCache, OneWireDiscovery
+
+class FakeBus(object):
+    """Stand in for an owserver proxy with a set of temperature sensors"""
+    def __init__(self, sensors, others=()):
+        self.sensors = set(sensors)
+        self.others = set(others)
+        self.probes = 0
+
+    def dir(self):
+        return [sensor + '/' for sensor in sorted(self.sensors | self.others)]
+
+    def present(self, path):
+        self.probes += 1
+        device = '/' + path.strip('/').split('/')[0]
+        if path.endswith('latesttemp'):
+            return device in self.sensors
+        return device in self.sensors or device in self.others
+
+    def read(self, path):
+        device = '/' + path.strip('/').split('/')[0]
+        if device not in self.sensors:
+            raise pyownet.protocol.OwnetError(2, 'no device', path)
+        return b'    21.5'
+
+class TestOneWireDiscovery(unittest.TestCase):
+    """Startup cache and rescan tests"""
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cachepath = os.path.join(self.folder, 'discovery.json')
+        self.expected = ['/28.A', '/28.B']
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_cached_startup_skips_probes(self):
+        bus = FakeBus(self.expected)
+        discovery = OneWireDiscovery(bus, self.expected, DiscoveryCache(self.cachepath))
+        self.assertEqual(discovery.startup(), 2)
+        self.assertGreater(bus.probes, 0)
+
+        bus = FakeBus(self.expected)
+        discovery = OneWireDiscovery(bus, self.expected, DiscoveryCache(self.cachepath))
+        self.assertEqual(discovery.startup(), 2)
+        self.assertEqual(bus.probes, 0)
+        self.assertEqual(discovery.sensors, self.expected)
+
+    def test_rescan_adds_returned_sensors(self):
+        bus = FakeBus([])
+        discovery = OneWireDiscovery(bus, self.expected, DiscoveryCache(self.cachepath))
+        self.assertEqual(discovery.startup(), 0)
+        sampled = discovery.sensors
+        self.assertEqual(sampled, [])
+
+        bus.sensors.add('/28.B')
+        bus.others.add('/10.C')
+        discovery.rescan()
+        self.assertEqual(sampled, self.expected)
+        cache = DiscoveryCache(self.cachepath)
+        self.assertTrue(cache.get('/28.B')['temperature'])
+        self.assertFalse(cache.get('/10.C')['temperature'])
+        self.assertEqual(cache.get('/10.C')['family'], '10')
+        self.assertIsNone(cache.get('/28.A'))
+
+    def test_background_rescan(self):
+        bus = FakeBus(self.expected)
+        discovery = OneWireDiscovery(bus, self.expected, DiscoveryCache(self.cachepath))
+        discovery.startup()
+        discovery.start(60)
+        discovery.stop()
+        self.assertEqual(discovery.rescans, 1)
+
+if __name__ == '__main__':
+    unittest.main()
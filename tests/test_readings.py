@@ -0,0 +1,39 @@
+"""Unittests for src.readings module"""
+import threading
+import unittest
+
+from emonreporter.readings import BoundedQueue, Reading, encode_reading
+
+class TestBoundedQueue(unittest.TestCase):
+    """Bounded queue and backpressure tests"""
+    def test_drops_oldest_when_full(self):
+        queue = BoundedQueue('test_drop', 2)
+        self.assertTrue(queue.put(1))
+        self.assertTrue(queue.put(2))
+        self.assertFalse(queue.put(3))
+        self.assertEqual((queue.get(0), queue.get(0), queue.get(0)), (2, 3, None))
+        self.assertEqual((queue.dropped, queue.high_water), (1, 2))
+
+    def test_put_waits_for_space(self):
+        queue = BoundedQueue('test_wait', 1)
+        queue.put(1)
+        threading.Timer(0.05, queue.get).start()
+        self.assertTrue(queue.put(2, timeout=5))
+        self.assertEqual(queue.get(0), 2)
+        self.assertEqual(queue.dropped, 0)
+
+    def test_get_waits_for_item(self):
+        queue = BoundedQueue('test_get', 1)
+        threading.Timer(0.05, queue.put, (1,)).start()
+        self.assertEqual(queue.get(5), 1)
+
+class TestEncodeReading(unittest.TestCase):
+    """Frame encoding tests"""
+    def test_kinds_and_nulls(self):
+        reading = Reading('hm', '27', 0, ['HOTW', 'TEMP0', 'DEMAND0', 'TEMP1', 'DEMAND1'],
+                          ['state', 'temperature', 'state', 'temperature', 'state'],
+                          [1, 20.5, 0, None, None])
+        self.assertEqual(encode_reading(reading, -10), '27 1 205 0 0 156 255 99')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+"""Unittests for src.report_policy module"""
+import unittest
+
+from emonreporter.report_policy import ReportPolicy
+
+class TestReportPolicy(unittest.TestCase):
+    """Deadband, heartbeat and adaptive interval tests"""
+    def test_deadband(self):
+        policy = ReportPolicy(0.5)
+        self.assertTrue(policy.due([('/28.A', 20.0), ('/28.B', 5.0)], 0))
+        self.assertFalse(policy.due([('/28.A', 20.5), ('/28.B', 5.0)], 10))
+        self.assertTrue(policy.due([('/28.A', 20.5), ('/28.B', 4.4)], 20))
+        # compared with the last reported value, not the last reading
+        self.assertFalse(policy.due([('/28.A', 20.0), ('/28.B', 4.0)], 30))
+        self.assertEqual((policy.frames_offered, policy.frames_reported), (4, 2))
+        self.assertEqual(policy.suppressed, 0.5)
+
+    def test_new_sensor_and_heartbeat(self):
+        policy = ReportPolicy(0.5, heartbeat=60)
+        self.assertTrue(policy.due([('/28.A', 20.0)], 0))
+        self.assertTrue(policy.due([('/28.A', 20.0), ('/28.B', 1.0)], 10))
+        self.assertFalse(policy.due([('/28.A', 20.0), ('/28.B', 1.0)], 69))
+        self.assertTrue(policy.due([('/28.A', 20.0), ('/28.B', 1.0)], 70))
+
+    def test_sensor_deadband(self):
+        policy = ReportPolicy(0.5, deadbands={'HOTW': 0})
+        policy.due([('TEMP0', 20.0), ('HOTW', 0)], 0)
+        self.assertTrue(policy.due([('TEMP0', 20.0), ('HOTW', 1)], 10))
+
+    def test_adaptive_interval(self):
+        policy = ReportPolicy(0.5, slow_interval=60, fast_interval=10)
+        policy.due([('/28.A', 20.0)], 0)
+        self.assertEqual(policy.next_interval(), 60)
+        policy.due([('/28.A', 21.0)], 60)
+        self.assertEqual(policy.next_interval(), 10)
+        intervals = []
+        for step in range(4):
+            policy.due([('/28.A', 21.0)], 70 + step)
+            intervals.append(policy.next_interval())
+        self.assertEqual(intervals, [20, 40, 60, 60])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""Unittests for src.rept_1wire_hmv2 module"""
+import unittest
+from unittest import mock
+
+import pyownet
+
+from emonreporter import emonhub_coder
+try:
+    import emonreporter.rept_1wire_hmv2 as rept
+except (ImportError, SyntaxError): # heatmisercontroller not installed for this python
+    rept = None
+
+class FakeSetup(object):
+    """Settings in the shape rept_1wire_hmv2 reads them from its config file"""
+    def __init__(self, configfile=None):
+        self.settings = {'1wire': {'owport': 4304, 'sensors': ['/28.A']},
+                         'emonsocket': {'host': 'localhost', 'port': '50011', 'node': '18',
+                                        'temperaturenull': -10},
+                         'logging': {'logfolder': '/tmp'}}
+
+class ChangedWatcher(object):
+    """ConfigWatcher for a file that has always just changed"""
+    def changed(self):
+        return True
+
+class FakeOwnet(object):
+    """owserver proxy with sensors that read, any others failing"""
+    def __init__(self, temps):
+        self.temps = temps
+
+    def read(self, path):
+        sensor = path.rsplit('/', 1)[0]
+        if sensor not in self.temps:
+            raise pyownet.protocol.Error('no sensor')
+        return ('%12.4f' % self.temps[sensor]).encode('ascii')
+
+class ListLogger(object):
+    """Datalogger keeping what it is given"""
+    def __init__(self):
+        self.logged = []
+
+    def log_sensor(self, read_time, sensor, temp):
+        self.logged.append((read_time, sensor, temp))
+
+@unittest.skipIf(rept is None, "heatmisercontroller not importable")
+class TestOneWireFrames(unittest.TestCase):
+    """1-wire frames sent and readings logged"""
+    def setUp(self):
+        rept.setup = FakeSetup()
+        rept.datalogger = ListLogger()
+        rept.read_time = 1000
+
+    def test_failed_reads_sent_as_null_not_logged(self):
+        frames = rept.get_1wire_data(FakeOwnet({'/28.A': 21.5}), ['/28.A', '/28.B'],
+                                     conversion_deadline=0)
+        self.assertEqual(frames, [('18', emonhub_coder.encode_many('h', [215, -100]))])
+        self.assertEqual(rept.datalogger.logged, [(1000, '/28.A', 21.5)])
+
+    def test_nothing_sent_when_all_fail(self):
+        self.assertEqual(rept.get_1wire_data(FakeOwnet({}), ['/28.A'], conversion_deadline=0),
+                         [])
+        self.assertEqual(rept.datalogger.logged, [])
+
+@unittest.skipIf(rept is None, "heatmisercontroller not importable")
+class TestOneWireBuses(unittest.TestCase):
+    """Connecting to owservers"""
+    def setUp(self):
+        rept.setup = FakeSetup()
+
+    def test_unreachable_owserver(self):
+        unreachable = mock.Mock(side_effect=pyownet.protocol.ConnError('refused'))
+        with mock.patch.object(pyownet.protocol, 'proxy', unreachable):
+            ownet, sensors = rept._initialise_owserver('nohost', 4304, ['/28.A'], '/tmp/none.json')
+        self.assertEqual((ownet, sensors), (None, []))
+        self.assertIsNone(rept.start_1wire_conversion(ownet))
+
+    def test_unreached_bus_keeps_its_slots(self):
+        rept.datalogger = ListLogger()
+        rept.read_time = 1000
+        buses = [rept.OneWireBus('main', FakeOwnet({'/28.A': 21.5}), ['/28.A'], None, '18'),
+                 rept.OneWireBus('far', None, [], None, '18', ['/28.C', '/28.D']),
+                 rept.OneWireBus('near', FakeOwnet({'/28.E': 19.0}), ['/28.E'], None, '18')]
+        frames = rept.get_1wire_buses_data(buses, [0, None, 0])
+        self.assertEqual(frames, [('18', emonhub_coder.encode_many('h', [215, -100, -100, 190]))])
+
+    def test_unreached_bus_retried(self):
+        bus = rept.OneWireBus('far', None, [], None, '18', ['/28.C'], ('far', 4304, '/tmp/c.json'))
+        ownet = FakeOwnet({'/28.C': 18.0})
+        with mock.patch.object(rept, '_initialise_owserver', return_value=(ownet, ['/28.C'])) \
+                as initialise:
+            self.assertIsNone(rept._connect_bus(bus)) # not yet time to retry
+            bus.retry_at = 0
+            self.assertIs(rept._connect_bus(bus), ownet)
+        initialise.assert_called_once_with('far', 4304, ['/28.C'], '/tmp/c.json')
+        self.assertEqual(bus.sensors, ['/28.C'])
+
+@unittest.skipIf(rept is None, "heatmisercontroller not importable")
+class TestReloadSettings(unittest.TestCase):
+    """Applying a changed config file"""
+    def setUp(self):
+        rept.setup = FakeSetup()
+        self.newsetup = FakeSetup()
+
+    def reload(self):
+        with mock.patch.object(rept.hms, 'HeatmiserControllerFileSetup',
+                               return_value=self.newsetup), \
+                mock.patch.object(rept, 'reload_1wire_buses') as reload_buses:
+            rept.reload_settings(ChangedWatcher(), 'emonreporter.conf')
+        return reload_buses
+
+    def test_missing_setting_not_applied(self):
+        oldsetup = rept.setup
+        del self.newsetup.settings['1wire']['sensors']
+        with self.assertLogs(level='WARNING') as logs:
+            reload_buses = self.reload()
+        self.assertIn('no sensors in [1wire]', logs.output[0])
+        self.assertIs(rept.setup, oldsetup)
+        reload_buses.assert_not_called()
+
+    def test_bad_number_not_applied(self):
+        oldsetup = rept.setup
+        self.newsetup.settings['emonsocket']['temperaturenull'] = 'none'
+        with self.assertLogs(level='WARNING'):
+            self.reload()
+        self.assertIs(rept.setup, oldsetup)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""Unittests for src.schedule_engine module"""
+import unittest
+import random
+from datetime import datetime, time, timedelta, timezone
+
+from emonreporter import schedule_engine
+
+NOW = datetime(2018, 11, 10, 12, 0, tzinfo=timezone.utc)
+
+def targets_at(*pairs):
+    """Targets from (hours after midnight today, temp) pairs"""
+    midnight = datetime.combine(NOW.date(), time(), timezone.utc)
+    return [{'time': midnight + timedelta(hours=hours), 'temp': temp} for hours, temp in pairs]
+
+def random_targets(rand, count):
+    """Time ordered targets starting in the past"""
+    when = NOW - timedelta(hours=rand.uniform(0, 48))
+    targets = []
+    for _ in range(count):
+        when += timedelta(minutes=rand.choice([5, 15, 30, 60, 120, 240, 1500]))
+        targets.append({'time': when, 'temp': rand.choice([5, 15, 18, 20, 21.5])})
+    return targets
+
+class TestScheduleEngine(unittest.TestCase):
+    """Compression, frost and holiday decisions"""
+    def test_shortest_held_dropped(self):
+        targets = targets_at((11, 18), (30, 20), (30.5, 15), (32, 21), (40, 19), (40.25, 17),
+                             (45, 16))
+        kept = schedule_engine.compress(targets, NOW)
+        # tomorrow's 20 and 19 are held for least time, skipped by pulling the following
+        # temperatures forward
+        self.assertEqual([(target['time'].hour, target['temp']) for target in kept],
+                         [(11, 18), (6, 15), (8, 21), (16, 17), (21, 16)])
+
+    def test_current_and_next_kept_today(self):
+        targets = targets_at((11.9, 18), (12.02, 20), (12.2, 21), (13, 19), (13.1, 5), (20, 15))
+        kept = schedule_engine.compress(targets, NOW)
+        # 12:01 follows 11:54 most closely but is the next target, so isn't dropped
+        self.assertEqual([(target['time'].time(), target['temp']) for target in kept],
+                         [(time(11, 54), 18), (time(12, 1, 12), 21), (time(13), 5),
+                          (time(20), 15)])
+
+    def test_frost_without_later_targets(self):
+        plan = schedule_engine.plan(targets_at((-30, 19), (8, 17)), NOW)
+        self.assertEqual(plan, schedule_engine.Plan(17, True, 0, []))
+        self.assertIsNone(schedule_engine.plan([], NOW))
+
+    def test_holiday_until_next_change(self):
+        plan = schedule_engine.plan(targets_at((8, 12), (12 + 50.5, 20), (12 + 60, 18)), NOW)
+        self.assertEqual((plan.temp, plan.frost, plan.holiday_hours), (12, False, 50))
+        self.assertEqual([periods for _, periods in plan.days[:2]], [[], []])
+        self.assertEqual(plan.days[2][1], [(time(0, 0), 12), (time(14, 30), 20)])
+        self.assertEqual(plan.days[3][1], [(time(0, 0), 18)])
+
+    def test_today_holds_current_and_next_week(self):
+        targets = targets_at((7, 20), (18, 21), (24 * 7 + 6, 19), (24 * 7 + 9, 16),
+                             (24 * 7 + 13, 14))
+        plan = schedule_engine.plan(targets, NOW)
+        self.assertEqual(plan.days[0], (NOW.date(), [(time(6), 19), (time(7), 20), (time(18), 21)]))
+        # the same plan until the next change
+        self.assertEqual(plan, schedule_engine.plan(targets, NOW + timedelta(hours=5)))
+
+    def test_properties(self):
+        rand = random.Random(4)
+        for _ in range(300):
+            targets = random_targets(rand, rand.randint(1, 120))
+            kept = schedule_engine.compress(targets, NOW)
+            times = [target['time'] for target in targets]
+
+            self.assertLessEqual(kept[0]['time'], max(NOW, times[0]))
+            for target, following in zip(kept, kept[1:] + [None]):
+                # kept targets are a time ordered subset holding the last temperature
+                # the calendar reaches before the next kept target
+                index = times.index(target['time'])
+                self.assertTrue(following is None or target['time'] < following['time'])
+                last = [other for other in targets[index:]
+                        if following is None or other['time'] < following['time']][-1]
+                self.assertEqual(target['temp'], last['temp'])
+            dates = [max(target['time'].date(), NOW.date()) for target in kept]
+            self.assertLessEqual(max(dates.count(date) for date in dates), 4)
+            until = NOW.date() + timedelta(days=rand.randint(0, 5))
+            self.assertEqual(schedule_engine.compress(targets, NOW, until=until),
+                             [target for target in kept if target['time'].date() <= until])
+
+            plan = schedule_engine.plan(targets, NOW)
+            for _, periods in plan.days:
+                self.assertLessEqual(len(periods), 4)
+                self.assertEqual(periods, sorted(periods, key=lambda period: period[0]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+"""Unittests for src.schedule_parser module"""
+import unittest
+import io
+from datetime import datetime, timedelta, timezone
+
+from emonreporter import schedule_parser
+
+NOW = datetime(2018, 11, 10, 12, 0, tzinfo=timezone.utc)
+
+SCHEDULE = b'''<?xml version="1.0"?>
+<calendar>
+  <stat><name>Kitchen</name><targets>
+    <target time="2018-11-10T05:15:00+00:00">20</target>
+    <target time="2018-11-10T22:30:00Z">15.5</target>
+    <target time="2018-11-27T06:00:00+00:00">21</target>
+    <target time="not a time">18</target>
+  </targets></stat>
+  <stat><name>Hall</name><targets>
+    <target time="2018-11-11T07:00:00+01:00">19</target>
+  </targets></stat>
+  <stat><name>Empty</name><targets/></stat>
+</calendar>'''
+
+class TestScheduleParser(unittest.TestCase):
+    """Streaming stats and targets"""
+    def test_stats_and_targets(self):
+        stats = list(schedule_parser.iter_stats(io.BytesIO(SCHEDULE), NOW))
+        self.assertEqual([name for name, _ in stats], ['Kitchen', 'Hall', 'Empty'])
+        kitchen = stats[0][1]
+        self.assertEqual(kitchen, [
+            {'time': datetime(2018, 11, 10, 5, 15, tzinfo=timezone.utc), 'temp': 20.0},
+            {'time': datetime(2018, 11, 10, 22, 30, tzinfo=timezone.utc), 'temp': 15.5}])
+        self.assertEqual(stats[1][1][0]['time'],
+                         datetime(2018, 11, 11, 6, 0, tzinfo=timezone.utc))
+        self.assertEqual(stats[2][1], [])
+
+    def test_horizon(self):
+        stats = dict(schedule_parser.iter_stats(io.BytesIO(SCHEDULE), NOW, timedelta(hours=1)))
+        self.assertEqual(len(stats['Kitchen']), 1)
+        self.assertEqual(stats['Hall'], [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""Unittests for src.schedule_sync module"""
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from emonreporter.schedule_sync import ScheduleSync
+from emonreporter.schedule_writer import DAY_FIELDS
+
+NOW = datetime(2018, 11, 10, 12, 0, tzinfo=timezone.utc)
+
+def schedule_xml(stats):
+    """Schedule of {name: [(hours from NOW, temp)]}"""
+    parts = ['<?xml version="1.0"?>\n<calendar>\n']
+    for name, targets in sorted(stats.items()):
+        parts.append('<stat><name>%s</name><targets>\n' % name)
+        for hours, temp in targets:
+            parts.append('<target time="%s">%s</target>\n'
+                         % ((NOW + timedelta(hours=hours)).isoformat(), temp))
+        parts.append('</targets></stat>\n')
+    parts.append('</calendar>\n')
+    return ''.join(parts)
+
+class FakeGetter(object):
+    """XmlGetter serving a schedule held in memory"""
+    def __init__(self):
+        self.xml = None
+        self.version = 0
+        self.fetches = 0
+        self.saved = None
+
+    def publish(self, stats):
+        self.xml = schedule_xml(stats)
+        self.version += 1
+
+    def check_file(self, url, destfile):
+        self.fetches += 1
+        if self.saved == self.version:
+            return False
+        with open(destfile, 'w') as xmlfile:
+            xmlfile.write(self.xml)
+        self.saved = self.version
+        return True
+
+    def validators(self, destfile):
+        return ('"%d"' % self.saved, None)
+
+class FakeSchedule(object):
+    """Heat schedule of a stat in day program mode"""
+    entrynames = list(DAY_FIELDS)
+
+class FakeStat(object):
+    """Stat counting the writes made to it"""
+    def __init__(self, name, address):
+        self.name = name
+        self.long_name = name
+        self.address = address
+        self.heat_schedule = FakeSchedule()
+        self.fields = {}
+        self.writes = 0
+
+    def set_fields(self, names, values):
+        self.writes += 1
+        self.fields.update(zip(names, values))
+
+    def read_fields(self, names, maxage):
+        return [self.fields.get(name) for name in names]
+
+class FakeNetwork(object):
+    """Network of two stats"""
+    def __init__(self):
+        self.controllers = [FakeStat('Kit', 1), FakeStat('B1', 2)]
+
+class TestScheduleSync(unittest.TestCase):
+    """Polling, reparsing and replanning only what changed"""
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.now = NOW
+        self.getter = FakeGetter()
+        self.getter.publish({'Kit': [(-2, 18), (6, 20), (10, 15), (30, 21)],
+                             'B1': [(-5, 16), (3, 19), (8, 14)]})
+        self.network = FakeNetwork()
+        self.sync = ScheduleSync(self.getter, 'http://schedule', os.path.join(self.folder, 's.xml'),
+                                 self.submit, clock=lambda: self.now)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def submit(self, job):
+        job(self.network, (IOError,))
+        return True
+
+    def writes(self):
+        return [stat.writes for stat in self.network.controllers]
+
+    def test_unchanged_schedule_not_reworked(self):
+        self.sync.poll()
+        self.assertEqual((self.sync.parses, self.sync.plans), (1, 2))
+        self.assertEqual(self.writes(), [1, 1])
+        self.now += timedelta(minutes=15)
+        self.sync.poll()
+        self.assertEqual(self.getter.fetches, 2)
+        self.assertEqual((self.sync.parses, self.sync.plans), (1, 2))
+        self.assertEqual(self.writes(), [1, 1])
+
+    def test_only_changed_stats_replanned(self):
+        self.sync.poll()
+        self.getter.publish({'Kit': [(-2, 18), (6, 20), (10, 15), (30, 21)],
+                             'B1': [(-5, 16), (3, 20), (8, 14)]})
+        self.sync.poll()
+        self.assertEqual((self.sync.parses, self.sync.plans), (2, 3))
+        self.assertEqual(self.writes(), [1, 2])
+
+    def test_replanned_at_next_target_and_midnight(self):
+        self.sync.poll()
+        self.now = NOW + timedelta(hours=3, minutes=5) # B1's next target
+        self.sync.poll()
+        self.assertEqual(self.sync.plans, 3)
+        self.now = NOW + timedelta(hours=12, minutes=5) # past midnight, today moves on
+        self.sync.poll()
+        self.assertEqual((self.sync.parses, self.sync.plans), (1, 5))
+        self.assertIn('sun_heat', self.network.controllers[0].fields)
+
+    def test_replanned_at_local_midnight(self):
+        self.now = NOW.astimezone(timezone(timedelta(hours=10))) # 22:00 locally
+        self.sync.poll()
+        self.assertEqual(self.sync.plans, 2)
+        self.now += timedelta(hours=2, minutes=5) # a new day locally, not in UTC
+        self.sync.poll()
+        self.assertEqual(self.sync.plans, 4)
+
+    def test_unsubmitted_plans_kept(self):
+        self.sync._submit = lambda job: False # no heatmiser interfacer yet
+        self.sync.poll()
+        self.assertEqual(self.writes(), [0, 0])
+        self.sync._submit = self.submit
+        self.now += timedelta(minutes=15)
+        self.sync.poll()
+        self.assertEqual(self.writes(), [1, 1])
+        self.assertEqual(self.sync.plans, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+"""Unittests for src.schedule_writer module"""
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date, datetime, time, timedelta, timezone
+
+from emonreporter import schedule_engine
+from emonreporter.schedule_writer import (DAY_FIELDS, ScheduleCache, ScheduleWriter, find_device,
+                                          plan_fields)
+
+NOW = 1541851200 # 2018-11-10 12:00 UTC, a Saturday
+SATURDAY = date(2018, 11, 10)
+SUNDAY = date(2018, 11, 11)
+
+class FakeClock(object):
+    """Clock moved on by hand"""
+    def __init__(self):
+        self.now = NOW
+
+    def __call__(self):
+        return self.now
+
+class FakeSchedule(object):
+    """Heat schedule of a stat in day program mode"""
+    entrynames = list(DAY_FIELDS)
+
+class FakeStat(object):
+    """Stat keeping the fields written to it"""
+    def __init__(self, address):
+        self.address = address
+        self.name = 'Stat%i' % address
+        self.long_name = 'Room %i' % address
+        self.heat_schedule = FakeSchedule()
+        self.fields = {}
+        self.writes = []
+        self.garble = None
+        self.dead = False
+
+    def set_fields(self, names, values):
+        if self.dead:
+            raise IOError('no response')
+        self.writes.append(list(names))
+        self.fields.update(zip(names, values))
+
+    def read_fields(self, names, maxage):
+        return [None if name == self.garble else self.fields.get(name) for name in names]
+
+def sample_plan(temp=20, holiday_hours=0):
+    """Plan for today and tomorrow"""
+    return schedule_engine.Plan(
+        temp, False, holiday_hours,
+        [(SATURDAY, [(time(11), temp), (time(22), 15)]),
+         (SUNDAY, [(time(7), 19.6), (time(9), 40), (time(17), 18), (time(23), 4)])])
+
+class TestPlanFields(unittest.TestCase):
+    """Fields a plan is written as"""
+    def test_programs_in_local_time(self):
+        # 23:00 UTC on Saturday is 09:00 on Sunday for a stat ten hours ahead
+        utcnow = datetime(2018, 11, 10, 23, 0, tzinfo=timezone.utc)
+        targets = [{'time': utcnow + timedelta(hours=hours), 'temp': temp}
+                   for hours, temp in [(-1, 18), (2, 21), (12, 15)]]
+        plan = schedule_engine.plan(targets, utcnow.astimezone(timezone(timedelta(hours=10))))
+        fields, _ = plan_fields(plan, utcnow.timestamp())
+        self.assertEqual(fields['sun_heat'], [8, 0, 18, 11, 0, 21, 21, 0, 15, 24, 0, 12])
+        self.assertEqual(fields['sat_heat'], [24, 0, 12] * 4) # nothing left of Saturday
+
+    def test_programs(self):
+        fields, holiday_end = plan_fields(sample_plan(), NOW)
+        self.assertEqual(fields, {'runmode': 0, 'holidayhours': 0,
+                                  'sat_heat': [11, 0, 20, 22, 0, 15] + [24, 0, 12] * 2,
+                                  'sun_heat': [7, 0, 20, 9, 0, 35, 17, 0, 18, 23, 0, 5]})
+        self.assertEqual(holiday_end, 0)
+
+    def test_frost_and_holiday(self):
+        fields, holiday_end = plan_fields(schedule_engine.Plan(3, True, 0, []), NOW)
+        self.assertEqual(fields, {'runmode': 1, 'frosttemp': 7})
+        fields, holiday_end = plan_fields(sample_plan(12, 1000), NOW)
+        self.assertEqual((fields['holidayhours'], fields['frosttemp']), (720, 12))
+        self.assertEqual(holiday_end, NOW + 720 * 3600)
+        fields, _ = plan_fields(sample_plan(12, 50), NOW, day_program=False)
+        self.assertNotIn('sat_heat', fields)
+
+class TestScheduleWriter(unittest.TestCase):
+    """Writing only changed fields"""
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'schedule.written')
+        self.clock = FakeClock()
+        self.writer = ScheduleWriter(ScheduleCache(self.path), clock=self.clock)
+        self.stat = FakeStat(3)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_unchanged_plan_not_written(self):
+        self.assertEqual(self.writer.write(self.stat, sample_plan()), 4)
+        self.assertEqual(self.stat.writes, [['runmode', 'holidayhours', 'sat_heat', 'sun_heat']])
+        self.clock.now += 3600
+        self.assertEqual(self.writer.write(self.stat, sample_plan()), 0)
+        # a new writer picks up what was written from the cache file
+        writer = ScheduleWriter(ScheduleCache(self.path), clock=self.clock)
+        self.assertEqual(writer.write(self.stat, sample_plan()), 0)
+        self.assertEqual(len(self.stat.writes), 1)
+
+    def test_only_changed_fields_written(self):
+        self.writer.write(self.stat, sample_plan())
+        plan = sample_plan()
+        plan.days[1][1][0] = (time(7, 30), 19.6)
+        self.assertEqual(self.writer.write(self.stat, plan), 1)
+        self.assertEqual(self.stat.writes[-1], ['sun_heat'])
+
+    def test_holiday_written_when_end_moves(self):
+        self.writer.write(self.stat, sample_plan(12, 50))
+        self.assertEqual(self.stat.fields['holidayhours'], 50)
+        # counting down on the stat, so left alone while the end stays put
+        self.clock.now += 2 * 3600
+        self.assertEqual(self.writer.write(self.stat, sample_plan(12, 48)), 0)
+        self.assertEqual(self.writer.write(self.stat, sample_plan(12, 60)), 1)
+        self.assertEqual(self.stat.writes[-1], ['holidayhours'])
+        # back from holiday early
+        self.assertEqual(self.writer.write(self.stat, sample_plan(12)), 1)
+        self.assertEqual(self.stat.fields['holidayhours'], 0)
+
+    def test_unverified_fields_written_again(self):
+        self.stat.garble = 'sat_heat'
+        self.writer.write(self.stat, sample_plan())
+        self.stat.garble = None
+        self.assertEqual(self.writer.write(self.stat, sample_plan()), 1)
+        self.assertEqual(self.stat.writes[-1], ['sat_heat'])
+
+    def test_failed_write_forgotten(self):
+        self.writer.write(self.stat, sample_plan())
+        self.stat.dead = True
+        plan = sample_plan(21)
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(self.writer.write(self.stat, plan), 0)
+        self.assertEqual(self.writer.write_failures, 1)
+        self.stat.dead = False
+        self.assertEqual(self.writer.write(self.stat, plan), 4)
+
+    def test_find_device(self):
+        class Network(object):
+            controllers = [FakeStat(1), self.stat]
+        self.assertIs(find_device(Network, 'Stat3'), self.stat)
+        self.assertIs(find_device(Network, 'Room 3'), self.stat)
+        self.assertIsNone(find_device(Network, 'Hall'))
+
+if __name__ == '__main__':
+    unittest.main()
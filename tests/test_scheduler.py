@@ -0,0 +1,125 @@
+"""Unittests for src.scheduler module"""
+import unittest
+import os
+import signal
+import socket
+
+from emonreporter.scheduler import Scheduler
+
+class TestScheduler(unittest.TestCase):
+    """Timer, reader and signal dispatch tests"""
+    def setUp(self):
+        self.loop = Scheduler()
+        self.calls = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_timer_order(self):
+        self.loop.call_later(0.02, self.calls.append, 'second')
+        self.loop.call_later(0.01, self.calls.append, 'first')
+        self.loop.call_later(0.03, self.loop.stop)
+        self.loop.run()
+        self.assertEqual(self.calls, ['first', 'second'])
+
+    def test_repeating_and_cancel(self):
+        timer = self.loop.call_every(0.01, self.calls.append, 'tick')
+        self.loop.call_later(0.035, timer.cancel)
+        self.loop.call_later(0.06, self.loop.stop)
+        self.loop.run()
+        self.assertEqual(self.calls, ['tick'] * 3)
+
+    def test_reader(self):
+        reader, writer = socket.socketpair()
+        def _read():
+            self.calls.append(reader.recv(10))
+            self.loop.stop()
+        self.loop.add_reader(reader, _read)
+        writer.send(b'x')
+        self.loop.run()
+        self.loop.remove_reader(reader)
+        reader.close()
+        writer.close()
+        self.assertEqual(self.calls, [b'x'])
+
+    def test_signal(self):
+        previous = signal.getsignal(signal.SIGUSR1)
+        self.loop.add_signal_handler(signal.SIGUSR1, lambda signum: self.loop.stop())
+        self.loop.call_later(0.01, os.kill, os.getpid(), signal.SIGUSR1)
+        self.loop.call_later(5, self.calls.append, 'timeout')
+        self.loop.run()
+        signal.signal(signal.SIGUSR1, previous)
+        self.assertEqual(self.calls, [])
+
+class FakeClock(object):
+    """Clock that only moves when told to"""
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class TestSampling(unittest.TestCase):
+    """Phase alignment, overrun and catch up tests on a fake clock"""
+    def setUp(self):
+        self.clock = FakeClock()
+        self.wallclock = FakeClock(1600000003.0)
+        self.loop = Scheduler(clock=self.clock, wallclock=self.wallclock)
+        self.runs = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _advance(self, seconds):
+        """Move both clocks forward and run anything due"""
+        self.clock.now += seconds
+        self.wallclock.now += seconds
+        self.loop.run_once(timeout=0)
+
+    def _sample(self, duration=0.0):
+        self.runs.append(self.wallclock.now)
+        self.clock.now += duration
+        self.wallclock.now += duration
+
+    def test_aligned_to_wall_clock(self):
+        self.loop.call_every(10, self._sample, align=True)
+        self._advance(6.9)
+        self.assertEqual(self.runs, [])
+        self._advance(0.1)
+        self._advance(10)
+        self.assertEqual(self.runs, [1600000010.0, 1600000020.0])
+
+    def test_wall_clock_step_ignored(self):
+        self.loop.call_every(10, self._sample)
+        self.wallclock.now -= 3600
+        self._advance(10)
+        self._advance(10)
+        self.assertEqual(len(self.runs), 2)
+
+    def test_overrun_skips(self):
+        timer = self.loop.call_every(10, self._sample, 25)
+        self._advance(10)
+        self.assertEqual((timer.runs, timer.overruns, timer.skipped), (1, 1, 2))
+        self._advance(4.9)
+        self.assertEqual(len(self.runs), 1)
+        self._advance(0.1) # next slot, 30 s after the first
+        self.assertEqual(len(self.runs), 2)
+
+    def test_catch_up_limit(self):
+        timer = self.loop.call_every(10, self._sample, 25, catch_up=1)
+        self._advance(10)
+        self.assertEqual((timer.overruns, timer.skipped, timer.caught_up), (1, 1, 1))
+        self.loop.run_once(timeout=0) # late slot runs straight away
+        self.assertEqual(len(self.runs), 2)
+
+    def test_separate_intervals(self):
+        fast = self.loop.call_every(10, self.runs.append, 'fast', align=True)
+        slow = self.loop.call_every(60, self.runs.append, 'slow', align=True)
+        for _ in range(60):
+            self._advance(1)
+        self.assertEqual(self.runs.count('fast'), 6)
+        self.assertEqual(self.runs.count('slow'), 1)
+        self.assertEqual((fast.overruns, slow.overruns), (0, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""Unittests for src.spool module"""
+import unittest
+import os
+import shutil
+import tempfile
+
+from emonreporter.spool import FrameSpool
+
+class TestFrameSpool(unittest.TestCase):
+    """Append, drain, recovery and eviction tests"""
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _drain(self, framespool, batch_bytes=1024):
+        drained = []
+        while framespool.depth:
+            records, position = framespool.read_batch(batch_bytes)
+            drained.extend(records)
+            framespool.commit(position)
+        return drained
+
+    def test_fifo_drain(self):
+        framespool = FrameSpool(self.folder, segment_bytes=100, fsync=False)
+        frames = [(1000 + i, '18 %d 0' % i) for i in range(20)]
+        for read_time, frame in frames:
+            framespool.append(read_time, frame)
+        self.assertEqual(framespool.depth, 20)
+        self.assertEqual(self._drain(framespool, 30), frames)
+        framespool.close()
+
+    def test_restart_keeps_position(self):
+        framespool = FrameSpool(self.folder, segment_bytes=100, fsync=False)
+        for i in range(10):
+            framespool.append(i, 'frame %d' % i)
+        records, position = framespool.read_batch(20)
+        framespool.commit(position)
+        framespool.close()
+
+        reopened = FrameSpool(self.folder, segment_bytes=100, fsync=False)
+        self.assertEqual(reopened.depth, 10 - len(records))
+        self.assertEqual(self._drain(reopened)[0], (len(records), 'frame %d' % len(records)))
+
+    def test_partial_record_truncated(self):
+        framespool = FrameSpool(self.folder, fsync=False)
+        framespool.append(1, 'complete')
+        framespool.append(2, 'torn')
+        framespool.close()
+        segment = [name for name in os.listdir(self.folder) if name.endswith('.spool')][0]
+        path = os.path.join(self.folder, segment)
+        with open(path, 'r+b') as segfile:
+            segfile.truncate(os.path.getsize(path) - 2)
+
+        reopened = FrameSpool(self.folder, fsync=False)
+        self.assertEqual(self._drain(reopened), [(1, 'complete')])
+
+    def test_oldest_evicted(self):
+        framespool = FrameSpool(self.folder, max_bytes=200, segment_bytes=50, fsync=False)
+        for i in range(50):
+            framespool.append(i, 'frame %02d' % i)
+        self.assertLessEqual(framespool.size_bytes, 200)
+        self.assertGreater(framespool.evicted, 0)
+        drained = self._drain(framespool)
+        self.assertEqual(drained[-1], (49, 'frame 49'))
+        self.assertEqual(len(drained) + framespool.evicted, 50)
+        framespool.close()
+
+    def test_binary_frames(self):
+        framespool = FrameSpool(self.folder, fsync=False, binary=True)
+        frames = [(1, b'\x02\x00\x01\x12'), (2, b'\r\n\xff')]
+        for read_time, frame in frames:
+            framespool.append(read_time, frame)
+        self.assertEqual(self._drain(framespool), frames)
+        framespool.close()
+
+if __name__ == '__main__':
+    unittest.main()